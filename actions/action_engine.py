@@ -1,53 +1,169 @@
 """
 Action Engine - Rule-Based Recommendations
+
+Rules live in config.yaml (actions.rules). Each rule has an action_id,
+message, reason, priority and a `when` block mapping RFM columns to
+conditions:
+    segment: ["At Risk"]     # membership (a single string also works)
+    M: {min: 4}              # inclusive numeric bounds (min and/or max)
+A customer gets every action whose conditions all hold.
 """
+from collections.abc import Mapping
 from typing import List, Dict
 
-def get_recommended_actions(customer_id: str, 
-                          segment: str, 
-                          r: int, 
-                          f: int, 
-                          m: int, 
+import numpy as np
+import pandas as pd
+
+from pipeline.profiler import STAGES
+from features.rfm import column_bound
+
+ACTION_FIELDS = ['action_id', 'message', 'reason', 'priority']
+
+
+def _rules():
+    import config
+    return config.actions.rules
+
+
+def _condition_mask(values: pd.Series, cond) -> np.ndarray:
+    """Boolean mask for one `when` entry over a column."""
+    if isinstance(cond, Mapping):
+        mask = np.ones(len(values), dtype=bool)
+        lo, hi = cond.get('min'), cond.get('max')
+        arr = values.to_numpy()
+        if lo is not None:
+            mask &= arr >= column_bound(arr, lo)
+        if hi is not None:
+            mask &= arr <= column_bound(arr, hi)
+        return mask
+    if isinstance(cond, str):
+        cond = [cond]
+    return values.isin(list(cond)).to_numpy()
+
+
+def rule_mask(rfm: pd.DataFrame, rule) -> np.ndarray:
+    """Customers (rows of rfm) a single rule fires for."""
+    mask = np.ones(len(rfm), dtype=bool)
+    when = rule.get('when') or {}
+    for col in when:
+        if col not in rfm.columns:
+            # Rules on features this frame doesn't carry never fire
+            return np.zeros(len(rfm), dtype=bool)
+        mask &= _condition_mask(rfm[col], when[col])
+    return mask
+
+
+@STAGES.instrument("actions_evaluate", rows=len)
+def evaluate_actions(rfm: pd.DataFrame, rules=None) -> pd.DataFrame:
+    """
+    Evaluates every rule as a boolean mask over the whole RFM frame.
+
+    Returns one row per (customer, action) with columns customer_id,
+    action_id, segment, message, reason, priority, score. Rows are ordered
+    by customer, then rule order, like the per-customer loop produced.
+    """
+    rules = _rules() if rules is None else rules
+
+    positions, rule_ids = [], []
+    for i, rule in enumerate(rules):
+        pos = np.flatnonzero(rule_mask(rfm, rule))
+        positions.append(pos)
+        rule_ids.append(np.full(len(pos), i, dtype=np.int32))
+
+    if positions:
+        pos = np.concatenate(positions)
+        rid = np.concatenate(rule_ids)
+    else:
+        pos = np.empty(0, dtype=np.intp)
+        rid = np.empty(0, dtype=np.int32)
+
+    # Stable sort by customer keeps rule order within a customer
+    order = np.argsort(pos, kind='stable')
+    pos, rid = pos[order], rid[order]
+
+    # Rule attributes are gathered as categoricals (one code per rule)
+    fields = {}
+    for field in ACTION_FIELDS:
+        codes, uniques = pd.factorize(pd.Index([rule.get(field) for rule in rules], dtype=object))
+        fields[field] = pd.Categorical.from_codes(codes[rid], categories=uniques)
+
+    out = {
+        'action_id': fields['action_id'],
+        # take() keeps compact (categorical) ids and segments encoded
+        'customer_id': rfm.index.take(pos),
+        'segment': rfm['segment'].array.take(pos),
+        'message': fields['message'],
+        'reason': fields['reason'],
+        'priority': fields['priority'],
+        'score': rfm['rfm_score'].to_numpy()[pos],
+    }
+    return pd.DataFrame(out)
+
+
+@STAGES.instrument("actions_top_k", rows=len)
+def top_actions(actions: pd.DataFrame, k: int, priority_map: dict = None) -> pd.DataFrame:
+    """
+    Top-k actions by priority (per priority_map, unknown = 99), then score
+    (highest first), then original order. Uses a partial sort: only the
+    candidates that can make the cut are fully ordered.
+    """
+    if priority_map is None:
+        import config
+        priority_map = config.actions.priority_map
+
+    n = len(actions)
+    if n == 0 or k <= 0:
+        return actions.iloc[:0]
+
+    prio = _priority_ranks(actions['priority'], priority_map)
+    score = actions['score'].to_numpy(dtype=np.float64)
+
+    # Primary key sorts priority first, then higher score first
+    span = np.nanmax(score) - np.nanmin(score) + 1.0
+    key = prio * span + (np.nanmax(score) - score)
+
+    if k < n:
+        kth = np.partition(key, k - 1)[k - 1]
+        # Keep every tie at the boundary so the final order is deterministic
+        cand = np.flatnonzero(key <= kth)
+    else:
+        cand = np.arange(n)
+
+    order = np.lexsort((cand, -score[cand], prio[cand]))
+    return actions.iloc[cand[order][:k]]
+
+
+def _priority_ranks(priority: pd.Series, priority_map: dict) -> np.ndarray:
+    """Maps priority labels to ranks once per distinct label."""
+    codes, uniques = pd.factorize(priority.astype(object))
+    ranks = np.array([priority_map.get(p, 99) for p in uniques], dtype=np.float64)
+    return ranks[codes]
+
+
+@STAGES.instrument("get_recommended_actions", rows=len)
+def get_recommended_actions(customer_id: str,
+                          segment: str,
+                          r: int,
+                          f: int,
+                          m: int,
                           score: float) -> List[Dict]:
     """
     Returns a list of action objects based on segment and scores.
+    Single-customer wrapper around the configured rule table.
     """
+    row = pd.DataFrame(
+        {'segment': [segment], 'R': [r], 'F': [f], 'M': [m], 'rfm_score': [score]},
+        index=pd.Index([customer_id], name='customer_id'),
+    )
     actions = []
-    
-    # --- Rule 1: Retention ---
-    # IF segment == "At Risk" AND M >= 4
-    if segment == "At Risk" and m >= 4:
-        actions.append({
-            "action_id": "act_retention_001",
-            "customer_id": customer_id,
-            "segment": segment,
-            "message": "Offer retention incentive",
-            "reason": "High value customer showing declining activity",
-            "priority": "High"
-        })
-        
-    # --- Rule 2: Growth ---
-    # IF segment == "Potential Loyalists"
-    if segment == "Potential Loyalists":
-        actions.append({
-            "action_id": "act_growth_001",
-            "customer_id": customer_id,
-            "segment": segment,
-            "message": "Encourage repeat purchase",
-            "reason": "Recent customer with low frequency",
-            "priority": "Medium"
-        })
-        
-    # --- Rule 3: Loyalty ---
-    # IF segment == "Champions"
-    if segment == "Champions":
-        actions.append({
-            "action_id": "act_loyalty_001",
-            "customer_id": customer_id,
-            "segment": segment,
-            "message": "Reward loyalty",
-            "reason": "Top tier customer",
-            "priority": "Low" # Low urgency, but high importance relationship w.r.t maintenance
-        })
-        
+    for rule in _rules():
+        if rule_mask(row, rule)[0]:
+            actions.append({
+                "action_id": rule.get('action_id'),
+                "customer_id": customer_id,
+                "segment": segment,
+                "message": rule.get('message'),
+                "reason": rule.get('reason'),
+                "priority": rule.get('priority'),
+            })
     return actions
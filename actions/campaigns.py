@@ -0,0 +1,139 @@
+"""
+Campaign Summaries - exact per-campaign totals over every recommended action.
+
+A campaign is one (action_id, segment) pair of the action table. The table
+is sorted once by (campaign, score descending); counts, score statistics and
+histograms are bincounts over the campaign codes, quantiles and the top-N
+customers are gathers from the sorted order, and member listings are slices
+of it. Nothing is limited to the top-k slice /actions returns.
+"""
+import numpy as np
+import pandas as pd
+
+from pipeline.paging import widen_floats
+from pipeline.profiler import STAGES
+
+QUANTILES = {'p25': 0.25, 'median': 0.5, 'p75': 0.75}
+
+
+def _codes(values):
+    """(codes, labels); categoricals keep their category order (rule order for action_id)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype(np.int64), pd.Index(values.cat.categories, dtype=object)
+    codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+    return codes.astype(np.int64), pd.Index(uniques, dtype=object)
+
+
+class CampaignIndex:
+    def __init__(self, actions: pd.DataFrame, priority_map: dict = None):
+        if priority_map is None:
+            import config
+            priority_map = config.actions.priority_map
+        self.actions = actions
+        self._priority_map = priority_map
+
+        action_codes, self.action_ids = _codes(actions['action_id'])
+        segment_codes, self.segments = _codes(actions['segment'])
+        self._score = actions['score'].to_numpy(dtype=np.float64)
+        self._group = action_codes * len(self.segments) + segment_codes
+        n_groups = len(self.action_ids) * len(self.segments)
+
+        with STAGES.stage("campaign_index", rows=len(actions)):
+            # By campaign, then score high to low, then table order (lexsort is stable)
+            self._order = np.lexsort((-self._score, self._group))
+        self._counts = np.bincount(self._group, minlength=n_groups)
+        self._starts = np.concatenate(([0], np.cumsum(self._counts)))
+        sorted_group = self._group[self._order]
+        self._rank = np.arange(len(actions)) - self._starts[sorted_group]
+        self._by_action = {}
+
+    def __len__(self):
+        return len(self.actions)
+
+    def _campaign(self, action_id, segment):
+        a = self.action_ids.get_indexer([action_id])[0]
+        s = self.segments.get_indexer([segment])[0]
+        return None if a < 0 or s < 0 else a * len(self.segments) + s
+
+    def members(self, action_id, segment=None) -> np.ndarray:
+        """Rows of the action table for a campaign (or every segment of an action), best score first."""
+        if segment is not None:
+            g = self._campaign(action_id, segment)
+            if g is None:
+                return np.empty(0, dtype=np.intp)
+            return self._order[self._starts[g]:self._starts[g + 1]]
+
+        if action_id not in self._by_action:
+            a = self.action_ids.get_indexer([action_id])[0]
+            if a < 0:
+                return np.empty(0, dtype=np.intp)
+            n_seg = len(self.segments)
+            rows = self._order[self._starts[a * n_seg]:self._starts[(a + 1) * n_seg]]
+            # Merge the action's segments back into one score order
+            self._by_action[action_id] = rows[np.lexsort((rows, -self._score[rows]))]
+        return self._by_action[action_id]
+
+    def summaries(self, top_n: int = 10, score_bins: int = None) -> list:
+        """
+        One dict per campaign: action fields, exact customer count, score
+        min/mean/quartiles/max, a histogram over integer score bins
+        [k, k + 1) and the top_n customers by score. Ordered by priority
+        (config map), then rule order, then segment.
+        """
+        counts = self._counts
+        groups = np.flatnonzero(counts)
+        if not len(groups):
+            return []
+        n = counts[groups]
+        start = self._starts[groups]
+        ranked = self._score[self._order]
+
+        stats = {
+            'min': ranked[start + n - 1],
+            'max': ranked[start],
+            'mean': np.bincount(self._group, weights=self._score, minlength=len(counts))[groups] / n,
+        }
+        for name, q in QUANTILES.items():
+            # Descending order: the q-quantile sits (n - 1) * (1 - q) from the top
+            pos = (n - 1) * (1 - q)
+            lo, frac = np.floor(pos).astype(np.int64), pos - np.floor(pos)
+            hi = np.minimum(lo + 1, n - 1)
+            stats[name] = ranked[start + lo] * (1 - frac) + ranked[start + hi] * frac
+
+        # Histogram over integer score bins, one bincount for all campaigns
+        low = int(np.floor(self._score.min()))
+        if score_bins is None:
+            score_bins = int(np.floor(self._score.max())) - low + 1
+        bins = np.clip(np.floor(self._score).astype(np.int64) - low, 0, score_bins - 1)
+        hist = np.bincount(self._group * score_bins + bins,
+                           minlength=len(counts) * score_bins).reshape(len(counts), score_bins)
+
+        top = self._order[self._rank < top_n]
+        top_group = self._group[top]
+        # float32 scores (rfm.compact) widened to their short repr
+        top_rows = widen_floats(self.actions[['customer_id', 'score']].iloc[top])
+        top_ids = top_rows['customer_id'].to_numpy(dtype=object)
+        top_scores = top_rows['score'].to_numpy()
+
+        first = self.actions.iloc[self._order[start]]
+        out = []
+        for i, g in enumerate(groups):
+            mine = np.flatnonzero(top_group == g)
+            out.append({
+                'action_id': first['action_id'].iloc[i],
+                'segment': first['segment'].iloc[i],
+                'message': first['message'].iloc[i],
+                'reason': first['reason'].iloc[i],
+                'priority': first['priority'].iloc[i],
+                'customers': int(n[i]),
+                'score': {k: round(float(v[i]), 2) for k, v in stats.items()},
+                'score_histogram': [{'start': low + b, 'end': low + b + 1, 'customers': int(c)}
+                                    for b, c in enumerate(hist[g]) if c],
+                'top_customers': [{'customer_id': top_ids[j], 'score': float(top_scores[j])}
+                                  for j in mine],
+            })
+
+        rank = {a: i for i, a in enumerate(self.action_ids)}
+        out.sort(key=lambda c: (self._priority_map.get(c['priority'], 99), rank[c['action_id']],
+                                str(c['segment'])))
+        return out
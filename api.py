@@ -1,78 +1,350 @@
 """
 Single File API for Behavior Intelligence MVP
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import Annotated, List, Optional
 import pandas as pd
+import numpy as np
+import asyncio
+import atexit
+import functools
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Import core logic
-from features.rfm import calculate_rfm_scores
-from segmentation.rfm_segments import assign_segment
-from actions.action_engine import get_recommended_actions
+from actions.action_engine import evaluate_actions, top_actions
+from actions.campaigns import CampaignIndex
+from segmentation.rfm_segments import segment_counts, segment_profiles
+from features.rfm import column_bound
 from drift.segment_drift import calculate_drift
+from feedback.feedback_log import FeedbackWriter
+from feedback.analytics import FeedbackAnalytics
+from drift.snapshots import SnapshotStore, encode_labels, transition_matrix
+from pipeline.state import PipelineCache
+from storage.shared_frames import SharedFrameCache
+from pipeline import profiler
+from pipeline.profiler import STAGES, REQUESTS
+from pipeline.lookup import CustomerIndex
+from pipeline.revenue import RevenueCube
+from pipeline.scatter import StratifiedSampler, density_grid
+from pipeline.paging import (
+    encode_cursor, decode_cursor, scan_page, iter_blocks, ndjson_stream, arrow_stream, widen_floats
+)
 import config
 
 app = FastAPI(title=config.app.name)
 
-# --- In-Memory Data Store (Simplification for MVP) ---
-# In real prod, this logic sits in a service or DB
-def get_data_state():
-    # Load transactions
+profiler.configure(enabled=config.metrics.enabled, trace_memory=config.metrics.trace_memory)
+
+@app.middleware("http")
+async def _time_requests(request, call_next):
+    # Time to response headers; streamed bodies are not included
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUESTS.record(f"{request.method} {route.path if route else 'unmatched'}",
+                    time.perf_counter() - start)
+    return response
+
+# --- In-Memory Data Store ---
+# One shared pipeline run, rebuilt in the background when the
+# transactions file or config.yaml changes. With storage.shared_cache_dir
+# set, workers and the dashboard map one published copy of the frames.
+_shared_frames = (SharedFrameCache(config.storage.shared_cache_dir)
+                  if config.storage.get('shared_cache_dir') else None)
+_state_cache = PipelineCache(
+    config.data.transactions_file,
+    config.CONFIG_PATH,
+    on_config_change=config.reload,
+    shared=_shared_frames,
+)
+
+# Buffered, multi-worker-safe feedback log
+_feedback_writer = FeedbackWriter(
+    config.data.feedback_file,
+    config.feedback.archive_dir,
+    flush_interval=config.feedback.flush_interval_seconds,
+    max_batch=config.feedback.max_batch,
+    fsync=config.feedback.fsync,
+    rotate_bytes=config.feedback.rotate_bytes,
+)
+atexit.register(_feedback_writer.close)
+
+# Incrementally maintained effectiveness counters over the same log
+_feedback_analytics = FeedbackAnalytics(config.data.feedback_file, config.feedback.archive_dir)
+
+# Historical segment snapshots for drift
+_snapshots = SnapshotStore(config.drift.snapshots_dir)
+
+# CPU-heavy handler bodies run on this pool so the event loop stays free
+# for cheap requests like /feedback; its size caps concurrent pandas work
+_compute_pool = ThreadPoolExecutor(
+    max_workers=config.api.get('compute_workers') or os.cpu_count(),
+    thread_name_prefix="compute",
+)
+
+async def _offload(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_compute_pool, functools.partial(fn, *args, **kwargs))
+
+# --- Derived, per-state tables (built once per pipeline run) ---
+def _action_table(state):
+    return state.derived('actions', lambda s: evaluate_actions(s.rfm))
+
+def _ranked_actions(state):
+    # Full priority/score ordering, only built once someone pages past top_k
+    def build(s):
+        actions = _action_table(s)
+        return top_actions(actions, len(actions)).reset_index(drop=True)
+    return state.derived('ranked_actions', build)
+
+def _campaigns(state):
+    return state.derived('campaigns', lambda s: CampaignIndex(_action_table(s)))
+
+def _record_snapshot(state):
+    """
+    Today's date; the first pipeline state seen each day is recorded in the
+    snapshot store (checked once per state and day, so long-lived states
+    still record after midnight).
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    def save(s):
+        if config.drift.auto_snapshot and not _snapshots.has(today):
+            _snapshots.save(s.rfm, today)
+        return today
+
+    return state.derived(f'snapshot:{today}', save)
+
+def _live_labels(state):
+    return state.derived('snapshot_labels', lambda s: encode_labels(s.rfm, _snapshots))
+
+def _customer_index(state):
+    return state.derived('customer_index', lambda s: CustomerIndex(s.rfm, s.transactions))
+
+def _revenue_cube(state):
+    # Incremental builds hand the extended cube over, so this only runs after full builds
+    return state.derived('revenue_cube', lambda s: RevenueCube.build(s.transactions, s.rfm))
+
+def _sampler(state):
+    # Shuffled once per state; every sample size reuses it
+    return state.derived('sampler', lambda s: StratifiedSampler(s.rfm))
+
+# --- Response helpers ---
+FORMATS = ("json", "ndjson", "arrow")
+
+def _page_limit(limit):
+    limit = config.api.default_page_size if limit is None else limit
+    if not 1 <= limit <= config.api.max_page_size:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {config.api.max_page_size}")
+    return limit
+
+def _decode_cursor(cursor):
     try:
-        df = pd.read_csv(config.data.transactions_file)
-    except FileNotFoundError:
-        return None, None
-    
-    # Run Pipeline
-    rfm = calculate_rfm_scores(df)
-    rfm['segment'] = rfm.apply(lambda row: assign_segment(row['R'], row['F']), axis=1)
-    
-    return df, rfm
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _records(frame):
+    with STAGES.stage("serialization", rows=len(frame)):
+        return widen_floats(frame).to_dict(orient='records')
+
+def _respond(blocks, fmt, next_cursor=None, paged=False):
+    """
+    Serializes an iterable of frames as a JSON list / page envelope, or
+    streams it as NDJSON or Arrow (next page cursor in X-Next-Cursor).
+    """
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {FORMATS}")
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    if fmt == "ndjson":
+        return StreamingResponse(ndjson_stream(blocks), media_type="application/x-ndjson", headers=headers)
+    if fmt == "arrow":
+        try:
+            body = arrow_stream(blocks)
+        except ImportError:
+            raise HTTPException(status_code=406, detail="Arrow output requires pyarrow")
+        return StreamingResponse(body, media_type="application/vnd.apache.arrow.stream", headers=headers)
+
+    records = [row for chunk in blocks for row in _records(chunk)]
+    if paged:
+        return {"items": records, "next_cursor": next_cursor}
+    return records
 
 # --- Endpoints ---
 
 @app.get("/segments")
-def get_segments():
-    _, rfm = get_data_state()
+async def get_segments():
+    state = await _state_cache.get_async()
+    return await _offload(_segment_counts, state)
+
+def _segment_counts(state):
+    rfm = state.rfm
     if rfm is None:
         return {"error": "No data found"}
         
-    counts = rfm['segment'].value_counts().to_dict()
+    counts = segment_counts(rfm)
     return counts
 
+@app.get("/segment-profiles")
+async def get_segment_profiles(active_days: int = 30):
+    """
+    Per segment: customers, customers active within active_days, revenue
+    and mean recency/frequency/monetary/R/F/M/rfm_score. Sum the rows for
+    base-wide KPIs.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_segment_profiles, state, active_days)
+
+def _segment_profiles(state, active_days):
+    if state.rfm is None:
+        return []
+    profiles = state.derived(f'segment_profiles:{active_days}',
+                             lambda s: segment_profiles(s.rfm, active_days))
+    return _records(profiles.reset_index())
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    return _state_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Stage and request timings, rows and memory in Prometheus text format."""
+    cache = _state_cache.stats()
+    lines = ["# HELP analytix_pipeline_cache_events_total Pipeline cache lookups by outcome.",
+             "# TYPE analytix_pipeline_cache_events_total counter"]
+    for event in ("hits", "misses", "coalesced", "rebuilds", "attaches", "rebuild_errors"):
+        lines.append(f'analytix_pipeline_cache_events_total{{event="{event}"}} {cache[event]}')
+    if _shared_frames is not None and (current := _shared_frames.current()):
+        lines += ["# HELP analytix_shared_frames_version Published shared frame version.",
+                  "# TYPE analytix_shared_frames_version gauge",
+                  f"analytix_shared_frames_version {current['version']}"]
+    body = STAGES.prometheus() + REQUESTS.prometheus() + profiler.process_metrics() + "\n".join(lines) + "\n"
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 @app.get("/actions")
-def get_actions():
-    _, rfm = get_data_state()
-    if rfm is None:
+async def get_actions(
+    segment: Annotated[Optional[List[str]], Query()] = None,
+    priority: Annotated[Optional[List[str]], Query()] = None,
+    action_id: Annotated[Optional[List[str]], Query()] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fmt: Annotated[str, Query(alias="format")] = "json",
+):
+    """
+    Recommended actions ordered by priority (config map), then score.
+    Without limit/cursor the top actions.top_k are returned as a list
+    (or, for ndjson/arrow, every matching action is streamed).
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_actions_response, state, segment, priority, action_id, limit, cursor, fmt)
+
+def _actions_response(state, segment, priority, action_id, limit, cursor, fmt):
+    if state.rfm is None:
         return []
-    
-    all_actions = []
-    
-    # Generate actions for all customers
-    # (In real world, paginate or filter)
-    for _, row in rfm.iterrows():
-        # Get actions for this customer
-        acts = get_recommended_actions(
-            customer_id=row.name, # index is customer_id
-            segment=row['segment'],
-            r=row['R'],
-            f=row['F'],
-            m=row['M'],
-            score=row['rfm_score']
-        )
-        # Inject score into action objects for UI display
-        for a in acts:
-            a['score'] = row['rfm_score']
-            
-        all_actions.extend(acts)
-        
-    # Sort by priority using config map
-    p_map = config.actions.priority_map
-    all_actions.sort(key=lambda x: p_map.get(x['priority'], 99))
-    
-    return all_actions[:200]  # Return top 200 for UI
+
+    filters = {'segment': segment, 'priority': priority, 'action_id': action_id}
+    filters = {k: v for k, v in filters.items() if v}
+    paged = limit is not None or cursor is not None
+
+    if not filters and not paged and fmt == "json":
+        # All rules evaluated as masks over the whole frame, then a partial
+        # sort picks the top-k by priority (config map) and score
+        top = top_actions(_action_table(state), config.actions.top_k)
+        return _records(top)
+
+    def mask_fn(chunk):
+        mask = np.ones(len(chunk), dtype=bool)
+        for col, allowed in filters.items():
+            mask &= chunk[col].isin(allowed).to_numpy()
+        return mask
+
+    ranked = _ranked_actions(state)
+    mask = mask_fn if filters else None
+
+    if not paged:
+        if fmt == "json":
+            positions, _ = scan_page(ranked, 0, config.actions.top_k, mask)
+            return _respond([ranked.iloc[positions]], fmt)
+        return _respond(iter_blocks(ranked, mask), fmt)
+
+    # Positional cursor into this pipeline run's ranking
+    start = 0
+    if cursor:
+        payload = _decode_cursor(cursor)
+        if payload.get('v') != state.version:
+            raise HTTPException(status_code=409, detail="Cursor is from an older data version; restart paging")
+        start = int(payload.get('pos', 0))
+
+    positions, next_start = scan_page(ranked, start, _page_limit(limit), mask)
+    next_cursor = encode_cursor({'pos': int(next_start), 'v': state.version}) if next_start is not None else None
+    return _respond([ranked.iloc[positions]], fmt, next_cursor, paged=True)
+
+@app.get("/campaigns")
+async def get_campaigns(
+    top_n: int = 10,
+    priority: Annotated[Optional[List[str]], Query()] = None,
+    segment: Annotated[Optional[List[str]], Query()] = None,
+):
+    """
+    One summary per campaign (action_id x segment) over all recommended
+    actions: exact customer count, score stats and histogram, and the
+    top_n customers by score. Ordered by priority, then rule order.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_campaign_summaries, state, top_n, priority, segment)
+
+def _campaign_summaries(state, top_n, priority, segment):
+    if state.rfm is None:
+        return []
+    if not 0 <= top_n <= config.api.max_page_size:
+        raise HTTPException(status_code=400,
+                            detail=f"top_n must be between 0 and {config.api.max_page_size}")
+    with STAGES.stage("campaign_summaries"):
+        summaries = _campaigns(state).summaries(top_n)
+    return [c for c in summaries
+            if (not priority or c['priority'] in priority) and (not segment or c['segment'] in segment)]
+
+@app.get("/campaigns/{action_id}/members")
+async def get_campaign_members(
+    action_id: str,
+    segment: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fmt: Annotated[str, Query(alias="format")] = "json",
+):
+    """
+    Customers an action is recommended for (one segment's campaign, or all
+    of them), best score first, as {items, next_cursor} pages.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_campaign_members, state, action_id, segment, limit, cursor, fmt)
+
+def _campaign_members(state, action_id, segment, limit, cursor, fmt):
+    if state.rfm is None:
+        return {"items": [], "next_cursor": None}
+    index = _campaigns(state)
+    rows = index.members(action_id, segment)
+    if not len(rows) and action_id not in index.action_ids:
+        raise HTTPException(status_code=404, detail=f"Unknown action {action_id}")
+
+    # Positional cursor into this pipeline run's ordering, as for /actions
+    start = 0
+    if cursor:
+        payload = _decode_cursor(cursor)
+        if payload.get('v') != state.version:
+            raise HTTPException(status_code=409, detail="Cursor is from an older data version; restart paging")
+        start = int(payload.get('pos', 0))
+
+    end = start + _page_limit(limit)
+    page = index.actions.iloc[rows[start:end]][['customer_id', 'segment', 'score']]
+    next_cursor = encode_cursor({'pos': end, 'v': state.version}) if end < len(rows) else None
+    return _respond([page], fmt, next_cursor, paged=True)
 
 class FeedbackItem(BaseModel):
     action_id: str
@@ -84,66 +356,342 @@ class BatchFeedbackItem(BaseModel):
     items: list[FeedbackItem]
 
 @app.post("/feedback")
-def save_feedback(item: FeedbackItem):
-    _save_feedback_rows([item.dict()])
+async def save_feedback(item: FeedbackItem):
+    await _save_feedback_rows([item.dict()])
     return {"status": "saved"}
 
 @app.post("/feedback/batch")
-def save_batch_feedback(batch: BatchFeedbackItem):
+async def save_batch_feedback(batch: BatchFeedbackItem):
     rows = [item.dict() for item in batch.items]
-    _save_feedback_rows(rows)
+    await _save_feedback_rows(rows)
     return {"status": "batch saved", "count": len(rows)}
 
-def _save_feedback_rows(rows: list):
-    file_path = config.data.feedback_file
-    clean_rows = []
-    
-    for r in rows:
-        clean_rows.append({
-            'action_id': r['action_id'],
-            'segment': r['segment'],
-            'applied': r['applied'],
-            'outcome': r.get('outcome', 'unknown'),
-            'timestamp': datetime.now().isoformat()
-        })
-        
-    df = pd.DataFrame(clean_rows)
-    
-    if not os.path.exists(file_path):
-        df.to_csv(file_path, index=False)
+@app.get("/feedback/stats")
+async def get_feedback_stats():
+    return {**_feedback_writer.stats(), "analytics": _feedback_analytics.stats()}
+
+def _feedback_window(window_days, from_date, to_date):
+    if window_days is not None:
+        from_date = (pd.Timestamp.now().normalize() - pd.Timedelta(days=window_days - 1)).strftime("%Y-%m-%d")
+    try:
+        return (pd.Timestamp(from_date) if from_date else None,
+                pd.Timestamp(to_date) if to_date else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/feedback/effectiveness")
+async def get_feedback_effectiveness(
+    group_by: str = "action_id,segment",
+    window_days: Optional[int] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    freq: Optional[str] = None,
+):
+    """
+    Apply rate (applied / shown) and positive-outcome rate (positive /
+    applied) per group_by (comma-separated: action_id, segment). Window:
+    last window_days days, or from_date/to_date (YYYY-MM-DD, inclusive).
+    freq (D, W, M) splits the window into periods.
+    """
+    keys = [k.strip() for k in group_by.split(',') if k.strip()]
+    bad = [k for k in keys if k not in ('action_id', 'segment')]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"Cannot group by {bad}")
+    start, end = _feedback_window(window_days, from_date, to_date)
+    return await _offload(_effectiveness_records, keys, start, end, freq)
+
+def _effectiveness_records(keys, start, end, freq):
+    _feedback_analytics.refresh()
+    try:
+        stats = _feedback_analytics.effectiveness(keys, start, end, freq)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    stats = stats.astype(object).where(stats.notna(), None)
+    return stats.to_dict(orient='records')
+
+@app.get("/feedback/priorities")
+async def get_feedback_priorities(window_days: Optional[int] = None,
+                                  min_applied: Optional[int] = None):
+    """Priority per action_id suggested by observed positive-outcome rates."""
+    start, end = _feedback_window(window_days, None, None)
+    return await _offload(_priority_suggestions, start, end, min_applied)
+
+def _priority_suggestions(start, end, min_applied):
+    _feedback_analytics.refresh()
+    if min_applied is None:
+        min_applied = config.feedback.get('min_applied_for_priority', 20)
+    priority_map = config.actions.get('priority_map')
+    levels = tuple(sorted(priority_map, key=priority_map.get))
+    return {
+        "suggested": _feedback_analytics.suggested_priorities(min_applied, levels, start, end),
+        "configured": {r.get('action_id'): r.get('priority') for r in config.actions.rules},
+    }
+
+async def _save_feedback_rows(rows: list):
+    # Buffered; a background thread appends to the log (see feedback/feedback_log.py)
+    if _feedback_writer.fsync == "always":
+        # submit() waits for the fsync; do that off the event loop
+        await asyncio.to_thread(_feedback_writer.submit, rows)
     else:
-        df.to_csv(file_path, mode='a', header=False, index=False)
+        _feedback_writer.submit(rows)
+
+def _drift_pair(state, from_date, to_date, window_days):
+    """
+    Resolves which two periods to compare. Returns (previous_date, to_date)
+    where to_date None means the live pipeline state.
+    """
+    known = set(_snapshots.dates())
+    for d in (from_date, to_date):
+        if d is not None and d not in known:
+            raise HTTPException(status_code=404, detail=f"No snapshot for {d}")
+
+    if to_date is None:
+        today = _record_snapshot(state)
+    else:
+        today = to_date
+    if from_date is None:
+        window = config.drift.window_days if window_days is None else window_days
+        from_date = _snapshots.latest_before(today, window)
+    return from_date, to_date
 
 @app.get("/drift")
-def get_drift():
-    # Mocking 'previous' state for demo purposes as we don't have historical snapshots yet
-    # In real app, load yesterday's stats from file/DB
-    
-    current_counts = get_segments()
-    if "error" in current_counts:
+async def get_drift(from_date: Optional[str] = None, to_date: Optional[str] = None,
+                    window_days: Optional[int] = None):
+    """
+    Segment share changes between two snapshot dates (YYYY-MM-DD). By
+    default the live state is compared with the latest snapshot at least
+    drift.window_days old; [] if there is no such history yet.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_drift_records, state, from_date, to_date, window_days)
+
+def _drift_records(state, from_date, to_date, window_days):
+    if state.rfm is None:
         return []
-        
-    # Mock previous (just perturb current slightly)
-    import random
-    prev_counts = {k: max(0, v + random.randint(-5, 5)) for k,v in current_counts.items()}
-    
+
+    prev_date, to_date = _drift_pair(state, from_date, to_date, window_days)
+    if prev_date is None:
+        return []
+
+    if to_date is None:
+        current_counts = segment_counts(state.rfm)
+    else:
+        current_counts = _snapshots.counts(to_date)
+    prev_counts = _snapshots.counts(prev_date)
+
     drift_df = calculate_drift(current_counts, prev_counts)
     return drift_df.to_dict(orient='records')
 
+@app.get("/drift/transitions")
+async def get_drift_transitions(from_date: Optional[str] = None, to_date: Optional[str] = None,
+                                window_days: Optional[int] = None):
+    """
+    Customer-level segment transition counts between two periods (same
+    period selection as /drift). Only non-zero cells are returned.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_transition_records, state, from_date, to_date, window_days)
+
+def _transition_records(state, from_date, to_date, window_days):
+    if state.rfm is None:
+        return []
+
+    prev_date, to_date = _drift_pair(state, from_date, to_date, window_days)
+    if prev_date is None:
+        return []
+
+    current = _live_labels(state) if to_date is None else _snapshots.load(to_date)
+    matrix = transition_matrix(_snapshots.load(prev_date), current)
+    cells = matrix.stack().rename('customers').reset_index()
+    cells = cells[cells['customers'] > 0]
+    return cells.to_dict(orient='records')
+
+@app.get("/drift/snapshots")
+async def get_drift_snapshots():
+    manifest = await _offload(_snapshots.manifest)
+    return [{"date": d, "customers": manifest[d]["customers"], "counts": manifest[d]["counts"]}
+            for d in sorted(manifest)]
+
 @app.get("/rfm-details")
-def get_rfm_details():
-    _, rfm = get_data_state()
+async def get_rfm_details(
+    segment: Annotated[Optional[List[str]], Query()] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    min_recency: Optional[int] = None,
+    max_recency: Optional[int] = None,
+    columns: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fmt: Annotated[str, Query(alias="format")] = "json",
+):
+    """
+    Per-customer RFM rows, ordered by customer_id.
+
+    Filters: segment (repeatable), score and recency bounds (inclusive).
+    columns: comma-separated subset (customer_id is always included).
+    With limit/cursor the JSON response is {"items", "next_cursor"};
+    format=ndjson/arrow streams rows instead of building one JSON blob.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_rfm_details_response, state.rfm, segment, min_score, max_score,
+                          min_recency, max_recency, columns, limit, cursor, fmt)
+
+def _rfm_details_response(rfm, segment, min_score, max_score, min_recency, max_recency,
+                          columns, limit, cursor, fmt):
     if rfm is None:
         return []
-    return rfm.reset_index().to_dict(orient='records')
+
+    paged = limit is not None or cursor is not None
+    bounds = [('rfm_score', min_score, max_score), ('recency', min_recency, max_recency)]
+    bounds = [b for b in bounds if b[1] is not None or b[2] is not None]
+
+    if not (segment or bounds or columns or paged) and fmt == "json":
+        return _records(rfm.reset_index())
+
+    cols = list(rfm.columns)
+    if columns:
+        cols = [c.strip() for c in columns.split(',') if c.strip() and c.strip() != rfm.index.name]
+        unknown = sorted(set(cols) - set(rfm.columns))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown columns: {unknown}")
+
+    def mask_fn(chunk):
+        mask = np.ones(len(chunk), dtype=bool)
+        if segment:
+            mask &= chunk['segment'].isin(segment).to_numpy()
+        for col, lo, hi in bounds:
+            values = chunk[col].to_numpy()
+            if lo is not None:
+                mask &= values >= column_bound(values, lo)
+            if hi is not None:
+                mask &= values <= column_bound(values, hi)
+        return mask
+
+    mask = mask_fn if (segment or bounds) else None
+
+    if not paged:
+        return _respond((c[cols].reset_index() for c in iter_blocks(rfm, mask)), fmt)
+
+    # Keyset cursor: the last customer_id returned (index is sorted)
+    start = 0
+    if cursor:
+        start = _keyset_start(rfm.index, _decode_cursor(cursor).get('after'))
+
+    positions, next_start = scan_page(rfm, start, _page_limit(limit), mask)
+    page = rfm.iloc[positions]
+    next_cursor = None
+    if next_start is not None and len(page):
+        next_cursor = encode_cursor({'after': page.index[-1]})
+    return _respond([page[cols].reset_index()], fmt, next_cursor, paged=True)
+
+def _keyset_start(index, after):
+    """Position just past customer `after` in the id-sorted RFM index."""
+    if isinstance(index, pd.CategoricalIndex):
+        # Compact ids: codes follow the dictionary order, not the sort order
+        pos = index.get_indexer([after])[0]
+        if pos >= 0:
+            return int(pos) + 1
+        index = pd.Index(np.asarray(index, dtype=object))  # `after` is gone; rare
+    return int(index.searchsorted(after, side='right'))
+
+MAX_SCATTER_BINS = 200
+
+@app.get("/rfm-density")
+async def get_rfm_density(
+    x: str = "recency",
+    y: str = "frequency",
+    bins: int = 40,
+    segment: Annotated[Optional[List[str]], Query()] = None,
+):
+    """
+    Customers per (segment, x bin, y bin) cell with monetary sum/mean, for
+    scatter plots that stay small however many customers there are.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_rfm_density, state.rfm, x, y, bins, segment)
+
+def _rfm_density(rfm, x, y, bins, segment):
+    if rfm is None:
+        return []
+    if not 1 <= bins <= MAX_SCATTER_BINS:
+        raise HTTPException(status_code=400, detail=f"bins must be between 1 and {MAX_SCATTER_BINS}")
+    numeric = [c for c in rfm.columns if c != 'segment' and rfm[c].dtype.kind in 'iuf']
+    for col in (x, y):
+        if col not in numeric:
+            raise HTTPException(status_code=400, detail=f"Cannot bin on {col!r}; use one of {numeric}")
+    if segment:
+        rfm = rfm[rfm['segment'].isin(segment).to_numpy()]
+    return _records(density_grid(rfm, x, y, bins))
+
+@app.get("/rfm-sample")
+async def get_rfm_sample(
+    size: int = 5000,
+    segment: Annotated[Optional[List[str]], Query()] = None,
+):
+    """
+    Random customers, stratified by segment (each keeps its share, and at
+    least one point). Reproducible for a given pipeline state.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_rfm_sample, state, size, segment)
+
+def _rfm_sample(state, size, segment):
+    if state.rfm is None:
+        return []
+    if not 1 <= size <= config.api.max_page_size:
+        raise HTTPException(status_code=400,
+                            detail=f"size must be between 1 and {config.api.max_page_size}")
+    return _records(_sampler(state).sample(size, segment).reset_index())
+
+@app.get("/customers/{customer_id}")
+async def get_customer(customer_id: str, transactions: int = 10):
+    """
+    One customer's RFM scores, segment, recommended actions and most recent
+    transactions, served from a hash index over the cached pipeline state.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_customer_profile, state, customer_id, transactions)
+
+def _customer_profile(state, customer_id, transactions):
+    if state.rfm is None:
+        raise HTTPException(status_code=404, detail="No data found")
+
+    index = _customer_index(state)
+    pos = index.position(customer_id)
+    if pos is None:
+        raise HTTPException(status_code=404, detail=f"Customer {customer_id} not found")
+
+    row = state.rfm.iloc[[pos]]
+    profile = _records(row.reset_index())[0]
+    profile['actions'] = _records(evaluate_actions(row))
+
+    recent = index.customer_transactions(pos, limit=max(transactions, 0))
+    recent = recent.drop(columns=['customer_id']).assign(date=recent['date'].map(lambda d: d.isoformat()))
+    profile['transaction_count'] = index.transaction_count(pos)
+    profile['recent_transactions'] = _records(recent)
+    return profile
 
 @app.get("/revenue-trends")
-def get_revenue_trends():
-    df, _ = get_data_state()
-    if df is None:
+async def get_revenue_trends(
+    granularity: str = "day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    segment: Annotated[Optional[List[str]], Query()] = None,
+    by_segment: bool = False,
+):
+    """
+    Revenue and transaction counts per day/week/month, optionally within
+    [start, end], for some segments (repeatable), or split by segment.
+    Served from the pre-aggregated revenue cube of the current state.
+    """
+    state = await _state_cache.get_async()
+    return await _offload(_revenue_trends, state, granularity, start, end, segment, by_segment)
+
+def _revenue_trends(state, granularity="day", start=None, end=None, segment=None, by_segment=False):
+    if state.transactions is None:
         return []
-    df['date'] = pd.to_datetime(df['date'])
-    daily_rev = df.groupby(df['date'].dt.date)['amount'].sum().reset_index()
-    daily_rev.columns = ['date', 'revenue']
-    daily_rev['date'] = daily_rev['date'].apply(lambda x: x.isoformat())
-    return daily_rev.to_dict(orient='records')
+    try:
+        frame = _revenue_cube(state).query(granularity, start, end, segment, by_segment)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _records(frame)
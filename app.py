@@ -1,6 +1,7 @@
 """
 Multi-Tab Dashboard - Action Center & Analytics Deep Dive
 """
+import asyncio
 import sys
 from pathlib import Path
 
@@ -10,14 +11,28 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 import streamlit as st
 import pandas as pd
 import altair as alt
-import plotly.express as px
 import config
 import api  # DIRECT IMPORT
+from pipeline.profiler import STAGES
 
 # API_URL - No longer needed for logic, but maybe for reference if needed
 # API_URL = config.dashboard.api_url
 
 st.set_page_config(page_title=config.app.name, layout="wide")
+config.sync_streamlit_theme()
+
+# Score scale for R/F/M (5 = quintiles)
+RFM_BINS = config.rfm.get('bins', 5)
+
+# Customers listed per Action Center card (counts cover everyone)
+CAMPAIGN_TOP_N = config.dashboard.get('campaign_top_n', 50)
+
+# Segmentation Matrix payload bounds
+SCATTER_BINS = config.dashboard.get('scatter_bins', 40)
+SCATTER_SAMPLE = config.dashboard.get('scatter_sample', 5000)
+
+# Customer Inventory rows per page (fetched with a cursor, never the full table)
+INVENTORY_PAGE_SIZE = config.dashboard.get('inventory_page_size', 500)
 
 # Set dynamic Plotly template
 PLOTLY_TEMPLATE = "plotly_dark" if config.dashboard.theme.lower() == "dark" else "plotly_white"
@@ -32,23 +47,64 @@ def fetch_data(endpoint):
     """
     Directly calls API functions instead of HTTP requests.
     This simulates the API layer within the Streamlit process.
+    Handlers are async, so each call runs on its own short-lived event loop.
     """
     try:
         if endpoint == "actions":
-            return api.get_actions()
+            return asyncio.run(api.get_actions())
         elif endpoint == "segments":
-            return api.get_segments()
+            return asyncio.run(api.get_segments())
         elif endpoint == "drift":
-            return api.get_drift()
-        elif endpoint == "rfm-details":
-            return api.get_rfm_details()
+            return asyncio.run(api.get_drift())
+        elif endpoint == "segment-profiles":
+            return asyncio.run(api.get_segment_profiles())
+        elif endpoint == "campaigns":
+            return asyncio.run(api.get_campaigns(top_n=CAMPAIGN_TOP_N))
         elif endpoint == "revenue-trends":
-            return api.get_revenue_trends()
+            return asyncio.run(api.get_revenue_trends())
+        return None
+    except Exception as e:
+        st.error(f"Data fetch error: {e}")
+        return None
+
+@st.cache_data(ttl=60)
+def fetch_revenue(granularity="day"):
+    """Revenue per day/week/month from the pre-aggregated cube."""
+    try:
+        return asyncio.run(api.get_revenue_trends(granularity=granularity))
+    except Exception as e:
+        st.error(f"Data fetch error: {e}")
         return None
+
+@st.cache_data(ttl=60)
+def fetch_scatter(view, n):
+    """Density cells (n bins per axis) or a stratified sample of n customers."""
+    try:
+        if view == "density":
+            return asyncio.run(api.get_rfm_density(bins=n))
+        return asyncio.run(api.get_rfm_sample(size=n))
+    except Exception as e:
+        st.error(f"Data fetch error: {e}")
+        return None
+
+@st.cache_data(ttl=60)
+def fetch_rfm_page(segment, cursor):
+    """One page of per-customer rows ({items, next_cursor}), optionally one segment."""
+    try:
+        return asyncio.run(api.get_rfm_details(segment=[segment] if segment else None,
+                                               limit=INVENTORY_PAGE_SIZE, cursor=cursor))
     except Exception as e:
         st.error(f"Data fetch error: {e}")
         return None
 
+@st.cache_data(ttl=60)
+def fetch_customer(customer_id):
+    """Single-customer profile via the API's indexed lookup; None if unknown."""
+    try:
+        return asyncio.run(api.get_customer(customer_id))
+    except api.HTTPException:
+        return None
+
 # --- Main Layout ---
 st.title("Behavior Intelligence Platform")
 
@@ -60,11 +116,9 @@ tab1, tab2, tab3 = st.tabs(["🎯 Action Center", "📊 KPI Dashboard", "📈 An
 with tab1:
     st.subheader("🏁 Priority Activity Board")
     
-    actions_raw = fetch_data("actions")
+    campaigns_raw = fetch_data("campaigns")
     
-    if actions_raw:
-        actions_df = pd.DataFrame(actions_raw)
-        
+    if campaigns_raw:
         # 3 Column Layout
         cols = st.columns(3)
         priorities = ["High", "Medium", "Low"]
@@ -73,26 +127,23 @@ with tab1:
             with cols[idx]:
                 st.info(f"**{priority} Priority**")
                 
-                # Filter for this priority column
-                priority_subset = actions_df[actions_df['priority'] == priority]
+                # Campaign summaries for this priority column (exact counts, server-side)
+                campaigns = [c for c in campaigns_raw if c['priority'] == priority]
                 
-                if priority_subset.empty:
+                if not campaigns:
                     st.caption("No pending actions.")
                 else:
-                    # Group by Campaign
-                    campaigns = priority_subset.groupby(['action_id', 'message', 'segment', 'reason']).size().reset_index(name='count')
-                    
-                    for _, camp in campaigns.iterrows():
+                    for camp in campaigns:
                         # Create a Card-like container
                         with st.container(border=True):
                             st.markdown(f"**{camp['message']}**")
-                            st.caption(f"🎯 {camp['segment']} • {camp['count']} users")
+                            st.caption(f"🎯 {camp['segment']} • {camp['customers']:,} users")
                             
-                            # Filter customers for this specific campaign card
-                            camp_customers = priority_subset[
-                                (priority_subset['action_id'] == camp['action_id']) & 
-                                (priority_subset['segment'] == camp['segment'])
-                            ]
+                            # Top customers of this campaign by score
+                            camp_customers = pd.DataFrame(camp['top_customers'], columns=['customer_id', 'score'])
+                            if camp['customers'] > len(camp_customers):
+                                st.caption(f"Top {len(camp_customers)} by RFM score "
+                                           f"(median {camp['score']['median']:.2f})")
                             
                             # Compact Data Editor
                             # Just show ID and Score + Select
@@ -116,7 +167,7 @@ with tab1:
                             b_col1, b_col2 = st.columns(2)
                             selected_rows = edited_df[edited_df['Select']]
                             
-                            if b_col1.button("✅ Apply", key=f"btn_apply_{camp['action_id']}", use_container_width=True):
+                            if b_col1.button("✅ Apply", key=f"btn_apply_{camp['action_id']}_{camp['segment']}", use_container_width=True):
                                 if not selected_rows.empty:
                                     # Construct FeedbackItem objects
                                     items = [
@@ -129,14 +180,14 @@ with tab1:
                                     ]
                                     
                                     # Call API directly
-                                    api.save_batch_feedback(api.BatchFeedbackItem(items=items))
+                                    asyncio.run(api.save_batch_feedback(api.BatchFeedbackItem(items=items)))
                                     
                                     st.toast(f"Applied {len(selected_rows)} actions")
                                     st.rerun()
                                 else:
                                     st.warning("Select users first")
 
-                            if b_col2.button("❌ Ignore", key=f"btn_ignore_{camp['action_id']}", use_container_width=True):
+                            if b_col2.button("❌ Ignore", key=f"btn_ignore_{camp['action_id']}_{camp['segment']}", use_container_width=True):
                                 if not selected_rows.empty:
                                     items = [
                                         api.FeedbackItem(
@@ -147,7 +198,7 @@ with tab1:
                                         for _, row in selected_rows.iterrows()
                                     ]
                                     
-                                    api.save_batch_feedback(api.BatchFeedbackItem(items=items))
+                                    asyncio.run(api.save_batch_feedback(api.BatchFeedbackItem(items=items)))
                                     
                                     st.toast(f"Ignored {len(selected_rows)} actions")
                                     st.rerun()
@@ -205,19 +256,19 @@ with tab1:
 with tab2:
     st.header("🔑 Key Performance Indicators")
     
-    rfm_details = fetch_data("rfm-details")
-    revenue_data = fetch_data("revenue-trends")
+    # Per-segment aggregates; base-wide KPIs are their sums
+    profiles = fetch_data("segment-profiles")
     
-    if rfm_details:
-        details_df = pd.DataFrame(rfm_details)
+    if profiles:
+        profiles_df = pd.DataFrame(profiles)
         
         # Row 1: Big Metrics
         k1, k2, k3, k4 = st.columns(4)
         
-        total_customers = len(details_df)
-        active_customers = len(details_df[details_df['recency'] < 30])
-        total_revenue = details_df['monetary'].sum()
-        avg_score = details_df['rfm_score'].mean()
+        total_customers = int(profiles_df['customers'].sum())
+        active_customers = int(profiles_df['active_customers'].sum())
+        total_revenue = profiles_df['revenue'].sum()
+        avg_score = (profiles_df['rfm_score'] * profiles_df['customers']).sum() / total_customers
         
         k1.metric("Total Customers", f"{total_customers:,}")
         k2.metric("Active Users (30d)", f"{active_customers:,}", delta=f"{active_customers/total_customers:.1%} of base")
@@ -231,6 +282,9 @@ with tab2:
         
         with c1:
             st.subheader("💰 Revenue Growth")
+            granularity = st.radio("Granularity", ["day", "week", "month"],
+                                   horizontal=True, label_visibility="collapsed")
+            revenue_data = fetch_revenue(granularity)
             if revenue_data:
                 rev_df = pd.DataFrame(revenue_data)
                 rev_df['date'] = pd.to_datetime(rev_df['date'])
@@ -255,9 +309,9 @@ with tab2:
         with c2:
             st.subheader("👥 User Segments")
             # Donut Chart
-            seg_counts = details_df['segment'].value_counts().reset_index()
-            seg_counts.columns = ['segment', 'count']
+            seg_counts = profiles_df[['segment', 'customers']].rename(columns={'customers': 'count'})
             
+            import plotly.express as px  # loaded on first chart, not at startup
             fig_donut = px.pie(
                 seg_counts, 
                 names='segment', 
@@ -278,49 +332,91 @@ with tab2:
 with tab3:
     st.header("📈 Data Explorer")
     
-    # Re-fetch or reuse
-    # fetch_data is cached so this is fine
-    rfm_details = fetch_data("rfm-details")
+    # fetch_data is cached, so this reuses the KPI tab's call
+    profiles = fetch_data("segment-profiles")
     
-    if rfm_details:
-        details_df = pd.DataFrame(rfm_details)
+    if profiles:
+        profiles_df = pd.DataFrame(profiles)
         
-        # Scatter Plot moved here
+        # Scatter Plot moved here: binned or sampled server-side, so the
+        # browser gets a bounded number of points at any customer count
         st.subheader("🔍 Segmentation Matrix")
-        fig = px.scatter(
-            details_df,
-            x='recency',
-            y='frequency',
-            size='monetary',
-            color='segment',
-            hover_data=['customer_id', 'rfm_score', 'R', 'F', 'M'],
-            title="Recency vs Frequency (Bubble Size = Monetary)",
-            template=PLOTLY_TEMPLATE,
-            height=600
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        view = st.radio("View", ["Density", "Sample"], horizontal=True, key="scatter_view",
+                        label_visibility="collapsed")
+        import plotly.express as px
+        points = fetch_scatter(view.lower(), SCATTER_BINS if view == "Density" else SCATTER_SAMPLE)
+        if not points:
+            fig = None
+        elif view == "Density":
+            cells = pd.DataFrame(points)
+            # Cell centres; bins are [start, end)
+            cells['recency'] = (cells['recency_start'] + cells['recency_end']) / 2
+            cells['frequency'] = (cells['frequency_start'] + cells['frequency_end']) / 2
+            fig = px.scatter(
+                cells,
+                x='recency',
+                y='frequency',
+                size='customers',
+                color='segment',
+                hover_data=['customers', 'monetary_mean', 'monetary_sum'],
+                title="Recency vs Frequency (Bubble Size = Customers)",
+                template=PLOTLY_TEMPLATE,
+                height=600
+            )
+        else:
+            sample_df = pd.DataFrame(points)
+            fig = px.scatter(
+                sample_df,
+                x='recency',
+                y='frequency',
+                size='monetary',
+                color='segment',
+                hover_data=['customer_id', 'rfm_score', 'R', 'F', 'M'],
+                title=f"Recency vs Frequency (Bubble Size = Monetary, {len(sample_df):,} sampled customers)",
+                template=PLOTLY_TEMPLATE,
+                height=600
+            )
+        if fig is not None:
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No data for the segmentation matrix.")
         
         st.divider()
 
         # Profiles
         st.subheader("📊 Segment Profiles")
         numeric_cols = ['recency', 'frequency', 'monetary', 'R', 'F', 'M', 'rfm_score']
-        profiles = details_df.groupby('segment')[numeric_cols].mean().round(2)
-        st.dataframe(profiles, use_container_width=True)
+        st.dataframe(profiles_df.set_index('segment')[numeric_cols].round(2), use_container_width=True)
             
         st.divider()
         
         # Inventory
         st.subheader("📋 Customer Inventory")
-        seg_list = ["All"] + list(details_df['segment'].unique())
+        seg_list = ["All"] + list(profiles_df['segment'])
         selected_seg = st.selectbox("Filter by Segment", seg_list, key="inv_seg_filter")
-        
-        if selected_seg != "All":
-            filtered_df = details_df[details_df['segment'] == selected_seg]
+        segment_filter = None if selected_seg == "All" else selected_seg
+
+        # Cursors of the pages visited so far; a new filter starts over
+        if st.session_state.get("inv_seg") != selected_seg:
+            st.session_state.inv_seg = selected_seg
+            st.session_state.inv_cursors = [None]
+        cursors = st.session_state.inv_cursors
+
+        page = fetch_rfm_page(segment_filter, cursors[-1])
+        if page and page['items']:
+            st.dataframe(pd.DataFrame(page['items']), use_container_width=True)
+            total = profiles_df['customers'].sum() if segment_filter is None else \
+                profiles_df.loc[profiles_df['segment'] == segment_filter, 'customers'].sum()
+            p1, p2, p3 = st.columns([1, 2, 1])
+            if p1.button("← Previous", disabled=len(cursors) == 1, key="inv_prev"):
+                cursors.pop()
+                st.rerun()
+            p2.caption(f"Page {len(cursors)} · {INVENTORY_PAGE_SIZE:,} per page · {int(total):,} customers")
+            if p3.button("Next →", disabled=page['next_cursor'] is None, key="inv_next"):
+                cursors.append(page['next_cursor'])
+                st.rerun()
         else:
-            filtered_df = details_df
-            
-        st.dataframe(filtered_df, use_container_width=True)
+            st.info("No customers to list.")
 
 # =================================================================
 # SIDEBAR: BEAUTIFIED INSPECTOR
@@ -337,38 +433,68 @@ with st.sidebar:
     if st.session_state.selected_customer:
         c_id = st.session_state.selected_customer
         
-        # Need RFM details to show profile
-        # Ideally this is a separate API call per customer for scale, but here we reuse the bulk fetch or cached list
-        if 'rfm_details_cache' not in st.session_state or st.session_state.rfm_details_cache is None:
-             st.session_state.rfm_details_cache = pd.DataFrame(fetch_data("rfm-details") or [])
+        # Point lookup against the API's customer index (no bulk fetch)
+        data = fetch_customer(c_id)
+
+        if data:
+             # Styled Profile Card
+             st.markdown(f"### 👤 {data['customer_id']}")
+             st.markdown(f"**Segment:** `{data['segment']}`")
+             
+             st.divider()
+             
+             k1, k2, k3 = st.columns(3)
+             k1.metric("Recency", f"{data['recency']}d", help="Days since last purchase")
+             k2.metric("Frequency", f"{data['frequency']}x", help="Total Transactions")
+             k3.metric("Monetary", f"{config.CURRENCY_SYMBOL} {data['monetary']:,.0f}", help="Total Spend")
              
-        if not st.session_state.rfm_details_cache.empty:
-             cust_row = st.session_state.rfm_details_cache[st.session_state.rfm_details_cache['customer_id'] == c_id]
+             st.progress(data['R']/RFM_BINS, text=f"Recency Score: {data['R']}/{RFM_BINS}")
+             st.progress(data['F']/RFM_BINS, text=f"Frequency Score: {data['F']}/{RFM_BINS}")
+             st.progress(data['M']/RFM_BINS, text=f"Monetary Score: {data['M']}/{RFM_BINS}")
+             
+             st.metric("Composite RFM Score", f"{data['rfm_score']}/5.0")
+
+             if data['actions']:
+                 st.markdown("**Recommended Actions**")
+                 for act in data['actions']:
+                     st.caption(f"{act['priority']} • {act['message']}")
+
+             if data['recent_transactions']:
+                 st.markdown("**Recent Transactions**")
+                 st.dataframe(pd.DataFrame(data['recent_transactions']), hide_index=True, use_container_width=True)
              
-             if not cust_row.empty:
-                 data = cust_row.iloc[0]
-                 
-                 # Styled Profile Card
-                 st.markdown(f"### 👤 {data['customer_id']}")
-                 st.markdown(f"**Segment:** `{data['segment']}`")
-                 
-                 st.divider()
-                 
-                 k1, k2, k3 = st.columns(3)
-                 k1.metric("Recency", f"{data['recency']}d", help="Days since last purchase")
-                 k2.metric("Frequency", f"{data['frequency']}x", help="Total Transactions")
-                 k3.metric("Monetary", f"{config.CURRENCY_SYMBOL} {data['monetary']:,.0f}", help="Total Spend")
-                 
-                 st.progress(data['R']/5, text=f"Recency Score: {data['R']}/5")
-                 st.progress(data['F']/5, text=f"Frequency Score: {data['F']}/5")
-                 st.progress(data['M']/5, text=f"Monetary Score: {data['M']}/5")
-                 
-                 st.metric("Composite RFM Score", f"{data['rfm_score']}/5.0")
-                 
-             else:
-                 st.warning(f"Customer {c_id} not found locally.")
         else:
-             st.info("Loading customer data...")
+             st.warning(f"Customer {c_id} not found.")
     else:
         st.info("Select a customer from the Action Center or search above to view profile.")
 
+
+    # Debug panel: where time goes inside this process (same data as /metrics)
+    if config.metrics.enabled:
+        with st.expander("🛠 Pipeline Profiler", expanded=False):
+            stages = STAGES.snapshot()
+            if stages:
+                prof_df = pd.DataFrame([
+                    {
+                        "stage": name,
+                        "calls": s["count"],
+                        "avg ms": round(s["seconds_avg"] * 1000, 2),
+                        "last ms": round(s["last_seconds"] * 1000, 2),
+                        "max ms": round(s["seconds_max"] * 1000, 2),
+                        "last rows": s["last_rows"],
+                        "peak MB": round(s["peak_bytes_max"] / 2**20, 1) if s["peak_bytes_max"] is not None else None,
+                    }
+                    for name, s in stages.items()
+                ])
+                st.dataframe(prof_df, hide_index=True, use_container_width=True)
+            else:
+                st.caption("No stages recorded yet.")
+            cache = api._state_cache.stats()
+            st.caption(f"Cache: {cache['hits']} hits · {cache['misses']} misses · "
+                       f"{cache['rebuilds']} rebuilds · last build {cache['last_rebuild_seconds'] or 0:.2f}s")
+            if cache["shared"]:
+                st.caption(f"Shared frames: version {cache['shared']['version']} · "
+                           f"{cache['attaches']} attaches")
+            if st.button("Reset profiler"):
+                STAGES.reset()
+                st.rerun()
@@ -1,89 +1,184 @@
 """
 Configuration Loader for Behavior Intelligence Platform.
 Loads settings from config.yaml and provides dot-notation access.
+
+config.yaml is parsed and checked once per process (and on reload()) into
+read-only sections, so attribute lookups are plain dict reads. Importing this
+module has no side effects: the Streamlit theme file is written by the
+dashboard via sync_streamlit_theme(), not here.
 """
-import yaml
 import os
+from collections.abc import Mapping
 from pathlib import Path
 
-class ConfigLoader:
-    def __init__(self, config_path="config.yaml"):
-        self.config_path = config_path
-        self._config = self._load()
-
-    def _load(self):
-        root_dir = Path(__file__).parent
-        path = root_dir / self.config_path
-        if not path.exists():
-             # Fallback for scripts running from subdirectories
-             path = Path(os.getcwd()) / self.config_path
-             
-        if not path.exists():
-            raise FileNotFoundError(f"Configuration file not found at {path}")
-            
-        with open(path, 'r') as f:
-            return yaml.safe_load(f)
+CONFIG_FILE = "config.yaml"
+
+
+class Section(Mapping):
+    """Read-only config section: attribute and item access, lists as tuples."""
+    __slots__ = ("_data",)
 
-    def __getattr__(self, name):
-        if name in self._config:
-            val = self._config[name]
-            if isinstance(val, dict):
-                return ConfigDict(val)
-            return val
-        raise AttributeError(f"Config has no attribute '{name}'")
-
-class ConfigDict:
     def __init__(self, data):
-        self._data = data
-        
+        object.__setattr__(self, "_data", {k: _freeze(v) for k, v in data.items()})
+
     def __getattr__(self, name):
-        if name in self._data:
-            val = self._data[name]
-            if isinstance(val, dict):
-                return ConfigDict(val)
-            return val
-        raise AttributeError(f"Config section has no attribute '{name}'")
+        try:
+            return self._data[name]
+        except KeyError:
+            raise AttributeError(f"Config section has no attribute '{name}'") from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config is read-only; edit config.yaml and call config.reload()")
 
     def __getitem__(self, key):
         return self._data[key]
-    
-    def get(self, key, default=None):
-        return self._data.get(key, default)
 
-def _sync_streamlit_theme(theme_name):
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"Section({self._data!r})"
+
+    def __reduce__(self):
+        return Section, (self._data,)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return Section(value)
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _find(config_file=CONFIG_FILE) -> Path:
+    path = Path(__file__).parent / config_file
+    if not path.exists():
+        # Fallback for scripts running from subdirectories
+        path = Path(os.getcwd()) / config_file
+    if not path.exists():
+        raise FileNotFoundError(f"Configuration file not found at {path}")
+    return path
+
+
+def _range_ok(value) -> bool:
+    return (isinstance(value, (list, tuple)) and len(value) == 2
+            and all(isinstance(v, int) for v in value))
+
+
+def validate(raw: dict, path="config.yaml") -> None:
+    """Raises ValueError naming the first malformed setting the code depends on."""
+    def fail(msg):
+        raise ValueError(f"{path}: {msg}")
+
+    if not isinstance(raw, dict):
+        fail("expected a mapping of sections")
+    for name in ("app", "data", "storage", "rfm", "api", "actions", "feedback",
+                 "drift", "dashboard", "metrics"):
+        if not isinstance(raw.get(name), dict):
+            fail(f"missing section '{name}'")
+
+    rfm = raw["rfm"]
+    bins = rfm.get("bins", 5)
+    if not isinstance(bins, int) or bins < 2:
+        fail(f"rfm.bins must be an integer >= 2, got {bins!r}")
+    for key in ("recency_weight", "frequency_weight", "monetary_weight"):
+        if not isinstance(rfm.get(key), (int, float)):
+            fail(f"rfm.{key} must be a number")
+    for i, seg in enumerate(rfm.get("segments") or ()):
+        if not isinstance(seg, dict) or not seg.get("name"):
+            fail(f"rfm.segments[{i}] needs a name")
+        for key in ("r_range", "f_range"):
+            if not _range_ok(seg.get(key)):
+                fail(f"rfm.segments[{i}].{key} must be [low, high]")
+        if seg.get("m_range") is not None and not _range_ok(seg["m_range"]):
+            fail(f"rfm.segments[{i}].m_range must be [low, high]")
+
+    if raw["storage"].get("format", "csv") not in ("csv", "columnar"):
+        fail("storage.format must be 'csv' or 'columnar'")
+    if raw["feedback"].get("fsync", "batch") not in ("always", "batch", "never"):
+        fail("feedback.fsync must be 'always', 'batch' or 'never'")
+
+    segmentation = (raw.get("models") or {}).get("segmentation") or {}
+    if segmentation.get("method", "rules") not in ("rules", "kmeans"):
+        fail("models.segmentation.method must be 'rules' or 'kmeans'")
+
+    actions = raw["actions"]
+    if not isinstance(actions.get("priority_map"), dict):
+        fail("actions.priority_map must be a mapping")
+    for i, rule in enumerate(actions.get("rules") or ()):
+        if not isinstance(rule, dict) or not rule.get("action_id"):
+            fail(f"actions.rules[{i}] needs an action_id")
+        if not isinstance(rule.get("when") or {}, dict):
+            fail(f"actions.rules[{i}].when must be a mapping")
+
+
+def load(config_file=CONFIG_FILE):
+    """(path, frozen config) for config.yaml."""
+    import yaml  # only needed when (re)reading the file
+    path = _find(config_file)
+    with open(path, 'r') as f:
+        raw = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    validate(raw, path)
+    return path, Section(raw)
+
+
+def sync_streamlit_theme(theme_name=None):
     """
     Writes/Updates .streamlit/config.toml to match the YAML theme.
     Streamlit doesn't support programmatic global theme switching via st.xxx
     at runtime for the base UI, so we must use the config file.
+    Called by the dashboard; defaults to dashboard.theme.
     """
+    theme_name = theme_name or dashboard.theme
     dot_streamlit = Path(os.getcwd()) / ".streamlit"
-    dot_streamlit.mkdir(exist_ok=True)
     config_toml = dot_streamlit / "config.toml"
-    
+
     # Map 'light'/'dark' to Streamlit settings
     base = "light" if theme_name.lower() == "light" else "dark"
-    
+
     content = f"""[theme]
 base="{base}"
 """
     # Only write if different to avoid unnecessary server reloads
     if not config_toml.exists() or config_toml.read_text().strip() != content.strip():
+        dot_streamlit.mkdir(exist_ok=True)
         config_toml.write_text(content)
 
-# Singleton instance
-_cfg = ConfigLoader()
 
-# Sync theme on load
-_sync_streamlit_theme(_cfg.dashboard.theme)
+def _bind(path, cfg):
+    global _cfg, app, data, storage, rfm, api, actions, feedback, drift, dashboard, metrics, models
+    global CURRENCY_SYMBOL, CURRENCY_CODE, CONFIG_PATH
+    _cfg = cfg
+    app = cfg.app
+    data = cfg.data
+    storage = cfg.storage
+    rfm = cfg.rfm
+    api = cfg.api
+    actions = cfg.actions
+    feedback = cfg.feedback
+    drift = cfg.drift
+    dashboard = cfg.dashboard
+    metrics = cfg.metrics
+    models = cfg.get("models") or Section({})
+    # For backward compatibility with my recent change
+    CURRENCY_SYMBOL = app.currency.symbol
+    CURRENCY_CODE = app.currency.code
+    # Resolved location of config.yaml (used for cache invalidation)
+    CONFIG_PATH = str(path)
 
-# Export specific values or the whole object
-app = _cfg.app
-data = _cfg.data
-rfm = _cfg.rfm
-api = _cfg.api
-actions = _cfg.actions
-dashboard = _cfg.dashboard
 
-# For backward compatibility with my recent change
-CURRENCY_SYMBOL = app.currency.symbol
-CURRENCY_CODE = app.currency.code
+# Singleton: exported sections (config.rfm, config.api, ...)
+_bind(*load())
+
+
+def reload():
+    """
+    Re-reads config.yaml and rebinds the exported sections.
+    Called by the pipeline cache when the file changes on disk. A file that
+    fails validation raises and leaves the current settings in place.
+    """
+    _bind(*load())
@@ -0,0 +1,220 @@
+"""
+Segment Snapshot Store - per-run-date segment counts and customer labels.
+
+Layout of the store directory:
+    customers.txt          append-only id dictionary (line number = code)
+    manifest.json          snapshot dates -> file, counts, customer total
+    manifest.lock          flock held while a writer updates manifest.json
+    snap-YYYY-MM-DD.npz    int32 customer codes (sorted), uint8 segment codes,
+                           segment label list
+
+Customer ids are dictionary-encoded once, so comparing two snapshots is a
+sorted-array merge on int32 codes rather than a dict/str join.
+"""
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from segmentation.rfm_segments import segment_counts
+
+MANIFEST = "manifest.json"
+MANIFEST_LOCK = "manifest.lock"
+DICTIONARY = "customers.txt"
+NEW_LABEL = "(new)"
+GONE_LABEL = "(gone)"
+
+
+try:
+    import fcntl
+
+    def _lock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+except ImportError:  # Windows: single-writer assumption
+    def _lock(f):
+        pass
+
+    def _unlock(f):
+        pass
+
+
+class SnapshotStore:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self._ids = None  # lazily loaded pd.Index over customers.txt
+        self._dict_size = 0
+
+    # --- Dictionary ---
+    def _dictionary(self) -> pd.Index:
+        """Id dictionary, picking up any ids other processes appended since last read."""
+        path = os.path.join(self.root_dir, DICTIONARY)
+        if self._ids is None:
+            self._ids, self._dict_size = pd.Index([], dtype=object), 0
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size > self._dict_size:
+            with open(path, "rb") as f:
+                f.seek(self._dict_size)
+                tail = f.read(size - self._dict_size)
+            # Only complete lines; a concurrent append may be in flight
+            tail = tail[:tail.rfind(b"\n") + 1]
+            self._ids = self._ids.append(pd.Index(tail.decode("utf-8").splitlines(), dtype=object))
+            self._dict_size += len(tail)
+        return self._ids
+
+    def encode(self, customer_ids, grow: bool = False) -> np.ndarray:
+        """
+        int32 codes for customer ids; unknown ids are appended to the
+        dictionary when grow=True, otherwise encoded as -1.
+        """
+        if isinstance(customer_ids, pd.CategoricalIndex):
+            # Compact ids: encode each dictionary entry once, gather by code
+            return self.encode(customer_ids.categories, grow)[customer_ids.codes]
+        ids = pd.Index(np.asarray(customer_ids).astype(str), dtype=object)
+        codes = self._dictionary().get_indexer(ids)
+        if grow and (codes < 0).any():
+            os.makedirs(self.root_dir, exist_ok=True)
+            with open(os.path.join(self.root_dir, DICTIONARY), "ab") as f:
+                _lock(f)
+                try:
+                    # Re-check under the lock: another writer may have added some
+                    codes = self._dictionary().get_indexer(ids)
+                    missing = codes < 0
+                    new_ids = ids[missing].unique()
+                    f.write("".join(f"{c}\n" for c in new_ids).encode("utf-8"))
+                    f.flush()
+                finally:
+                    _unlock(f)
+            codes[missing] = self._dictionary().get_indexer(ids[missing])
+        return codes.astype(np.int32)
+
+    # --- Manifest ---
+    def manifest(self) -> dict:
+        path = os.path.join(self.root_dir, MANIFEST)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    @contextmanager
+    def _manifest_lock(self):
+        """Serializes manifest read-modify-writes across processes (workers, backfills)."""
+        os.makedirs(self.root_dir, exist_ok=True)
+        with open(os.path.join(self.root_dir, MANIFEST_LOCK), "ab") as f:
+            _lock(f)
+            try:
+                yield
+            finally:
+                _unlock(f)
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.root_dir, MANIFEST)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+    def dates(self) -> list:
+        return sorted(self.manifest())
+
+    def has(self, run_date: str) -> bool:
+        return run_date in self.manifest()
+
+    # --- Snapshots ---
+    def save(self, rfm: pd.DataFrame, run_date: str, segment_col: str = "segment") -> dict:
+        """Records segment labels for every customer in rfm under run_date (YYYY-MM-DD)."""
+        codes = self.encode(rfm.index, grow=True)
+        seg_codes, labels = pd.factorize(rfm[segment_col].astype(object))
+        order = np.argsort(codes, kind="stable")
+
+        fname = f"snap-{run_date}.npz"
+        path = os.path.join(self.root_dir, fname)
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp,
+            customers=codes[order],
+            segments=seg_codes[order].astype(np.uint8),
+            labels=np.asarray(list(labels), dtype=str),
+        )
+        os.replace(tmp, path)
+
+        counts = segment_counts(rfm, segment_col)
+        entry = {
+            "file": fname,
+            "customers": int(len(codes)),
+            "counts": {str(k): int(v) for k, v in counts.items()},
+        }
+        with self._manifest_lock():
+            manifest = self.manifest()
+            manifest[run_date] = entry
+            self._write_manifest(manifest)
+        return entry
+
+    def counts(self, run_date: str) -> dict:
+        return self.manifest()[run_date]["counts"]
+
+    def load(self, run_date: str):
+        """Returns (customer codes sorted asc, segment codes, labels)."""
+        entry = self.manifest()[run_date]
+        with np.load(os.path.join(self.root_dir, entry["file"]), allow_pickle=False) as data:
+            return data["customers"], data["segments"], list(data["labels"])
+
+    def latest_before(self, run_date: str, window_days: int = 1):
+        """Most recent snapshot at least window_days older than run_date, or None."""
+        cutoff = (pd.Timestamp(run_date) - pd.Timedelta(days=window_days)).strftime("%Y-%m-%d")
+        older = [d for d in self.dates() if d <= cutoff]
+        return older[-1] if older else None
+
+
+def encode_labels(rfm: pd.DataFrame, store: SnapshotStore, segment_col: str = "segment"):
+    """Live RFM frame in snapshot form: (codes sorted, segment codes, labels)."""
+    codes = store.encode(rfm.index, grow=False)
+    seg_codes, labels = pd.factorize(rfm[segment_col].astype(object))
+    order = np.argsort(codes, kind="stable")
+    return codes[order], seg_codes[order], list(labels)
+
+
+def transition_matrix(previous, current) -> pd.DataFrame:
+    """
+    Customer-level segment transitions between two snapshots, each given as
+    (customer codes sorted asc, segment codes, labels).
+
+    Returns a from x to count matrix. Customers only present in `current`
+    come from NEW_LABEL; customers missing from it go to GONE_LABEL.
+    Customers unknown to the dictionary (code -1) count as new.
+    """
+    p_ids, p_seg, p_labels = previous
+    c_ids, c_seg, c_labels = current
+
+    # Merge on encoded ids: both arrays are sorted, so searchsorted finds matches
+    known = c_ids >= 0
+    pos = np.searchsorted(p_ids, c_ids)
+    pos = np.minimum(pos, max(len(p_ids) - 1, 0))
+    matched = known & (len(p_ids) > 0)
+    if len(p_ids):
+        matched &= p_ids[pos] == c_ids
+
+    n_from = len(p_labels) + 1  # + NEW
+    n_to = len(c_labels) + 1    # + GONE
+    new_code = len(p_labels)
+    gone_code = len(c_labels)
+
+    from_codes = np.where(matched, p_seg[pos] if len(p_ids) else 0, new_code).astype(np.int64)
+    cells = np.bincount(from_codes * n_to + c_seg.astype(np.int64), minlength=n_from * n_to)
+
+    # Previous customers with no match in current
+    seen = np.zeros(len(p_ids), dtype=bool)
+    seen[pos[matched]] = True
+    gone = p_seg[~seen].astype(np.int64)
+    cells += np.bincount(gone * n_to + gone_code, minlength=n_from * n_to)
+
+    matrix = cells.reshape(n_from, n_to)
+    return pd.DataFrame(
+        matrix,
+        index=pd.Index(list(p_labels) + [NEW_LABEL], name="from_segment"),
+        columns=pd.Index(list(c_labels) + [GONE_LABEL], name="to_segment"),
+    )
@@ -1,11 +1,45 @@
 """
 Features Package - RFM Feature Engineering
 """
-from .rfm import calculate_rfm_scores
+from .rfm import (
+    calculate_rfm_scores,
+    calculate_rfm_scores_chunked,
+    aggregate_transactions,
+    score_rfm,
+    quantile_scores,
+    RFMAggregateStore,
+    read_csv_delta,
+    changed_scores,
+    encode_ids,
+    compact_transactions,
+    compact_rfm,
+    column_bound,
+)
+from .parallel import calculate_rfm_scores_parallel, aggregate_transactions_parallel
+from .history import TransactionTimeline, rfm_history
+from .churn import churn_features, ChurnModel, score_churn
 from .utils import load_config, clean_dataframe
 
 __all__ = [
     'calculate_rfm_scores',
+    'calculate_rfm_scores_chunked',
+    'aggregate_transactions',
+    'score_rfm',
+    'quantile_scores',
+    'RFMAggregateStore',
+    'read_csv_delta',
+    'changed_scores',
+    'encode_ids',
+    'compact_transactions',
+    'compact_rfm',
+    'column_bound',
+    'calculate_rfm_scores_parallel',
+    'aggregate_transactions_parallel',
+    'TransactionTimeline',
+    'rfm_history',
+    'churn_features',
+    'ChurnModel',
+    'score_churn',
     'load_config',
     'clean_dataframe'
 ]
@@ -0,0 +1,292 @@
+"""
+Churn Scoring - probability that a customer makes no purchase in the next
+models.churn.horizon_days.
+
+Features come from the transaction history as of a snapshot date: log
+recency/frequency/monetary/tenure, the mean gap between purchases and how
+overdue the customer is against it, the spend trend (last window vs the one
+before) and the R/F/M scores. A logistic regression is trained on past
+snapshots, whose labels are known (did the customer buy within the horizon
+after the snapshot?), and saved as an .npz under models.dir. Scoring is a
+few bincounts over the transactions plus one matrix-vector product, so the
+whole customer base is scored in one vectorized pass:
+
+    model = ChurnModel.train(transactions)
+    rfm['churn_probability'] = model.predict_proba(churn_features(transactions, rfm=rfm))
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from pipeline.profiler import STAGES
+from .rfm import score_rfm
+
+FEATURES = ('log_recency', 'log_frequency', 'log_monetary', 'log_tenure', 'log_gap',
+            'overdue', 'spend_trend', 'R', 'F', 'M')
+MODEL_FILE = "churn_logit.npz"
+FORMAT_VERSION = 1
+DAY = np.timedelta64(1, 'D')
+
+
+def _customer_codes(customers: pd.Series):
+    """(codes, ids); categoricals (compact frames) reuse their dictionary."""
+    if isinstance(customers.dtype, pd.CategoricalDtype):
+        codes = customers.cat.codes.to_numpy().astype(np.int64)
+        return codes, pd.Index(customers.cat.categories, dtype=object)
+    codes, ids = pd.factorize(customers.to_numpy(dtype=object))
+    return codes.astype(np.int64), pd.Index(ids, dtype=object)
+
+
+@STAGES.instrument("churn_features", rows=len)
+def churn_features(transactions: pd.DataFrame, snapshot_date=None, rfm: pd.DataFrame = None,
+                   window_days: int = 90, customer_col='customer_id', date_col='date',
+                   amount_col='amount') -> pd.DataFrame:
+    """
+    Churn features per customer from transactions before snapshot_date
+    (default: the day after the last transaction, as score_rfm uses). With
+    rfm (the pipeline's scored table) its R/F/M and recency are reused and
+    the result follows rfm's index.
+    """
+    dates = transactions[date_col]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates)
+    dates = dates.to_numpy()
+    if snapshot_date is None:
+        snapshot_date = pd.Timestamp(dates.max()) + pd.Timedelta(days=1)
+    snapshot = np.datetime64(pd.Timestamp(snapshot_date)).astype(dates.dtype)
+
+    before = dates < snapshot
+    codes, ids = _customer_codes(transactions[customer_col][before])
+    present = np.bincount(codes, minlength=len(ids)) > 0
+    if not present.all():
+        # Dictionary entries (compact ids) with no purchase yet
+        codes, ids = (np.cumsum(present) - 1)[codes], ids[present]
+    dates = dates[before]
+    amounts = transactions[amount_col].to_numpy(dtype=np.float64)[before]
+    n = len(ids)
+
+    # Days before the snapshot, fractional; windows are [0, w) and [w, 2w)
+    age = (snapshot - dates) / DAY
+    count = np.bincount(codes, minlength=n)
+    spend = np.bincount(codes, weights=amounts, minlength=n)
+    recent = np.bincount(codes, weights=amounts * (age < window_days), minlength=n)
+    prior = np.bincount(codes, weights=amounts * ((age >= window_days) & (age < 2 * window_days)),
+                        minlength=n)
+    by_customer = pd.Series(dates).groupby(codes, sort=True)
+    first = by_customer.min().to_numpy()
+
+    if rfm is None:
+        agg = pd.DataFrame({'last_date': by_customer.max().to_numpy(), 'frequency': count,
+                            'monetary': spend}, index=ids)
+        agg.index.name = customer_col
+        rfm = score_rfm(agg, snapshot_date=pd.Timestamp(snapshot_date))
+        pos = np.arange(n)
+    else:
+        pos = ids.get_indexer(pd.Index(np.asarray(rfm.index, dtype=object)))
+        if (pos < 0).any():
+            raise ValueError("rfm has customers without transactions before the snapshot")
+
+    recency = rfm['recency'].to_numpy(dtype=np.float64)
+    frequency = count[pos].astype(np.float64)
+    tenure = ((snapshot - first[pos]) // DAY).astype(np.float64)
+    # Mean days between purchases; one-off buyers get their tenure
+    gap = np.where(frequency > 1, (tenure - recency) / np.maximum(frequency - 1, 1), tenure)
+
+    return pd.DataFrame({
+        'log_recency': np.log1p(recency),
+        'log_frequency': np.log1p(frequency),
+        'log_monetary': np.log1p(np.maximum(spend[pos], 0)),
+        'log_tenure': np.log1p(tenure),
+        'log_gap': np.log1p(gap),
+        'overdue': np.log1p(recency / (gap + 1)),
+        'spend_trend': np.log1p(np.maximum(recent[pos], 0)) - np.log1p(np.maximum(prior[pos], 0)),
+        'R': rfm['R'].to_numpy(dtype=np.float64),
+        'F': rfm['F'].to_numpy(dtype=np.float64),
+        'M': rfm['M'].to_numpy(dtype=np.float64),
+    }, index=rfm.index)
+
+
+def churn_labels(transactions: pd.DataFrame, customers: pd.Index, snapshot_date, horizon_days: int,
+                 customer_col='customer_id', date_col='date') -> np.ndarray:
+    """1 for customers with no purchase in [snapshot_date, snapshot_date + horizon_days)."""
+    dates = pd.to_datetime(transactions[date_col])
+    start = pd.Timestamp(snapshot_date)
+    window = ((dates >= start) & (dates < start + pd.Timedelta(days=horizon_days))).to_numpy()
+    active = pd.Index(np.asarray(transactions[customer_col][window].unique(), dtype=object))
+    return (~customers.isin(active)).astype(np.int8)
+
+
+class ChurnModel:
+    def __init__(self, coef, intercept, mean, scale, horizon_days, window_days,
+                 trained_rows=0, base_rate=0.0, auc=None):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.horizon_days = int(horizon_days)
+        self.window_days = int(window_days)
+        self.trained_rows = int(trained_rows)
+        self.base_rate = float(base_rate)
+        self.auc = None if auc is None or np.isnan(auc) else float(auc)
+
+    # --- Training ---
+    @classmethod
+    def training_set(cls, transactions, horizon_days=90, snapshots=4, step_days=30, window_days=90):
+        """
+        (features, labels) stacked over past snapshots whose horizon has fully
+        elapsed, newest first; features are indexed by (snapshot_date, customer).
+        """
+        dates = pd.to_datetime(transactions['date'])
+        end = dates.max().normalize() + pd.Timedelta(days=1)
+        if not isinstance(transactions['customer_id'].dtype, pd.CategoricalDtype):
+            # Hash the ids once, not once per snapshot
+            codes, ids = _customer_codes(transactions['customer_id'])
+            transactions = transactions.assign(date=dates, customer_id=pd.Categorical.from_codes(codes, ids))
+        frames, labels, keys = [], [], []
+        for k in range(snapshots):
+            snapshot = end - pd.Timedelta(days=horizon_days + k * step_days)
+            if snapshot <= dates.min():
+                break
+            try:
+                x = churn_features(transactions, snapshot, window_days=window_days)
+            except ValueError:
+                continue  # too few customers for distinct score bins
+            frames.append(x)
+            labels.append(churn_labels(transactions, x.index, snapshot, horizon_days))
+            keys.append(snapshot)
+        if not frames:
+            return pd.DataFrame(columns=list(FEATURES)), np.empty(0, dtype=np.int8)
+        return pd.concat(frames, keys=keys, names=['snapshot_date', 'customer_id']), np.concatenate(labels)
+
+    @classmethod
+    @STAGES.instrument("churn_train")
+    def train(cls, transactions: pd.DataFrame, horizon_days: int = 90, snapshots: int = 4,
+              step_days: int = 30, window_days: int = 90, min_samples: int = 100,
+              max_rows: int = 500_000, seed: int = 0) -> "ChurnModel":
+        """
+        Logistic regression on past snapshots. The newest snapshot is held
+        out for the reported AUC, then the model is refitted on all of them.
+        Raises ValueError with fewer than min_samples rows or one class only.
+        """
+        try:
+            from sklearn.linear_model import LogisticRegression
+            from sklearn.metrics import roc_auc_score
+        except ImportError:
+            raise ImportError("Churn scoring requires scikit-learn")
+
+        x, y = cls.training_set(transactions, horizon_days, snapshots, step_days, window_days)
+        if len(y) < min_samples or len(np.unique(y)) < 2:
+            raise ValueError(f"Not enough churn history to train: {len(y)} samples "
+                             f"(min_samples={min_samples}), classes {np.unique(y).tolist()}")
+
+        # Rows of the newest snapshot come first in training_set
+        snapshot_dates = x.index.get_level_values('snapshot_date')
+        n_newest = int((snapshot_dates == snapshot_dates[0]).sum())
+        rng = np.random.default_rng(seed)
+        if len(y) > max_rows:
+            keep = np.sort(rng.choice(len(y), max_rows, replace=False))
+            x, y = x.iloc[keep], y[keep]
+            n_newest = int(np.searchsorted(keep, n_newest))
+
+        values = x.to_numpy(dtype=np.float64)
+        mean, scale = values.mean(axis=0), values.std(axis=0)
+        scale[scale == 0] = 1.0
+        values = (values - mean) / scale
+
+        auc = None
+        held, rest = slice(0, n_newest), slice(n_newest, None)
+        if 0 < n_newest < len(y) and len(np.unique(y[rest])) == 2 and len(np.unique(y[held])) == 2:
+            check = LogisticRegression(max_iter=500).fit(values[rest], y[rest])
+            auc = roc_auc_score(y[held], check.decision_function(values[held]))
+
+        fit = LogisticRegression(max_iter=500).fit(values, y)
+        return cls(fit.coef_[0], fit.intercept_[0], mean, scale, horizon_days, window_days,
+                   trained_rows=len(y), base_rate=float(y.mean()), auc=auc)
+
+    # --- Scoring ---
+    def predict_proba(self, features: pd.DataFrame) -> np.ndarray:
+        """Churn probability per row of churn_features output."""
+        values = features[list(FEATURES)].to_numpy(dtype=np.float64)
+        logit = ((values - self.mean) / self.scale) @ self.coef + self.intercept
+        return 1.0 / (1.0 + np.exp(-logit))
+
+    # --- Persistence ---
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, format=FORMAT_VERSION, features=np.array(FEATURES, dtype=str),
+                     coef=self.coef, intercept=self.intercept, mean=self.mean, scale=self.scale,
+                     horizon_days=self.horizon_days, window_days=self.window_days,
+                     trained_rows=self.trained_rows, base_rate=self.base_rate,
+                     auc=np.nan if self.auc is None else self.auc)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """The saved model, or None if missing or built for other features."""
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                if int(z['format']) != FORMAT_VERSION or tuple(z['features'].tolist()) != FEATURES:
+                    return None
+                return cls(z['coef'], z['intercept'], z['mean'], z['scale'], z['horizon_days'],
+                           z['window_days'], z['trained_rows'], z['base_rate'], float(z['auc']))
+        except FileNotFoundError:
+            return None
+
+
+_model_cache = {}
+
+def model_path():
+    import config
+    return os.path.join(config.models.get('dir', 'models'), MODEL_FILE)
+
+
+def load_or_train(transactions: pd.DataFrame, retrain: bool = False) -> ChurnModel:
+    """
+    The model at model_path() if it was trained for the configured horizon
+    and window; otherwise trains one on transactions and saves it.
+    """
+    import config
+    settings = config.models.get('churn') or {}
+    horizon = int(settings.get('horizon_days', 90))
+    window = int(settings.get('window_days', 90))
+    path = model_path()
+
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        stamp = None
+    model = None
+    if not retrain and stamp is not None:
+        cached = _model_cache.get(path)
+        model = cached[1] if cached and cached[0] == stamp else ChurnModel.load(path)
+        if model is not None and (model.horizon_days, model.window_days) != (horizon, window):
+            model = None
+
+    if model is None:
+        model = ChurnModel.train(transactions, horizon, int(settings.get('training_snapshots', 4)),
+                                 int(settings.get('snapshot_step_days', 30)), window,
+                                 int(settings.get('min_samples', 100)),
+                                 int(settings.get('max_train_rows', 500_000)))
+        model.save(path)
+        stamp = os.stat(path).st_mtime_ns
+    _model_cache[path] = (stamp, model)
+    return model
+
+
+def score_churn(transactions: pd.DataFrame, rfm: pd.DataFrame, threshold: float = None) -> pd.DataFrame:
+    """
+    churn_probability and churn_risk (probability >= models.churn.threshold)
+    for every customer in rfm, from the saved (or freshly trained) model.
+    """
+    import config
+    if threshold is None:
+        threshold = float((config.models.get('churn') or {}).get('threshold', 0.5))
+    model = load_or_train(transactions)
+    features = churn_features(transactions, rfm=rfm, window_days=model.window_days)
+    with STAGES.stage("churn_score", rows=len(features)):
+        proba = model.predict_proba(features)
+    return pd.DataFrame({'churn_probability': np.round(proba, 4), 'churn_risk': proba >= threshold},
+                        index=rfm.index)
@@ -0,0 +1,105 @@
+"""
+Parallel RFM Aggregation - hash-partitioned customer shards on a process pool.
+
+Rows are split by a hash of customer_id, so every customer lives in exactly
+one shard. Each worker aggregates its shard (last date, count, spend) and the
+shard results are simply concatenated; scoring stays global. Rows keep their
+original order inside a shard, so per-customer float sums are identical to
+the single-process groupby.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .rfm import aggregate_transactions, score_rfm
+
+_pools = {}
+
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    """Long-lived pool per worker count. Spawned, since the API process is multi-threaded."""
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        _pools[workers] = pool
+    return pool
+
+
+def parallel_workers(n_rows: int) -> int:
+    """Worker count from config (rfm.workers, 0 = one per CPU); 1 for small inputs."""
+    import config
+    workers = config.rfm.get('workers', 1)
+    if not workers:
+        workers = os.cpu_count() or 1
+    if n_rows < config.rfm.get('parallel_min_rows', 1_000_000):
+        return 1
+    return max(int(workers), 1)
+
+
+def shard_ids(customer_ids, n_shards: int) -> np.ndarray:
+    """Shard number per row: a stable hash of the id (same in every process)."""
+    if isinstance(customer_ids.dtype, pd.CategoricalDtype):
+        # Hash each category once, then gather by code
+        cat = customer_ids.array
+        hashes = pd.util.hash_array(np.asarray(cat.categories, dtype=object))
+        return (hashes % n_shards)[cat.codes].astype(np.intp)
+    hashes = pd.util.hash_array(np.asarray(customer_ids, dtype=object))
+    return (hashes % n_shards).astype(np.intp)
+
+
+def _aggregate_shard(ids, dates, amounts):
+    # ids are category codes for categorical input, raw ids otherwise
+    shard = pd.DataFrame({'customer_id': ids, 'date': dates, 'amount': amounts})
+    return aggregate_transactions(shard)
+
+
+def aggregate_transactions_parallel(df: pd.DataFrame, workers: int,
+                                    customer_col='customer_id',
+                                    date_col='date',
+                                    amount_col='amount') -> pd.DataFrame:
+    """Same result as aggregate_transactions, computed on `workers` processes."""
+    if workers <= 1 or len(df) == 0:
+        return aggregate_transactions(df, customer_col, date_col, amount_col)
+
+    customers = df[customer_col]
+    dates = df[date_col]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates)
+    dates = dates.to_numpy()  # keeps the input's datetime unit
+    amounts = df[amount_col].to_numpy()
+
+    categorical = isinstance(customers.dtype, pd.CategoricalDtype)
+    ids = customers.array.codes if categorical else customers.to_numpy(dtype=object)
+
+    # Stable grouping of row positions by shard keeps row order within a shard
+    shards = shard_ids(customers, workers)
+    order = np.argsort(shards, kind='stable')
+    bounds = np.searchsorted(shards[order], np.arange(workers + 1))
+
+    pool = _pool(workers)
+    futures = []
+    for i in range(workers):
+        rows = order[bounds[i]:bounds[i + 1]]
+        if len(rows):
+            futures.append(pool.submit(_aggregate_shard, ids[rows], dates[rows], amounts[rows]))
+
+    agg = pd.concat([f.result() for f in futures])
+    if categorical:
+        agg.index = pd.CategoricalIndex(
+            pd.Categorical.from_codes(agg.index.to_numpy(), dtype=customers.dtype))
+    agg.index.name = customer_col
+    return agg.sort_index()
+
+
+def calculate_rfm_scores_parallel(df: pd.DataFrame, workers: int = None,
+                                  customer_col='customer_id',
+                                  date_col='date',
+                                  amount_col='amount') -> pd.DataFrame:
+    """calculate_rfm_scores with sharded aggregation; workers defaults to config."""
+    if workers is None:
+        workers = parallel_workers(len(df))
+    agg = aggregate_transactions_parallel(df, workers, customer_col, date_col, amount_col)
+    return score_rfm(agg)
@@ -1,58 +1,464 @@
 """
 RFM Computation Engine
 """
+import json
+import os
 import pandas as pd
 import numpy as np
 
-def calculate_rfm_scores(df: pd.DataFrame, 
-                         customer_col='customer_id', 
-                         date_col='date', 
-                         amount_col='amount') -> pd.DataFrame:
+import config
+from pipeline.profiler import STAGES
+
+def aggregate_transactions(df: pd.DataFrame,
+                           customer_col='customer_id',
+                           date_col='date',
+                           amount_col='amount') -> pd.DataFrame:
     """
-    Computes R, F, M scores (1-5) and weighted composite score.
-    Input df must have: customer_id, date, amount
+    Per-customer aggregates: last purchase date, transaction count, total spend.
+    Output is indexed by customer and sorted like a pandas groupby.
+    """
+    dates = df[date_col]
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates)
+
+    grouped = pd.DataFrame({
+        'last_date': dates,
+        'frequency': df[customer_col],
+        'monetary': df[amount_col],
+    }, index=df.index).groupby(df[customer_col], observed=True)
+
+    agg = grouped.agg({'last_date': 'max', 'frequency': 'count', 'monetary': 'sum'})
+    agg.index.name = customer_col
+    return agg
+
+def quantile_scores(values: np.ndarray, q: int = 5,
+                    rank_first: bool = False, reverse: bool = False) -> np.ndarray:
+    """
+    Equal-frequency bin labels 1..q, computed directly in NumPy.
+
+    Matches pd.qcut(values, q, labels=1..q) (or labels q..1 with reverse),
+    and with rank_first matches pd.qcut(values.rank(method='first'), ...):
+    edges are linear-interpolated quantiles, bins are right-closed with
+    the lowest edge included, and duplicate edges raise ValueError.
+    """
+    values = np.asarray(values)
+    n = len(values)
+
+    # Quantile levels as qcut builds them: rounded up when 1/q isn't exact in base 2
+    levels = np.linspace(0, 1, q + 1)
+    np.putmask(levels, q * levels != np.arange(q + 1), np.nextafter(levels, 1))
+
+    if rank_first:
+        # Stable argsort == rank(method='first'); ranks are 1..n in sorted order
+        order = np.argsort(values, kind='stable')
+        x = np.arange(1, n + 1, dtype=np.float64)
+    else:
+        x = values
+    edges = np.quantile(x, levels) if n else np.zeros(q + 1)
+
+    if n and np.any(np.diff(edges) == 0):
+        raise ValueError(f"Bin edges must be unique: {edges!r}.")
+
+    if rank_first:
+        # Ranks are already sorted: bin sizes come from the edges alone
+        bounds = np.searchsorted(x, edges[1:], side='right')
+        counts = np.diff(bounds, prepend=0)
+        labels = np.empty(n, dtype=np.int64)
+        labels[order] = np.repeat(np.arange(1, q + 1, dtype=np.int64), counts)
+    else:
+        labels = np.searchsorted(edges, x, side='left').astype(np.int64)
+        labels[x == edges[0]] = 1
+    if reverse:
+        labels = (q + 1) - labels
+    return labels
+
+@STAGES.instrument("rfm_score", rows=len)
+def score_rfm(agg: pd.DataFrame, snapshot_date=None) -> pd.DataFrame:
+    """
+    Turns per-customer aggregates (last_date, frequency, monetary) into
+    recency plus R, F, M scores (1-5, or 1..rfm.bins) and the weighted
+    composite score.
     """
-    # Defensive copy & conversion
-    df = df.copy()
-    df[date_col] = pd.to_datetime(df[date_col])
-    
     # Snapshot date (max date + 1 day to ensure recency > 0)
-    snapshot_date = df[date_col].max() + pd.Timedelta(days=1)
-    
-    # Aggregation
-    rfm = df.groupby(customer_col).agg({
-        date_col: lambda x: (snapshot_date - x.max()).days,
-        customer_col: 'count',
-        amount_col: 'sum'
-    }).rename(columns={
-        date_col: 'recency',
-        customer_col: 'frequency',
-        amount_col: 'monetary'
-    })
-    
-    # Scoring (Quintiles 1-5)
+    if snapshot_date is None:
+        snapshot_date = agg['last_date'].max() + pd.Timedelta(days=1)
+
+    rfm = pd.DataFrame({
+        'recency': (snapshot_date - agg['last_date']).dt.days,
+        'frequency': agg['frequency'],
+        'monetary': agg['monetary'],
+    }, index=agg.index)
+
+    q = config.rfm.get('bins', 5)
+
+    # Scoring (Quintiles 1-5 by default)
     # Recency: Lower is better (reverse labels)
-    rfm['R'] = pd.qcut(rfm['recency'], q=5, labels=[5, 4, 3, 2, 1])
-    
+    rfm['R'] = quantile_scores(rfm['recency'].to_numpy(), q, reverse=True)
+
     # Frequency: Higher is better
-    # Use rank(method='first') to handle ties in low-data volume cases
-    rfm['F'] = pd.qcut(rfm['frequency'].rank(method='first'), q=5, labels=[1, 2, 3, 4, 5])
-    
+    # Ranked 'first' (ties broken by order) to handle low-data volume cases
+    rfm['F'] = quantile_scores(rfm['frequency'].to_numpy(), q, rank_first=True)
+
     # Monetary: Higher is better
-    rfm['M'] = pd.qcut(rfm['monetary'].rank(method='first'), q=5, labels=[1, 2, 3, 4, 5])
-    
-    # Convert to integers
-    rfm['R'] = rfm['R'].astype(int)
-    rfm['F'] = rfm['F'].astype(int)
-    rfm['M'] = rfm['M'].astype(int)
-    
+    rfm['M'] = quantile_scores(rfm['monetary'].to_numpy(), q, rank_first=True)
+
     # Composite Score from Config
-    import config
     w_r = config.rfm.recency_weight
     w_f = config.rfm.frequency_weight
     w_m = config.rfm.monetary_weight
-    
+
     rfm['rfm_score'] = (w_r * rfm['R']) + (w_f * rfm['F']) + (w_m * rfm['M'])
     rfm['rfm_score'] = rfm['rfm_score'].round(2)
-    
+
     return rfm
+
+@STAGES.instrument("calculate_rfm_scores", rows=len)
+def calculate_rfm_scores(df: pd.DataFrame,
+                         customer_col='customer_id',
+                         date_col='date',
+                         amount_col='amount',
+                         snapshot_date=None) -> pd.DataFrame:
+    """
+    Computes R, F, M scores (1-5) and weighted composite score.
+    Input df must have: customer_id, date, amount
+
+    snapshot_date computes RFM as of that date: only transactions before it
+    count and recency is measured from it. Default is the last date + 1 day.
+    For many dates at once use features.history.rfm_history.
+    """
+    if snapshot_date is not None:
+        snapshot_date = pd.Timestamp(snapshot_date)
+        dates = df[date_col]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates)
+        df = df[(dates < snapshot_date).to_numpy()]
+    agg = aggregate_transactions(df, customer_col, date_col, amount_col)
+    return score_rfm(agg, snapshot_date)
+
+
+class RFMAggregateStore:
+    """
+    Per-customer partial aggregates kept in flat NumPy arrays.
+
+    Customer ids live in a pandas Index (hash lookup -> slot); the last
+    purchase date (int64 ns), count and spend are parallel arrays that grow
+    geometrically. Partial aggregates from any number of chunks can be
+    merged in and the result is independent of chunk boundaries.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._ids = pd.Index([], dtype=object)
+        self._last_ns = np.empty(capacity, dtype=np.int64)
+        self._count = np.empty(capacity, dtype=np.int64)
+        self._total = np.empty(capacity, dtype=np.int64)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, n: int):
+        if n <= len(self._last_ns):
+            return
+        cap = max(n, 2 * len(self._last_ns))
+        for name in ('_last_ns', '_count', '_total'):
+            old = getattr(self, name)
+            new = np.empty(cap, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def update(self, customer_ids, last_ns, count, total):
+        """
+        Merges already-grouped partials (unique ids per call) into the store.
+        last_ns are int64 nanosecond timestamps.
+        """
+        if isinstance(customer_ids, pd.CategoricalIndex):
+            customer_ids = pd.Index(np.asarray(customer_ids), dtype=object)
+        customer_ids = pd.Index(customer_ids)
+        last_ns = np.asarray(last_ns, dtype=np.int64)
+        count = np.asarray(count, dtype=np.int64)
+        total = np.asarray(total)
+
+        # Keep integer spend exact until a float amount shows up
+        if total.dtype.kind == 'f' and self._total.dtype.kind != 'f':
+            self._total = self._total.astype(np.float64)
+
+        slots = self._ids.get_indexer(customer_ids)
+        new = slots < 0
+        n_new = int(new.sum())
+        if n_new:
+            start = self._size
+            self._reserve(start + n_new)
+            self._ids = self._ids.append(customer_ids[new])
+            new_slots = np.arange(start, start + n_new)
+            self._last_ns[new_slots] = last_ns[new]
+            self._count[new_slots] = count[new]
+            self._total[new_slots] = total[new]
+            self._size += n_new
+
+        old = ~new
+        if old.any():
+            s = slots[old]
+            np.maximum.at(self._last_ns, s, last_ns[old])
+            self._count[s] += count[old]
+            self._total[s] += total[old]
+
+    def add_transactions(self, df: pd.DataFrame,
+                         customer_col='customer_id',
+                         date_col='date',
+                         amount_col='amount',
+                         workers: int = 1):
+        """
+        Aggregates a raw transaction frame (e.g. one CSV chunk) and merges it.
+        workers > 1 aggregates hash-partitioned customer shards in parallel.
+        """
+        if workers > 1:
+            from .parallel import aggregate_transactions_parallel
+            agg = aggregate_transactions_parallel(df, workers, customer_col, date_col, amount_col)
+        else:
+            agg = aggregate_transactions(df, customer_col, date_col, amount_col)
+        self.update(
+            agg.index,
+            agg['last_date'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+            agg['frequency'].to_numpy(),
+            agg['monetary'].to_numpy(),
+        )
+
+    def copy(self) -> "RFMAggregateStore":
+        """Independent copy, so a live store can be extended without mutating it."""
+        n = self._size
+        new = RFMAggregateStore(capacity=max(n, 1))
+        new._ids = self._ids
+        new._last_ns[:n] = self._last_ns[:n]
+        new._count[:n] = self._count[:n]
+        new._total = new._total.astype(self._total.dtype)
+        new._total[:n] = self._total[:n]
+        new._size = n
+        return new
+
+    def save(self, path, **meta):
+        """Persists the aggregates (plus JSON-serializable metadata) as .npz."""
+        n = self._size
+        np.savez(
+            path,
+            ids=np.asarray(self._ids.tolist()),
+            last_ns=self._last_ns[:n],
+            count=self._count[:n],
+            total=self._total[:n],
+            meta=np.array(json.dumps(meta)),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Returns (store, meta) from a file written by save()."""
+        with np.load(path, allow_pickle=False) as data:
+            store = cls(capacity=max(len(data['ids']), 1))
+            store._total = store._total.astype(data['total'].dtype)
+            store.update(data['ids'].tolist(), data['last_ns'], data['count'], data['total'])
+            meta = json.loads(str(data['meta']))
+        return store, meta
+
+    def merge(self, other: "RFMAggregateStore"):
+        n = other._size
+        self.update(other._ids, other._last_ns[:n], other._count[:n], other._total[:n])
+
+    def to_frame(self, customer_col='customer_id') -> pd.DataFrame:
+        """Aggregates as a frame sorted by customer id (same layout as aggregate_transactions)."""
+        n = self._size
+        agg = pd.DataFrame({
+            'last_date': pd.to_datetime(self._last_ns[:n].copy()),
+            'frequency': self._count[:n].copy(),
+            'monetary': self._total[:n].copy(),
+        }, index=pd.Index(self._ids, name=customer_col))
+        return agg.sort_index()
+
+
+def calculate_rfm_scores_chunked(path,
+                                 chunksize: int = 1_000_000,
+                                 customer_col='customer_id',
+                                 date_col='date',
+                                 amount_col='amount') -> pd.DataFrame:
+    """
+    Streaming version of calculate_rfm_scores for CSVs larger than memory.
+    Only per-customer aggregates are held; scoring runs once at the end.
+    """
+    store = RFMAggregateStore()
+    reader = pd.read_csv(path, usecols=[customer_col, date_col, amount_col], chunksize=chunksize)
+    for chunk in reader:
+        store.add_transactions(chunk, customer_col, date_col, amount_col)
+    return score_rfm(store.to_frame(customer_col))
+
+
+PREFIX_BYTES = 4096
+
+def file_prefix_hash(path, offset: int) -> str:
+    """
+    Hash of the file head (up to offset, capped at PREFIX_BYTES). A mismatch
+    means the already-consumed part was rewritten, not appended to.
+    """
+    import hashlib
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(min(offset, PREFIX_BYTES))).hexdigest()
+
+class _RangeReader:
+    """File-like view over bytes [start, stop) of an open binary file."""
+
+    def __init__(self, f, start, stop):
+        self._f = f
+        self._remaining = stop - start
+        f.seek(start)
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        # pandas requires file-likes to be iterable; its C parser only calls read()
+        while True:
+            data = self.read(65536)
+            if not data:
+                return
+            yield data
+
+
+def _complete_lines_end(f, offset, end, block=65536):
+    """Position just past the last newline in [offset, end), or offset if none."""
+    pos = end
+    while pos > offset:
+        start = max(offset, pos - block)
+        f.seek(start)
+        idx = f.read(pos - start).rfind(b'\n')
+        if idx >= 0:
+            return start + idx + 1
+        pos = start
+    return offset
+
+def read_csv_delta(path, offset: int = 0, end: int = None, names=None, chunksize: int = None):
+    """
+    Reads complete CSV lines between byte offsets [offset, end) of an
+    append-only file. offset=0 reads the header; otherwise column names
+    must be given. Returns (df, new_offset) where new_offset points just
+    past the last complete line consumed; with chunksize, df is an
+    iterator of chunks instead.
+    """
+    if end is None:
+        end = os.stat(path).st_size
+
+    # A writer may be mid-line; leave the partial tail for the next read
+    with open(path, 'rb') as f:
+        new_offset = _complete_lines_end(f, offset, end)
+
+    kwargs = {} if offset == 0 else {'header': None, 'names': names}
+    if new_offset == offset:
+        empty = pd.DataFrame(columns=names)
+        return (iter(()) if chunksize else empty), new_offset
+
+    if chunksize is None:
+        with open(path, 'rb') as f:
+            return pd.read_csv(_RangeReader(f, offset, new_offset), **kwargs), new_offset
+
+    def _chunks():
+        with open(path, 'rb') as f:
+            reader = _RangeReader(f, offset, new_offset)
+            with pd.read_csv(reader, chunksize=chunksize, **kwargs) as chunks:
+                yield from chunks
+
+    return _chunks(), new_offset
+
+def _smallest_int(values: np.ndarray, candidates=(np.int16, np.int32, np.int64)):
+    """values cast to the narrowest candidate integer dtype that holds them."""
+    if len(values) == 0:
+        return values.astype(candidates[0])
+    lo, hi = values.min(), values.max()
+    for dtype in candidates:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return values.astype(dtype)
+    return values
+
+def encode_ids(ids, categories: pd.Index = None) -> pd.Categorical:
+    """
+    Dictionary-encodes customer ids. Ids missing from `categories` (e.g. the
+    dictionary of an earlier frame) are appended, so existing codes stay put.
+    Without categories the dictionary is the sorted distinct ids.
+    """
+    if isinstance(getattr(ids, 'dtype', None), pd.CategoricalDtype):
+        cat = pd.Categorical(ids)
+        if categories is None or cat.categories.equals(categories):
+            return cat
+        # Re-code through the category lists rather than per row
+        merged = categories.append(cat.categories[categories.get_indexer(cat.categories) < 0])
+        return pd.Categorical.from_codes(merged.get_indexer(cat.categories)[cat.codes],
+                                         dtype=pd.CategoricalDtype(merged))
+
+    ids = pd.Index(np.asarray(ids, dtype=object))
+    if categories is None:
+        codes, categories = pd.factorize(ids, sort=True)
+        return pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories))
+    codes = categories.get_indexer(ids)
+    unseen = codes < 0
+    if unseen.any():
+        categories = categories.append(ids[unseen].unique())
+        codes[unseen] = categories.get_indexer(ids[unseen])
+    return pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories))
+
+def compact_transactions(df: pd.DataFrame, categories: pd.Index = None,
+                         customer_col='customer_id', amount_col='amount') -> pd.DataFrame:
+    """
+    Transactions with dictionary-encoded customer ids and float32 (or the
+    narrowest integer) amounts. Pass the dictionary of a previous compact
+    frame as `categories` so the two can be concatenated without re-encoding.
+    """
+    out = df.copy(deep=False)
+    out[customer_col] = encode_ids(df[customer_col], categories)
+    amount = df[amount_col].to_numpy()
+    if amount.dtype.kind == 'f':
+        out[amount_col] = amount.astype(np.float32, copy=False)
+    elif amount.dtype.kind in 'iu':
+        out[amount_col] = _smallest_int(amount)
+    return out
+
+def compact_rfm(rfm: pd.DataFrame, categories: pd.Index = None) -> pd.DataFrame:
+    """
+    Memory-compact RFM table: customer ids as a CategoricalIndex (sharing
+    `categories`, typically the transactions' dictionary), uint8 R/F/M,
+    int16/int32 recency and frequency (and integer monetary), float32
+    monetary, rfm_score and churn_probability, and a categorical segment.
+    Row order and values are unchanged.
+    """
+    out = pd.DataFrame(index=pd.CategoricalIndex(encode_ids(rfm.index, categories), name=rfm.index.name))
+    for col in rfm.columns:
+        values = rfm[col]
+        if col in ('R', 'F', 'M'):
+            out[col] = _smallest_int(values.to_numpy(), (np.uint8, np.uint16, np.int64))
+        elif col in ('recency', 'frequency') or (col == 'monetary' and values.dtype.kind in 'iu'):
+            out[col] = _smallest_int(values.to_numpy())
+        elif col in ('monetary', 'rfm_score', 'churn_probability'):
+            out[col] = values.to_numpy(dtype=np.float32)
+        elif col == 'segment' and not isinstance(values.dtype, pd.CategoricalDtype):
+            out[col] = pd.Categorical(values.to_numpy(dtype=object))
+        else:
+            out[col] = values.to_numpy() if not isinstance(values.dtype, pd.CategoricalDtype) else values.array
+    return out
+
+def column_bound(values: np.ndarray, bound):
+    """
+    A filter bound in the column's dtype. float32 columns (compact_rfm) hold
+    the rounded score, so the bound is rounded the same way: 3.1 still
+    matches a min of 3.1.
+    """
+    if values.dtype == np.float32:
+        return np.float32(bound)
+    return bound
+
+def changed_scores(previous: pd.DataFrame, current: pd.DataFrame) -> pd.Series:
+    """
+    Boolean mask over current's customers: True where R, F or M differ
+    from previous, or the customer is new.
+    """
+    prev = previous[['R', 'F', 'M']].reindex(current.index)
+    return prev.isna().any(axis=1) | (prev != current[['R', 'F', 'M']]).any(axis=1)
@@ -2,11 +2,11 @@
 Shared Utilities
 """
 import pandas as pd
-import yaml
 import os
 
 def load_config(config_path="config.yaml"):
     """Load configuration from YAML file."""
+    import yaml
     if os.path.exists(config_path):
         with open(config_path, 'r') as f:
             return yaml.safe_load(f)
@@ -0,0 +1,175 @@
+"""
+Feedback Analytics - action effectiveness from the feedback log.
+
+Keeps daily counters per (day, action_id, segment):
+    n          feedback rows
+    applied    rows with applied == "yes"
+    positive   applied rows with outcome == "positive"
+and derives apply_rate = applied / n and positive_rate = positive / applied
+over any window.
+
+refresh() only reads what was appended since the last call: each log file
+is tracked by its log_key (header + first row), so consumed bytes of the
+active log are not counted again after it is rotated into the archive or
+compacted into an .npz part.
+"""
+import glob
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from feedback.feedback_log import CLAIMED, COLUMNS, _archive_stem, _decode_part, head_key
+
+KEYS = ['day', 'action_id', 'segment']
+COUNTS = ['n', 'applied', 'positive']
+
+
+def _count(df: pd.DataFrame) -> pd.DataFrame:
+    """Daily counters for a batch of raw feedback rows."""
+    applied = df['applied'].astype(str).str.lower().eq('yes').to_numpy()
+    positive = applied & df['outcome'].astype(str).str.lower().eq('positive').to_numpy()
+    batch = pd.DataFrame({
+        'day': pd.to_datetime(df['timestamp'], format='ISO8601').dt.normalize(),
+        'action_id': df['action_id'].astype(str).to_numpy(),
+        'segment': df['segment'].astype(str).to_numpy(),
+        'n': 1,
+        'applied': applied.astype(np.int64),
+        'positive': positive.astype(np.int64),
+    })
+    return batch.groupby(KEYS, sort=False)[COUNTS].sum()
+
+
+class FeedbackAnalytics:
+    def __init__(self, log_path, archive_dir):
+        self.log_path = log_path
+        self.archive_dir = archive_dir
+        self._counts = pd.DataFrame(columns=COUNTS, dtype=np.int64,
+                                    index=pd.MultiIndex.from_tuples([], names=KEYS))
+        self._progress = {}   # log_key -> (bytes consumed, rows consumed)
+        self._done = set()    # archive stems fully counted
+        self._lock = threading.Lock()
+        self.rows_read = 0
+
+    # --- Incremental ingestion ---
+    def refresh(self) -> int:
+        """Counts feedback appended since the last refresh. Returns new rows."""
+        with self._lock:
+            batches = []
+            for path in sorted(glob.glob(os.path.join(self.archive_dir, "feedback-*.npz"))):
+                batches.append(self._read_part(path))
+            # Archived logs, including claims a compaction hasn't turned into a part yet
+            archived = sorted(glob.glob(os.path.join(self.archive_dir, "feedback-*.csv")))
+            archived += sorted(glob.glob(os.path.join(self.archive_dir, "feedback-*.csv" + CLAIMED)))
+            for path in archived:
+                batches.append(self._read_csv(path, archived=True))
+            if os.path.exists(self.log_path):
+                batches.append(self._read_csv(self.log_path, archived=False))
+
+            batches = [b for b in batches if b is not None and len(b)]
+            if not batches:
+                return 0
+            new = pd.concat(batches, ignore_index=True)
+            merged = pd.concat([self._counts, _count(new)])
+            self._counts = merged.groupby(level=KEYS, sort=False).sum()
+            self.rows_read += len(new)
+            return len(new)
+
+    def _stem(self, path):
+        return _archive_stem(path)
+
+    def _read_part(self, path):
+        stem = self._stem(path)
+        if stem in self._done:
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            key = str(data["source_key"]) if "source_key" in data.files else None
+        _, rows = self._progress.pop(key, (0, 0))
+        self._done.add(stem)
+        return _decode_part(path).iloc[rows:]
+
+    def _read_csv(self, path, archived: bool):
+        if archived and self._stem(path) in self._done:
+            return None
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None  # rotated/compacted under us; picked up next time
+        with f:
+            # Key and rows come from the same descriptor, even if the path is rotated meanwhile
+            key = head_key(f.read(64 * 1024))
+            if key is None:
+                return None
+            offset, rows = self._progress.get(key, (0, 0))
+            f.seek(offset)
+            tail = f.read()
+        tail = tail[:tail.rfind(b"\n") + 1]  # only complete lines
+        if not tail:
+            return None
+
+        df = pd.read_csv(io.BytesIO(tail), dtype=str, keep_default_na=False,
+                         header=0 if offset == 0 else None,
+                         names=None if offset == 0 else COLUMNS)
+        if archived:
+            self._progress.pop(key, None)
+            self._done.add(self._stem(path))
+        else:
+            self._progress[key] = (offset + len(tail), rows + len(df))
+        return df
+
+    # --- Queries ---
+    def effectiveness(self, group_by=('action_id', 'segment'), start=None, end=None,
+                      freq=None) -> pd.DataFrame:
+        """
+        Counters and rates per group over days in [start, end] (either may be
+        None). freq ('D', 'W', 'M', ...) adds a period column for time series.
+        """
+        counts = self._counts
+        if start is not None or end is not None:
+            days = counts.index.get_level_values('day')
+            mask = np.ones(len(counts), dtype=bool)
+            if start is not None:
+                mask &= days >= pd.Timestamp(start)
+            if end is not None:
+                mask &= days <= pd.Timestamp(end)
+            counts = counts[mask]
+
+        flat = counts.reset_index()
+        keys = list(group_by)
+        if freq:
+            flat['period'] = flat['day'].dt.to_period(freq).dt.start_time
+            keys = ['period'] + keys
+        if keys:
+            out = flat.groupby(keys, sort=True)[COUNTS].sum().reset_index()
+        else:
+            out = flat[COUNTS].sum().to_frame().T
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out['apply_rate'] = np.where(out['n'] > 0, out['applied'] / out['n'], np.nan)
+            out['positive_rate'] = np.where(out['applied'] > 0, out['positive'] / out['applied'], np.nan)
+        return out
+
+    def suggested_priorities(self, min_applied: int = 1, levels=("High", "Medium", "Low"),
+                             start=None, end=None) -> dict:
+        """
+        action_id -> priority label, ranking actions by positive_rate and
+        splitting them evenly over `levels`. Actions with fewer than
+        min_applied applied rows are left out.
+        """
+        stats = self.effectiveness(group_by=('action_id',), start=start, end=end)
+        stats = stats[stats['applied'] >= min_applied]
+        stats = stats.sort_values(['positive_rate', 'applied'], ascending=False, kind='stable')
+        if stats.empty:
+            return {}
+        tiers = np.minimum(np.arange(len(stats)) * len(levels) // len(stats), len(levels) - 1)
+        return {a: levels[t] for a, t in zip(stats['action_id'], tiers)}
+
+    def stats(self) -> dict:
+        return {
+            "rows_read": self.rows_read,
+            "groups": int(len(self._counts)),
+            "tracked_logs": len(self._progress),
+            "archives_done": len(self._done),
+        }
@@ -0,0 +1,354 @@
+"""
+Feedback Log - buffered, multi-worker-safe feedback ingestion.
+
+Requests hand rows to a FeedbackWriter, which buffers them in memory and a
+background thread appends them to the active CSV log (data/feedback.csv):
+    - each flush is one write() on an O_APPEND descriptor under an exclusive
+      flock, so rows from different uvicorn workers never interleave and the
+      header is written exactly once;
+    - fsync policy: "always" (every flush, submit waits for it), "batch"
+      (every flush) or "never" (left to the OS);
+    - once the log exceeds rotate_bytes it is moved into archive_dir and
+      compacted into a columnar .npz part. A worker compacting a file holds
+      an flock on it; claims (.csv.compacting) left by a worker that died are
+      picked up by the next compaction.
+read_feedback() returns the whole history (compacted parts + archived,
+claimed and active CSVs) as one DataFrame.
+"""
+import csv
+import glob
+import hashlib
+import io
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['action_id', 'segment', 'applied', 'outcome', 'timestamp']
+STRING_COLUMNS = ['action_id', 'segment', 'applied', 'outcome']
+
+try:
+    import fcntl
+
+    def _lock(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _try_lock(fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:  # Windows: single-writer assumption
+    def _lock(fd):
+        pass
+
+    def _try_lock(fd):
+        return True
+
+    def _unlock(fd):
+        pass
+
+CLAIMED = ".compacting"
+
+
+def _to_csv_bytes(rows, header: bool) -> bytes:
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator='\n')
+    if header:
+        w.writerow(COLUMNS)
+    for r in rows:
+        w.writerow([r[c] for c in COLUMNS])
+    return buf.getvalue().encode('utf-8')
+
+
+class FeedbackWriter:
+    def __init__(self, log_path, archive_dir, flush_interval=0.2, max_batch=1000,
+                 fsync="batch", rotate_bytes=64 * 1024 * 1024):
+        if fsync not in ("always", "batch", "never"):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.log_path = log_path
+        self.archive_dir = archive_dir
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.rotate_bytes = rotate_bytes
+
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._flushed_seq = 0   # rows durably appended so far
+        self._submitted_seq = 0
+
+        self.rows_written = 0
+        self.flushes = 0
+        self.rotations = 0
+
+    # --- Public API ---
+    def submit(self, rows: list) -> int:
+        """
+        Queues feedback rows (dicts with action_id, segment, applied and
+        optional outcome); timestamps are taken now. Returns the row count.
+        With fsync="always" this blocks until the rows are on disk.
+        """
+        now = datetime.now().isoformat()
+        clean_rows = [{
+            'action_id': r['action_id'],
+            'segment': r['segment'],
+            'applied': r['applied'],
+            'outcome': r.get('outcome', 'unknown'),
+            'timestamp': now,
+        } for r in rows]
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("FeedbackWriter is closed")
+            self._buffer.extend(clean_rows)
+            self._submitted_seq += len(clean_rows)
+            target = self._submitted_seq
+            self._ensure_thread()
+            if len(self._buffer) >= self.max_batch or self.fsync == "always":
+                self._cond.notify_all()
+
+        if self.fsync == "always":
+            self.wait_flushed(target)
+        return len(clean_rows)
+
+    def flush(self):
+        """Synchronously writes anything buffered."""
+        with self._cond:
+            rows, self._buffer = self._buffer, []
+        self._write(rows)
+
+    def wait_flushed(self, seq=None, timeout=None):
+        with self._cond:
+            seq = self._submitted_seq if seq is None else seq
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._flushed_seq >= seq, timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "rotations": self.rotations,
+        }
+
+    # --- Background flushing ---
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            # Claims a previous process left behind when it died mid-compaction
+            compact_feedback(self.archive_dir)
+        except Exception:
+            pass  # retried after the next rotation
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._buffer) >= self.max_batch
+                    or (self.fsync == "always" and self._buffer),
+                    timeout=self.flush_interval,
+                )
+                rows, self._buffer = self._buffer, []
+                closed = self._closed
+            if rows:
+                try:
+                    self._write(rows)
+                except Exception:
+                    # Put the rows back; they'll be retried on the next tick
+                    with self._cond:
+                        self._buffer[:0] = rows
+                    time.sleep(self.flush_interval)
+            if closed:
+                return
+
+    def _open_locked(self):
+        """Opens the active log with an exclusive lock, retrying if it was rotated meanwhile."""
+        while True:
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _lock(fd)
+            try:
+                same = os.fstat(fd).st_ino == os.stat(self.log_path).st_ino
+            except FileNotFoundError:
+                same = False
+            if same:
+                return fd
+            _unlock(fd)
+            os.close(fd)
+
+    def _write(self, rows):
+        if not rows:
+            return
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+        rotated = None
+        fd = self._open_locked()
+        try:
+            size = os.fstat(fd).st_size
+            os.write(fd, _to_csv_bytes(rows, header=size == 0))
+            if self.fsync != "never":
+                os.fsync(fd)
+            if os.fstat(fd).st_size >= self.rotate_bytes:
+                rotated = self._rotate_locked()
+        finally:
+            _unlock(fd)
+            os.close(fd)
+
+        with self._cond:
+            self._flushed_seq += len(rows)
+            self.rows_written += len(rows)
+            self.flushes += 1
+            self._cond.notify_all()
+
+        if rotated:
+            compact_feedback(self.archive_dir)
+
+    def _rotate_locked(self):
+        """Moves the active log into the archive (caller holds the lock)."""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        target = os.path.join(self.archive_dir, f"feedback-{stamp}-{os.getpid()}.csv")
+        os.replace(self.log_path, target)
+        self.rotations += 1
+        return target
+
+
+# --- Compaction & reading ---
+def log_key(path):
+    """
+    Identity of a log file: hash of its header and first row (rows carry
+    microsecond timestamps). Survives rotation and compaction, unlike the
+    path or inode. None while the log has no complete row yet.
+    """
+    with open(path, "rb") as f:
+        return head_key(f.read(64 * 1024))
+
+
+def head_key(head: bytes):
+    first = head.find(b"\n")
+    second = head.find(b"\n", first + 1) if first >= 0 else -1
+    if second < 0:
+        return None
+    return hashlib.sha1(head[:second + 1]).hexdigest()
+
+
+def _encode_part(df: pd.DataFrame, source_key=None) -> dict:
+    arrays = {}
+    if source_key is not None:
+        arrays["source_key"] = np.asarray(source_key)
+    for col in STRING_COLUMNS:
+        codes, uniques = pd.factorize(df[col].astype(str))
+        arrays[f"{col}__codes"] = codes.astype(np.int32)
+        arrays[f"{col}__categories"] = np.asarray(list(uniques), dtype=str)
+    arrays["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601").to_numpy(dtype="datetime64[ns]").view(np.int64)
+    return arrays
+
+
+def _decode_part(path) -> pd.DataFrame:
+    with np.load(path, allow_pickle=False) as data:
+        out = {}
+        for col in STRING_COLUMNS:
+            out[col] = pd.Categorical.from_codes(data[f"{col}__codes"], categories=data[f"{col}__categories"].tolist())
+        out["timestamp"] = data["timestamp"].view("datetime64[ns]")
+    return pd.DataFrame(out)
+
+
+def _archive_stem(path):
+    """feedback-<stamp>-<pid> for an archived .csv, its .csv.compacting claim or its .npz part."""
+    name = os.path.basename(path)
+    if name.endswith(CLAIMED):
+        name = name[:-len(CLAIMED)]
+    return name.rsplit('.', 1)[0]
+
+
+def compact_feedback(archive_dir) -> int:
+    """
+    Converts archived CSV logs into columnar .npz parts and removes them.
+    Safe to run from several workers: a file is locked, then claimed by
+    renaming it to .csv.compacting. A claim nobody holds the lock on belongs
+    to a worker that died, and is compacted here. Returns the number of files
+    compacted.
+    """
+    done = 0
+    pending = sorted(glob.glob(os.path.join(archive_dir, "feedback-*.csv")))
+    pending += sorted(glob.glob(os.path.join(archive_dir, "feedback-*.csv" + CLAIMED)))
+    for path in pending:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue  # another worker got it
+        try:
+            if not _try_lock(fd):
+                continue  # being compacted (or still being rotated) by another process
+            claimed = path if path.endswith(CLAIMED) else path + CLAIMED
+            if claimed != path:
+                try:
+                    os.rename(path, claimed)
+                except FileNotFoundError:
+                    continue
+            elif not os.path.exists(claimed):
+                continue  # its owner finished before we got the lock
+            df = pd.read_csv(claimed, dtype=str, keep_default_na=False)
+            part = os.path.join(archive_dir, _archive_stem(claimed) + ".npz")
+            # Hidden tmp name so readers globbing feedback-*.npz never see a partial part
+            tmp = os.path.join(archive_dir, f".tmp-{os.getpid()}-" + os.path.basename(part))
+            np.savez_compressed(tmp, **_encode_part(df, log_key(claimed)))
+            os.replace(tmp, part)
+            os.remove(claimed)
+            done += 1
+        finally:
+            _unlock(fd)
+            os.close(fd)
+    return done
+
+
+def read_feedback(log_path, archive_dir) -> pd.DataFrame:
+    """Full feedback history: compacted parts, archived and claimed CSVs, then the active log."""
+    # CSVs are listed before parts: one compacted in between is then found as a part
+    csvs = sorted(glob.glob(os.path.join(archive_dir, "feedback-*.csv")))
+    csvs += sorted(glob.glob(os.path.join(archive_dir, "feedback-*.csv" + CLAIMED)))
+    parts = sorted(glob.glob(os.path.join(archive_dir, "feedback-*.npz")))
+    compacted = {_archive_stem(p) for p in parts}
+    csvs = [p for p in csvs if _archive_stem(p) not in compacted]
+    if os.path.exists(log_path):
+        csvs.append(log_path)
+
+    frames = [_decode_part(p) for p in parts]
+    for path in csvs:
+        try:
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        except FileNotFoundError:
+            # Claimed or compacted since the listing
+            stem = os.path.join(archive_dir, _archive_stem(path))
+            if os.path.exists(stem + ".csv" + CLAIMED):
+                df = pd.read_csv(stem + ".csv" + CLAIMED, dtype=str, keep_default_na=False)
+            elif os.path.exists(stem + ".npz"):
+                frames.append(_decode_part(stem + ".npz"))
+                continue
+            else:
+                continue
+        if len(df):
+            df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601")
+            frames.append(df[COLUMNS])
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS)
+    out = pd.concat([f.astype({c: object for c in STRING_COLUMNS}) for f in frames], ignore_index=True)
+    return out
@@ -0,0 +1,55 @@
+"""
+Per-Customer Lookup Index - O(1) access to one customer's RFM row and
+transactions without scanning the cached frames.
+"""
+import numpy as np
+import pandas as pd
+
+
+class CustomerIndex:
+    """
+    Hash index over the RFM table plus CSR-style transaction offsets.
+
+    Transactions are grouped by customer once (stable counting by RFM row
+    position), so a customer's rows are perm[starts[i]:starts[i + 1]].
+    """
+
+    def __init__(self, rfm: pd.DataFrame, transactions: pd.DataFrame, customer_col='customer_id'):
+        self.rfm = rfm
+        self.transactions = transactions
+        # pandas builds the hash table once for this Index and reuses it
+        self._ids = rfm.index
+
+        if transactions is None:
+            self._perm = np.empty(0, dtype=np.intp)
+            self._starts = np.zeros(len(rfm) + 1, dtype=np.int64)
+            return
+
+        col = transactions[customer_col]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # Look up each dictionary entry once, then gather by code
+            codes = self._ids.get_indexer(col.cat.categories)[col.cat.codes]
+        else:
+            codes = self._ids.get_indexer(np.asarray(col))
+        codes = np.where(codes < 0, len(rfm), codes)  # unknown ids go to a trailing bucket
+        self._perm = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(rfm) + 1)
+        self._starts = np.concatenate(([0], np.cumsum(counts)))
+
+    def position(self, customer_id):
+        """Row of the customer in the RFM table, or None if unknown."""
+        try:
+            pos = self._ids.get_loc(customer_id)
+        except KeyError:
+            return None
+        return pos if isinstance(pos, (int, np.integer)) else None
+
+    def customer_transactions(self, position: int, limit: int = None) -> pd.DataFrame:
+        """The customer's transactions, most recent first."""
+        rows = self._perm[self._starts[position]:self._starts[position + 1]]
+        txns = self.transactions.iloc[rows]
+        txns = txns.sort_values('date', ascending=False, kind='stable')
+        return txns if limit is None else txns.head(limit)
+
+    def transaction_count(self, position: int) -> int:
+        return int(self._starts[position + 1] - self._starts[position])
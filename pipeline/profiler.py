@@ -0,0 +1,229 @@
+"""
+Stage Profiler - timers, row counts and peak memory per pipeline stage.
+
+    with STAGES.stage("load") as s:
+        df = ...
+        s.rows = len(df)
+
+    @STAGES.instrument("segmentation", rows=len)
+    def assign_segments(...): ...
+
+Stats are kept in-process (count, total/last/max seconds, a latency
+histogram, rows, peak memory) and rendered in Prometheus text format for
+/metrics. Peak memory per stage needs tracemalloc (metrics.trace_memory),
+which slows allocations down; the process peak RSS is always reported.
+"""
+import functools
+import math
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+
+class _Span:
+    __slots__ = ("rows",)
+
+    def __init__(self, rows=None):
+        self.rows = rows
+
+
+class _Stats:
+    __slots__ = ("count", "seconds_sum", "seconds_max", "last_seconds", "buckets",
+                 "rows_total", "last_rows", "peak_bytes_max", "last_peak_bytes")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds_sum = 0.0
+        self.seconds_max = 0.0
+        self.last_seconds = None
+        self.buckets = [0] * len(BUCKETS)
+        self.rows_total = 0
+        self.last_rows = None
+        self.peak_bytes_max = None
+        self.last_peak_bytes = None
+
+
+class StageProfiler:
+    def __init__(self, metric="stage", label="stage", help_text="Time spent per pipeline stage."):
+        self.metric = metric
+        self.label = label
+        self.help_text = help_text
+        self.enabled = True
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._frames = threading.local()  # nested tracemalloc peaks per thread
+
+    # --- Recording ---
+    def record(self, name, seconds, rows=None, peak_bytes=None):
+        with self._lock:
+            st = self._stats.get(name)
+            if st is None:
+                st = self._stats[name] = _Stats()
+            st.count += 1
+            st.seconds_sum += seconds
+            st.seconds_max = max(st.seconds_max, seconds)
+            st.last_seconds = seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    st.buckets[i] += 1
+                    break
+            if rows is not None:
+                st.rows_total += int(rows)
+                st.last_rows = int(rows)
+            if peak_bytes is not None:
+                st.last_peak_bytes = peak_bytes
+                st.peak_bytes_max = max(st.peak_bytes_max or 0, peak_bytes)
+
+    @contextmanager
+    def stage(self, name, rows=None, memory=True):
+        """Times the block; set .rows on the yielded span to record a row count."""
+        span = _Span(rows)
+        if not self.enabled:
+            yield span
+            return
+
+        tracing = memory and tracemalloc.is_tracing()
+        if tracing:
+            stack = self._frame_stack()
+            base, outer_peak = tracemalloc.get_traced_memory()
+            # Keep the enclosing stage's peak so far; resetting only affects ours
+            if stack:
+                stack[-1] = max(stack[-1], outer_peak)
+            tracemalloc.reset_peak()
+            stack.append(0)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if tracing:
+                inner = stack.pop()
+                top = max(tracemalloc.get_traced_memory()[1], inner)
+                peak = max(top - base, 0)
+                if stack:
+                    stack[-1] = max(stack[-1], top)
+            self.record(name, seconds, span.rows, peak)
+
+    def instrument(self, name=None, rows=None):
+        """Decorator form of stage(); rows(result) gives the row count."""
+        def decorator(fn):
+            stage_name = name or fn.__name__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name) as span:
+                    result = fn(*args, **kwargs)
+                    if rows is not None and result is not None:
+                        span.rows = rows(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def _frame_stack(self):
+        stack = getattr(self._frames, "stack", None)
+        if stack is None:
+            stack = self._frames.stack = []
+        return stack
+
+    # --- Reading ---
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "count": st.count,
+                    "seconds_sum": st.seconds_sum,
+                    "seconds_avg": st.seconds_sum / st.count if st.count else None,
+                    "seconds_max": st.seconds_max,
+                    "last_seconds": st.last_seconds,
+                    "rows_total": st.rows_total,
+                    "last_rows": st.last_rows,
+                    "peak_bytes_max": st.peak_bytes_max,
+                    "last_peak_bytes": st.last_peak_bytes,
+                }
+                for name, st in sorted(self._stats.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def prometheus(self, prefix="analytix") -> str:
+        """Prometheus text exposition of every recorded stage."""
+        metric = f"{prefix}_{self.metric}"
+        with self._lock:
+            items = sorted(self._stats.items())
+            lines = [f"# HELP {metric}_seconds {self.help_text}",
+                     f"# TYPE {metric}_seconds histogram"]
+            for name, st in items:
+                lbl = f'{self.label}="{_escape(name)}"'
+                cumulative = 0
+                for bound, n in zip(BUCKETS, st.buckets):
+                    cumulative += n
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f'{metric}_seconds_bucket{{{lbl},le="{le}"}} {cumulative}')
+                lines.append(f"{metric}_seconds_sum{{{lbl}}} {st.seconds_sum:.6f}")
+                lines.append(f"{metric}_seconds_count{{{lbl}}} {st.count}")
+
+            lines += [f"# HELP {metric}_last_seconds Duration of the most recent call.",
+                      f"# TYPE {metric}_last_seconds gauge"]
+            lines += [f'{metric}_last_seconds{{{self.label}="{_escape(n)}"}} {st.last_seconds:.6f}'
+                      for n, st in items]
+
+            rows = [(n, st) for n, st in items if st.last_rows is not None]
+            if rows:
+                lines += [f"# HELP {metric}_rows_total Rows processed.",
+                          f"# TYPE {metric}_rows_total counter"]
+                lines += [f'{metric}_rows_total{{{self.label}="{_escape(n)}"}} {st.rows_total}'
+                          for n, st in rows]
+
+            peaks = [(n, st) for n, st in items if st.peak_bytes_max is not None]
+            if peaks:
+                lines += [f"# HELP {metric}_peak_bytes Peak traced memory above the stage's start.",
+                          f"# TYPE {metric}_peak_bytes gauge"]
+                lines += [f'{metric}_peak_bytes{{{self.label}="{_escape(n)}"}} {st.peak_bytes_max}'
+                          for n, st in peaks]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def process_metrics(prefix="analytix") -> str:
+    """Process-wide gauges: peak RSS (and traced memory when tracemalloc is on)."""
+    lines = []
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak = peak if sys.platform == "darwin" else peak * 1024
+        lines += [f"# HELP {prefix}_process_peak_rss_bytes Peak resident set size.",
+                  f"# TYPE {prefix}_process_peak_rss_bytes gauge",
+                  f"{prefix}_process_peak_rss_bytes {peak}"]
+    except ImportError:  # Windows
+        pass
+    if tracemalloc.is_tracing():
+        current, _ = tracemalloc.get_traced_memory()
+        lines += [f"# HELP {prefix}_traced_memory_bytes Memory currently traced by tracemalloc.",
+                  f"# TYPE {prefix}_traced_memory_bytes gauge",
+                  f"{prefix}_traced_memory_bytes {current}"]
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def configure(enabled=True, trace_memory=False):
+    for profiler in (STAGES, REQUESTS):
+        profiler.enabled = enabled
+    if enabled and trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+# Pipeline stages (load, rfm, segmentation, actions, serialization...)
+STAGES = StageProfiler()
+# Per-route HTTP latency, recorded by the API middleware
+REQUESTS = StageProfiler(metric="http_request", label="route",
+                         help_text="HTTP request latency per route.")
@@ -0,0 +1,185 @@
+"""
+Revenue Cube - daily revenue and transaction counts per customer segment.
+
+A dense (day x segment) matrix built with one bincount over the
+transactions; week/month views, date ranges and segment filters are sums
+over that small matrix. The cube remembers which customer each transaction
+row belongs to, so after an incremental pipeline run it is extended instead
+of rebuilt: appended rows are added, and the history of customers whose
+segment changed is moved between segment columns.
+"""
+import numpy as np
+import pandas as pd
+
+from pipeline.profiler import STAGES
+
+GRANULARITIES = {"day": None, "week": "W", "month": "M"}
+
+
+def _day_numbers(dates) -> np.ndarray:
+    """Days since the epoch for a datetime column, in any resolution."""
+    return dates.to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+class RevenueCube:
+    def __init__(self, ids, slots, segment_of, segments, day0, revenue, count):
+        self._ids = ids                # customer dictionary (slot -> id)
+        self._slots = slots            # customer slot per transaction row
+        self._segment_of = segment_of  # segment column per slot
+        self.segments = segments       # column labels
+        self.day0 = day0               # day number of row 0
+        self.revenue = revenue         # (days, segments)
+        self.count = count             # (days, segments) transaction counts
+
+    def __len__(self):
+        return len(self._slots)
+
+    # --- Building ---
+    @classmethod
+    def build(cls, transactions: pd.DataFrame, rfm: pd.DataFrame,
+              customer_col='customer_id', date_col='date', amount_col='amount') -> "RevenueCube":
+        empty = cls(pd.Index([], dtype=object), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32),
+                    pd.Index([], dtype=object), 0, np.zeros((0, 0)), np.zeros((0, 0), dtype=np.int64))
+        return empty.extend(transactions, rfm, customer_col, date_col, amount_col)
+
+    @STAGES.instrument("revenue_cube")
+    def extend(self, transactions: pd.DataFrame, rfm: pd.DataFrame,
+               customer_col='customer_id', date_col='date', amount_col='amount') -> "RevenueCube":
+        """
+        Cube for `transactions`, whose first len(self) rows are the ones this
+        cube was built from, segmented by `rfm`. Returns a new cube; this one
+        is left as is (the previous pipeline state may still be serving it).
+        """
+        if len(transactions) < len(self):
+            return RevenueCube.build(transactions, rfm, customer_col, date_col, amount_col)
+
+        new = transactions.iloc[len(self):]
+        ids, new_slots = _encode(self._ids, new[customer_col])
+        slots = np.concatenate([self._slots, new_slots])
+
+        # Segment column of every known customer under the new segmentation
+        labels = rfm['segment'].reindex(ids)
+        segments = self.segments.append(pd.Index(labels.dropna().unique(), dtype=object)
+                                        .difference(self.segments))
+        segment_of = segments.get_indexer(labels.to_numpy(dtype=object)).astype(np.int32)
+
+        revenue, count, day0 = self.revenue, self.count, self.day0
+        new_days = _day_numbers(new[date_col]) if len(new) else np.empty(0, dtype=np.int64)
+        span = [day0, day0 + len(revenue) - 1] if len(revenue) else []
+        if len(new_days):
+            span += [int(new_days.min()), int(new_days.max())]
+        lo, hi = (min(span), max(span)) if span else (0, -1)
+        n_days = hi - lo + 1
+
+        # Re-grid onto the (possibly wider) day range and segment list
+        if revenue.dtype.kind != 'f' and new[amount_col].dtype.kind == 'f':
+            revenue = revenue.astype(np.float64)
+        dtype = revenue.dtype if len(self) else _revenue_dtype(new[amount_col])
+        grid = np.zeros((n_days, len(segments)), dtype=dtype)
+        grid_count = np.zeros((n_days, len(segments)), dtype=np.int64)
+        if len(revenue):
+            top = day0 - lo
+            grid[top:top + len(revenue), :revenue.shape[1]] = revenue
+            grid_count[top:top + len(count), :count.shape[1]] = count
+
+        # History of customers whose segment changed moves to their new column
+        if len(self):
+            old_of = self._segment_of
+            moved_slot = old_of != segment_of[:len(old_of)]
+            if moved_slot.any():
+                rows = np.flatnonzero(moved_slot[self._slots])
+                old = transactions.iloc[rows]
+                days = _day_numbers(old[date_col]) - lo
+                amounts = old[amount_col].to_numpy()
+                from_col = old_of[self._slots[rows]]
+                to_col = segment_of[self._slots[rows]]
+                _add(grid, grid_count, days, from_col, amounts, sign=-1)
+                _add(grid, grid_count, days, to_col, amounts, sign=1)
+
+        if len(new):
+            _add(grid, grid_count, new_days - lo, segment_of[new_slots], new[amount_col].to_numpy())
+
+        return RevenueCube(ids, slots, segment_of, segments, lo, grid, grid_count)
+
+    # --- Queries ---
+    def query(self, granularity="day", start=None, end=None, segments=None,
+              by_segment=False) -> pd.DataFrame:
+        """
+        Revenue and transaction counts per period (and segment with
+        by_segment). Periods without transactions are left out; week and
+        month periods are labelled by their first day.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {sorted(GRANULARITIES)}")
+
+        days = pd.to_datetime(np.arange(self.day0, self.day0 + len(self.revenue)), unit="D")
+        rows = np.ones(len(days), dtype=bool)
+        if start is not None:
+            rows &= days >= pd.Timestamp(start)
+        if end is not None:
+            rows &= days <= pd.Timestamp(end)
+        cols = np.arange(len(self.segments))
+        if segments:
+            cols = np.flatnonzero(self.segments.isin(list(segments)))
+
+        revenue = self.revenue[np.ix_(rows, cols)]
+        count = self.count[np.ix_(rows, cols)]
+        periods = days[rows]
+        if GRANULARITIES[granularity]:
+            periods = periods.to_period(GRANULARITIES[granularity]).start_time
+
+        if by_segment:
+            n = len(cols)
+            frame = pd.DataFrame({
+                'date': np.repeat(periods, n),
+                'segment': np.tile(self.segments[cols].to_numpy(dtype=object), len(periods)),
+                'revenue': revenue.ravel(),
+                'transactions': count.ravel(),
+            })
+            keys = ['date', 'segment']
+        else:
+            frame = pd.DataFrame({'date': periods, 'revenue': revenue.sum(axis=1),
+                                  'transactions': count.sum(axis=1)})
+            keys = ['date']
+        # Folds days into weeks/months; sorts segments by name within a period
+        frame = frame.groupby(keys, sort=True, as_index=False).sum()
+        frame = frame[frame['transactions'] > 0].reset_index(drop=True)
+        frame['date'] = frame['date'].dt.strftime("%Y-%m-%d")
+        return frame
+
+    def stats(self) -> dict:
+        return {"rows": len(self), "customers": len(self._ids), "days": len(self.revenue),
+                "segments": list(self.segments)}
+
+
+def _revenue_dtype(amounts):
+    return np.int64 if amounts.dtype.kind in 'iub' else np.float64
+
+
+def _encode(ids: pd.Index, customers):
+    """(extended dictionary, slot per row) for new transaction rows."""
+    if isinstance(customers.dtype, pd.CategoricalDtype):
+        # Look up each dictionary entry once, then gather by code
+        cats = customers.cat.categories
+        ids, cat_slots = _encode(ids, pd.Series(np.asarray(cats, dtype=object)))
+        return ids, cat_slots[customers.cat.codes]
+    values = pd.Index(np.asarray(customers, dtype=object))
+    slots = ids.get_indexer(values)
+    unseen = slots < 0
+    if unseen.any():
+        ids = ids.append(values[unseen].unique())
+        slots[unseen] = ids.get_indexer(values[unseen])
+    return ids, slots.astype(np.int32)
+
+
+def _add(grid, grid_count, days, cols, amounts, sign=1):
+    keep = cols >= 0  # customers missing from the RFM table
+    flat = days[keep] * grid.shape[1] + cols[keep]
+    size = grid.size
+    sums = np.bincount(flat, weights=amounts[keep].astype(np.float64), minlength=size)
+    counts = np.bincount(flat, minlength=size)
+    if grid.dtype.kind == 'f':
+        grid += sign * sums.reshape(grid.shape)
+    else:
+        grid += sign * np.rint(sums).astype(grid.dtype).reshape(grid.shape)
+    grid_count += sign * counts.reshape(grid_count.shape)
@@ -0,0 +1,127 @@
+"""
+Scatter Data - bounded payloads for the RFM scatter, whatever the customer count.
+
+density_grid bins customers on two RFM columns per segment (one bincount)
+and reports counts and monetary totals per non-empty cell, so the payload is
+at most segments x bins x bins rows. StratifiedSampler picks a fixed-size
+sample that keeps each segment's share (every segment gets at least one
+point); its per-state shuffle is done once, so any sample size is O(N).
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+
+def _codes(labels: pd.Series):
+    """(codes, labels) of a segment column, plain or categorical."""
+    if isinstance(labels.dtype, pd.CategoricalDtype):
+        codes = labels.cat.codes.to_numpy().astype(np.int64)
+        return codes, pd.Index(labels.cat.categories, dtype=object)
+    codes, uniques = pd.factorize(labels.to_numpy(dtype=object), sort=True)
+    return codes.astype(np.int64), pd.Index(uniques, dtype=object)
+
+
+def _bins(values: np.ndarray, bins: int):
+    """(start, width, n_bins, bin per value); integer columns get integer-aligned bins."""
+    lo, hi = float(values.min()), float(values.max())
+    if values.dtype.kind in 'iub':
+        width = max(1, math.ceil((hi - lo + 1) / bins))
+        n = math.ceil((hi - lo + 1) / width)
+    else:
+        width = (hi - lo) / bins or 1.0
+        n = bins
+    idx = np.minimum(((values - lo) // width).astype(np.int64), n - 1)
+    return lo, width, n, idx
+
+
+def density_grid(rfm: pd.DataFrame, x='recency', y='frequency', bins: int = 40,
+                 segment_col='segment', value_col='monetary') -> pd.DataFrame:
+    """
+    Customers per (segment, x bin, y bin) with the sum and mean of value_col.
+    Bins are [start, end); empty cells are left out.
+    """
+    columns = [segment_col, f'{x}_start', f'{x}_end', f'{y}_start', f'{y}_end',
+               'customers', f'{value_col}_sum', f'{value_col}_mean']
+    if rfm is None or not len(rfm):
+        return pd.DataFrame(columns=columns)
+
+    codes, labels = _codes(rfm[segment_col])
+    if (codes < 0).any():  # unlabelled rows
+        rfm, codes = rfm[codes >= 0], codes[codes >= 0]
+    x_lo, x_width, nx, xi = _bins(rfm[x].to_numpy(), bins)
+    y_lo, y_width, ny, yi = _bins(rfm[y].to_numpy(), bins)
+
+    flat = (codes * nx + xi) * ny + yi
+    size = len(labels) * nx * ny
+    customers = np.bincount(flat, minlength=size)
+    total = np.bincount(flat, weights=rfm[value_col].to_numpy(dtype=np.float64), minlength=size)
+
+    cells = np.flatnonzero(customers)
+    seg, rest = np.divmod(cells, nx * ny)
+    xb, yb = np.divmod(rest, ny)
+    count = customers[cells]
+    return pd.DataFrame({
+        segment_col: labels[seg].to_numpy(dtype=object),
+        f'{x}_start': np.round(x_lo + xb * x_width, 6),
+        f'{x}_end': np.round(x_lo + (xb + 1) * x_width, 6),
+        f'{y}_start': np.round(y_lo + yb * y_width, 6),
+        f'{y}_end': np.round(y_lo + (yb + 1) * y_width, 6),
+        'customers': count,
+        f'{value_col}_sum': np.round(total[cells], 2),
+        f'{value_col}_mean': np.round(total[cells] / count, 2),
+    }, columns=columns)
+
+
+def _allocate(counts: np.ndarray, size: int) -> np.ndarray:
+    """Rows per group for a sample of `size`: proportional, largest remainder, >= 1 per group."""
+    total = counts.sum()
+    if size >= total:
+        return counts.copy()
+    quota = size * counts / total
+    alloc = np.floor(quota).astype(np.int64)
+    present = counts > 0
+    if size >= present.sum():
+        alloc[present] = np.maximum(alloc[present], 1)
+
+    short = size - alloc.sum()
+    if short > 0:
+        # Largest fractional remainders first, among groups with rows left
+        remainder = np.where(alloc < counts, quota - alloc, -1.0)
+        for g in np.argsort(-remainder, kind='stable')[:short]:
+            alloc[g] += 1
+    while short < 0:
+        # Minimums overshot: take back from the largest allocations
+        g = int(np.argmax(alloc))
+        alloc[g] -= 1
+        short += 1
+    return alloc
+
+
+class StratifiedSampler:
+    """Segment-stratified samples of the RFM table, reproducible per seed."""
+
+    def __init__(self, rfm: pd.DataFrame, segment_col='segment', seed: int = 0):
+        self.rfm = rfm
+        codes, self.segments = _codes(rfm[segment_col])
+        # Unlabelled rows go to a trailing group that is never sampled
+        self._codes = np.where(codes < 0, len(self.segments), codes)
+        rng = np.random.default_rng(seed)
+        # Rows grouped by segment, shuffled within each group
+        self._order = np.lexsort((rng.random(len(rfm)), self._codes))
+        self._counts = np.bincount(self._codes, minlength=len(self.segments) + 1)
+        starts = np.concatenate(([0], np.cumsum(self._counts)[:-1]))
+        self._rank = np.arange(len(rfm)) - starts[self._codes[self._order]]
+
+    def positions(self, size: int, segments=None) -> np.ndarray:
+        """Row positions (ascending) of a sample of at most `size` customers."""
+        counts = self._counts.copy()
+        counts[-1] = 0
+        if segments:
+            counts[:-1][~self.segments.isin(list(segments))] = 0
+        alloc = _allocate(counts, size)
+        take = self._rank < alloc[self._codes[self._order]]
+        return np.sort(self._order[take])
+
+    def sample(self, size: int, segments=None) -> pd.DataFrame:
+        return self.rfm.iloc[self.positions(size, segments)]
@@ -0,0 +1,482 @@
+"""
+Pipeline State Cache - computes transactions, RFM and segments once
+and serves every endpoint from the same snapshot.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait as futures_wait
+from pathlib import Path
+
+import pandas as pd
+
+from pipeline.profiler import STAGES
+
+
+class PipelineState:
+    """Immutable result of one pipeline run."""
+
+    def __init__(self, key, transactions, rfm, build_seconds,
+                 aggregates=None, offset=0, source_id=None, incremental=False):
+        self.key = key
+        self.transactions = transactions
+        self.rfm = rfm
+        self.build_seconds = build_seconds
+        self.built_at = time.time()
+        # Incremental bookkeeping: per-customer aggregates and how far into
+        # the append-only source they reach (bytes for CSV, rows for the
+        # columnar store); source_id changes when the source is rewritten
+        self.aggregates = aggregates
+        self.offset = offset
+        self.source_id = source_id
+        self.incremental = incremental
+        # Lazily built artefacts derived from this state (action table, indexes...)
+        self._derived = {}
+        self._derived_lock = threading.RLock()  # builders may depend on other artefacts
+
+    @property
+    def version(self):
+        """Data version, the same in every process built from the same inputs (key)."""
+        if self.key is None:
+            return repr(self.built_at)
+        return hashlib.sha1(repr(self.key).encode()).hexdigest()[:16]
+
+    def derived(self, name, build):
+        """Returns build(self), computed at most once per state."""
+        value = self._derived.get(name)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = build(self)
+                    self._derived[name] = value
+        return value
+
+
+def _file_identity(path):
+    """(path, mtime_ns, size) or (path, None, None) if the file is missing."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return (str(path), None, None)
+    return (str(path), st.st_mtime_ns, st.st_size)
+
+
+_config_hash_cache = {}
+
+def _config_hash(config_path):
+    """Content hash of config.yaml, recomputed only when its mtime/size change."""
+    ident = _file_identity(config_path)
+    cached = _config_hash_cache.get(config_path)
+    if cached and cached[0] == ident:
+        return cached[1]
+    if ident[1] is None:
+        digest = None
+    else:
+        digest = hashlib.sha1(Path(config_path).read_bytes()).hexdigest()
+    _config_hash_cache[config_path] = (ident, digest)
+    return digest
+
+
+def state_key(transactions_file, config_path):
+    """Identity of the inputs a pipeline run depends on."""
+    return _file_identity(transactions_file) + (_config_hash(config_path),)
+
+
+def _compact_enabled():
+    import config
+    return bool(config.rfm.get('compact', False))
+
+
+def _clustering_enabled():
+    import config
+    return (config.models.get('segmentation') or {}).get('method', 'rules') == 'kmeans'
+
+
+def segment_customers(rfm):
+    """Segment labels by models.segmentation.method: the rule table or k-means clusters."""
+    if _clustering_enabled():
+        from segmentation.clusters import cluster_segments
+        return cluster_segments(rfm, categorical=_compact_enabled())
+    from segmentation.rfm_segments import assign_segments
+    # R/F rules only, as the per-row assign_segment(R, F) call always did
+    return assign_segments(rfm, m_col=None, categorical=_compact_enabled())
+
+
+def _churn_enabled():
+    import config
+    return bool((config.models.get('churn') or {}).get('enabled', False))
+
+
+def _add_churn(df, rfm):
+    """Joins churn_probability/churn_risk into rfm (models.churn.enabled)."""
+    if not _churn_enabled():
+        return rfm
+    from features.churn import score_churn
+    try:
+        scores = score_churn(df, rfm)
+    except ValueError as e:
+        # Too little history to train; rules on the churn columns just don't fire
+        import warnings
+        warnings.warn(f"Churn scoring skipped: {e}")
+        return rfm
+    return rfm.join(scores)
+
+
+def _compact(df, rfm):
+    """Compact dtypes for the cached frames (rfm.compact); ids share one dictionary."""
+    if not _compact_enabled():
+        return df, rfm
+    from features.rfm import compact_transactions, compact_rfm
+    with STAGES.stage("compact", rows=len(rfm)):
+        df = compact_transactions(df)
+        rfm = compact_rfm(rfm, df['customer_id'].cat.categories)
+    return df, rfm
+
+
+def _append_transactions(previous, delta):
+    """previous + delta rows; a compact previous frame keeps its id codes."""
+    col = previous['customer_id']
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        from features.rfm import encode_ids
+        # New ids extend the dictionary, so existing codes stay valid as they are
+        ids = encode_ids(delta['customer_id'], col.cat.categories)
+        delta = delta.assign(customer_id=ids)
+        if ids.dtype != col.dtype:
+            previous = previous.assign(customer_id=pd.Categorical.from_codes(col.cat.codes, dtype=ids.dtype))
+    return pd.concat([previous, delta], ignore_index=True)
+
+
+def _carry_derived(previous, state):
+    """Extends derived tables that support it (the revenue cube) rather than dropping them."""
+    cube = previous._derived.get('revenue_cube')
+    if cube is not None:
+        state._derived['revenue_cube'] = cube.extend(state.transactions, state.rfm)
+    return state
+
+
+def _can_extend(previous, key, source_id, offset):
+    if previous is None or previous.aggregates is None or previous.rfm is None:
+        return False
+    # Config changes (weights, segment rules) require a full rebuild
+    if key is None or previous.key is None or previous.key[-1] != key[-1]:
+        return False
+    return previous.source_id == source_id and previous.offset <= offset
+
+
+def _apply_delta(previous, key, df, delta, offset, source_id, start):
+    """Merges delta into previous's aggregates; only moved customers are re-segmented."""
+    from features.rfm import score_rfm, changed_scores
+
+    if delta.empty:
+        state = PipelineState(key, df, previous.rfm, time.perf_counter() - start,
+                              previous.aggregates, offset, source_id, incremental=True)
+        return _carry_derived(previous, state)
+
+    aggregates = previous.aggregates.copy()
+    with STAGES.stage("rfm_aggregate", rows=len(delta)):
+        aggregates.add_transactions(delta)
+
+    # Quintile rescoring is global but cheap; segment only customers whose bins moved
+    rfm = score_rfm(aggregates.to_frame())
+    if _clustering_enabled():
+        # Clusters use raw recency, which moves for everyone; re-assigning is a cheap predict
+        changed = pd.Series(True, index=rfm.index)
+    else:
+        changed = changed_scores(previous.rfm, rfm)
+    segment = previous.rfm['segment'].reindex(rfm.index)
+    if changed.all():
+        segment = segment_customers(rfm)
+    elif changed.any():
+        fresh = segment_customers(rfm[changed])
+        if isinstance(segment.dtype, pd.CategoricalDtype):
+            # Compact or shared frames: make room for labels the old table never had
+            fresh = fresh.to_numpy(dtype=object)
+            segment = segment.cat.add_categories(
+                pd.Index(fresh).unique().difference(segment.cat.categories))
+        segment[changed] = fresh
+    rfm['segment'] = segment
+    # Recency moves for everyone, so every customer is rescored (one vectorized pass)
+    rfm = _add_churn(df, rfm)
+    df, rfm = _compact(df, rfm)
+
+    state = PipelineState(key, df, rfm, time.perf_counter() - start, aggregates,
+                          offset, source_id, incremental=True)
+    return _carry_derived(previous, state)
+
+
+def _build_full(key, df, offset, source_id, start):
+    from features.rfm import RFMAggregateStore, score_rfm
+    from features.parallel import parallel_workers
+
+    aggregates = RFMAggregateStore()
+    with STAGES.stage("rfm_aggregate", rows=len(df)):
+        aggregates.add_transactions(df, workers=parallel_workers(len(df)))
+    rfm = score_rfm(aggregates.to_frame())
+    rfm['segment'] = segment_customers(rfm)
+    rfm = _add_churn(df, rfm)
+    df, rfm = _compact(df, rfm)
+
+    return PipelineState(key, df, rfm, time.perf_counter() - start, aggregates,
+                         offset, source_id)
+
+
+def _build_from_csv(transactions_file, key, previous, size, start):
+    from features.rfm import read_csv_delta, file_prefix_hash
+
+    if previous is not None and previous.offset <= size:
+        source_id = "csv:" + file_prefix_hash(transactions_file, previous.offset)
+        if _can_extend(previous, key, source_id, size):
+            # Only the bytes appended since previous.offset
+            names = list(previous.transactions.columns)
+            with STAGES.stage("load") as span:
+                delta, offset = read_csv_delta(transactions_file, previous.offset, size, names=names)
+                span.rows = len(delta)
+            # The consumed prefix grew, so its hash may have too
+            source_id = "csv:" + file_prefix_hash(transactions_file, offset)
+            if delta.empty:
+                return _apply_delta(previous, key, previous.transactions, delta, offset, source_id, start)
+            delta['date'] = pd.to_datetime(delta['date'])
+            df = _append_transactions(previous.transactions, delta)
+            return _apply_delta(previous, key, df, delta, offset, source_id, start)
+
+    with STAGES.stage("load") as span:
+        # Bounded read so rows appended mid-build are picked up next time, not twice
+        df, offset = read_csv_delta(transactions_file, 0, size)
+
+        # Parse once so downstream consumers never mutate the shared frame
+        df['date'] = pd.to_datetime(df['date'])
+        span.rows = len(df)
+
+    return _build_full(key, df, offset, "csv:" + file_prefix_hash(transactions_file, offset), start)
+
+
+def _build_from_store(transactions_file, key, previous, start):
+    import config
+    from storage.columnar import ingest_csv, load_transactions
+
+    store_dir = config.storage.transactions_store
+    with STAGES.stage("load") as span:
+        meta = ingest_csv(transactions_file, store_dir, amount_dtype=config.storage.amount_dtype)
+        df = load_transactions(store_dir, meta=meta)
+        span.rows = len(df)
+
+    nrows = meta["nrows"]
+    source_id = "columnar:" + meta["generation"]
+    if _can_extend(previous, key, source_id, nrows):
+        return _apply_delta(previous, key, df, df.iloc[previous.offset:], nrows, source_id, start)
+    return _build_full(key, df, nrows, source_id, start)
+
+
+def read_transactions(transactions_file=None):
+    """
+    All transactions, from the CSV or (storage.format "columnar") the store
+    after syncing it with the CSV. For scripts that need the full history.
+    """
+    import config
+    transactions_file = transactions_file or config.data.transactions_file
+    if config.storage.format == "columnar":
+        from storage.columnar import ingest_csv, load_transactions
+        meta = ingest_csv(transactions_file, config.storage.transactions_store,
+                          amount_dtype=config.storage.amount_dtype)
+        return load_transactions(config.storage.transactions_store, meta=meta)
+    from features.rfm import read_csv_delta
+    df, _ = read_csv_delta(transactions_file)
+    return df
+
+
+def build_pipeline_state(transactions_file, key=None, previous=None):
+    """
+    Runs the pipeline: load -> RFM -> segments.
+
+    Transactions come from the CSV directly or, with storage.format set to
+    "columnar", from the memory-mapped store kept in sync with it. If
+    previous covers a prefix of the same append-only source (and config is
+    unchanged), only the appended rows are merged into its aggregates.
+    Returns a PipelineState whose transactions/rfm are None if the file is
+    missing.
+    """
+    import config
+
+    start = time.perf_counter()
+    try:
+        size = os.stat(transactions_file).st_size
+    except FileNotFoundError:
+        return PipelineState(key, None, None, time.perf_counter() - start)
+
+    with STAGES.stage("pipeline_build") as span:
+        if config.storage.format == "columnar":
+            state = _build_from_store(transactions_file, key, previous, start)
+        else:
+            state = _build_from_csv(transactions_file, key, previous, size, start)
+        span.rows = len(state.transactions) if state.transactions is not None else 0
+    return state
+
+
+class PipelineCache:
+    """
+    Holds the current PipelineState keyed on (path, mtime, size, config hash).
+
+    - Builds run on a dedicated executor, one at a time. Concurrent callers
+      needing the same build share its future (single flight) instead of
+      each recomputing the pipeline.
+    - First request (or a missing state) waits for the build.
+    - When the inputs change, the stale state keeps being served while the
+      rebuild runs; the new state is swapped in atomically.
+    - With a SharedFrameCache, one process builds each version (under its
+      lock) and publishes the frames; every process serves memory-mapped
+      views of the published version instead of a private copy.
+    """
+
+    def __init__(self, transactions_file, config_path, builder=build_pipeline_state,
+                 on_config_change=None, executor=None, shared=None):
+        self.transactions_file = transactions_file
+        self.config_path = config_path
+        self._builder = builder
+        self._on_config_change = on_config_change  # e.g. config.reload
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+        self._state = None
+        self._lock = threading.Lock()
+        self._inflight = None  # (key, Future) of the running build
+        self._shared = shared
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.rebuilds = 0
+        self.attaches = 0
+        self.rebuild_errors = 0
+        self.last_rebuild_seconds = None
+        self.total_rebuild_seconds = 0.0
+
+    def _build(self, key):
+        prev = self._state
+        # Last key element is the config hash
+        if self._on_config_change is not None and prev is not None and prev.key[-1] != key[-1]:
+            self._on_config_change()
+        try:
+            if self._shared is None:
+                state = self._run_builder(key, prev)
+            else:
+                state = self._build_shared(key, prev)
+        except Exception:
+            self.rebuild_errors += 1
+            with self._lock:
+                self._inflight = None
+            raise
+        with self._lock:
+            # Swap before clearing so no caller sees stale state with no build running
+            self._state = state  # single reference swap
+            self._inflight = None
+        return state
+
+    def _run_builder(self, key, prev):
+        state = self._builder(self.transactions_file, key=key, previous=prev)
+        self.rebuilds += 1
+        self.last_rebuild_seconds = state.build_seconds
+        self.total_rebuild_seconds += state.build_seconds
+        return state
+
+    def _build_shared(self, key, prev):
+        state = self._attach(key, prev)
+        if state is not None:
+            return state
+        with self._shared.build_lock():
+            # Another process may have published these inputs while we waited
+            state = self._attach(key, prev)
+            if state is not None:
+                return state
+            state = self._run_builder(key, prev)
+            if state.rfm is None:
+                return state
+            self._shared.publish(
+                {"transactions": state.transactions, "rfm": state.rfm}, key,
+                {"build_seconds": state.build_seconds, "offset": state.offset,
+                 "source_id": state.source_id, "incremental": state.incremental})
+        # Serve the mapped copy too; our aggregates keep the next build incremental
+        attached = self._attach(key, prev, aggregates=state.aggregates)
+        if attached is None:
+            return state
+        if 'revenue_cube' in state._derived:
+            attached._derived['revenue_cube'] = state._derived['revenue_cube']
+        return attached
+
+    def _attach(self, key, prev, aggregates=None):
+        """PipelineState over the published frames for `key`, or None."""
+        with STAGES.stage("shared_attach", memory=False):
+            found = self._shared.attach(key)
+        if found is None:
+            return None
+        frames, info = found
+        self.attaches += 1
+        if aggregates is None and prev is not None and prev.source_id == info["source_id"] \
+                and prev.offset == info["offset"]:
+            aggregates = prev.aggregates
+        return PipelineState(key, frames["transactions"], frames["rfm"], info["build_seconds"],
+                             aggregates, info["offset"], info["source_id"], info["incremental"])
+
+    def _submit(self, key) -> Future:
+        """Future for the build of `key`, joining the in-flight one if any."""
+        with self._lock:
+            if self._inflight is not None:
+                self.coalesced += 1
+                return self._inflight[1]
+            future = self._executor.submit(self._build, key)
+            self._inflight = (key, future)
+            return future
+
+    def _lookup(self):
+        """(state, None) when servable now, else (None, future to wait on)."""
+        key = state_key(self.transactions_file, self.config_path)
+        state = self._state
+
+        if state is not None and state.key == key:
+            self.hits += 1
+            return state, None
+
+        self.misses += 1
+        future = self._submit(key)
+        if state is None:
+            # Cold start: everyone waits for the same build
+            return None, future
+        # Inputs changed: serve stale while the rebuild runs
+        return state, None
+
+    def get(self) -> PipelineState:
+        with STAGES.stage("get_data_state", memory=False):
+            state, future = self._lookup()
+            return state if future is None else future.result()
+
+    async def get_async(self) -> PipelineState:
+        """Like get(), but waits for a cold build without blocking the event loop."""
+        with STAGES.stage("get_data_state", memory=False):
+            state, future = self._lookup()
+            return state if future is None else await asyncio.wrap_future(future)
+
+    def wait(self, timeout=None):
+        """Blocks until any in-flight rebuild finishes."""
+        inflight = self._inflight
+        if inflight is not None:
+            futures_wait([inflight[1]], timeout)
+
+    def invalidate(self):
+        self._state = None
+
+    def stats(self) -> dict:
+        state = self._state
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "rebuilds": self.rebuilds,
+            "attaches": self.attaches,
+            "rebuild_errors": self.rebuild_errors,
+            "last_rebuild_seconds": self.last_rebuild_seconds,
+            "total_rebuild_seconds": round(self.total_rebuild_seconds, 6),
+            "rebuilding": self._inflight is not None,
+            "built_at": state.built_at if state else None,
+            "key": list(state.key) if state and state.key else None,
+            "shared": self._shared.stats() if self._shared is not None else None,
+        }
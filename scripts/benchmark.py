@@ -0,0 +1,228 @@
+"""
+Pipeline benchmark: times each stage across dataset sizes.
+
+Stages: load (CSV, or the columnar store with --columnar), rfm, segmentation
+(rule table), k-means segmentation fit and assignment (for comparison),
+churn model training and scoring, actions, drift, api serialization. Data comes from the seeded generator and
+is cached under --data-dir, so repeated runs time the same inputs.
+
+Every run appends one JSON line per size to --results (commit, versions,
+CPU count, stage seconds). With --compare, each stage is checked against the
+previous run of the same size/seed and the script exits 1 if any stage got
+slower than --threshold times its previous time.
+
+    python scripts/benchmark.py --sizes 100000,1000000,10000000 --compare
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config
+from actions.action_engine import evaluate_actions, top_actions
+from drift.segment_drift import calculate_drift
+from drift.snapshots import SnapshotStore, encode_labels, transition_matrix
+from features.churn import ChurnModel, churn_features
+from features.parallel import parallel_workers
+from features.rfm import RFMAggregateStore, read_csv_delta, score_rfm
+from pipeline.paging import ndjson_stream, iter_blocks
+from segmentation.clusters import ClusterSegmenter
+from segmentation.rfm_segments import assign_segments, segment_counts
+from storage.columnar import build_store, load_transactions, read_meta
+from generate_demo_data import TransactionModel, write_csv
+
+END_DATE = "2026-01-31"  # fixed so cached inputs don't depend on the run date
+
+
+def _timed(timings, name, fn, repeat=1):
+    """Runs fn `repeat` times; records the best time and returns the last result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    timings[name] = round(best, 6)
+    return result
+
+
+def _dataset(rows, customers, seed, data_dir, columnar):
+    """Path of the cached CSV (or store dir) for this size, generating it if needed."""
+    name = f"tx-{rows}-{customers}-{seed}"
+    path = os.path.join(data_dir, name + (".store" if columnar else ".csv"))
+    if columnar and read_meta(path) is not None:
+        return path
+    if not columnar and os.path.exists(path):
+        return path
+    model = TransactionModel(customers, end_date=END_DATE, seed=seed)
+    if columnar:
+        build_store(model.chunks(rows), path)
+    else:
+        tmp = path + ".tmp"
+        write_csv(model.chunks(rows), tmp)
+        os.replace(tmp, path)
+    return path
+
+
+def _load(path, columnar):
+    if columnar:
+        return load_transactions(path)
+    df, _ = read_csv_delta(path)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def _rfm(df):
+    store = RFMAggregateStore()
+    store.add_transactions(df, workers=parallel_workers(len(df)))
+    return score_rfm(store.to_frame())
+
+
+def _drift(rfm, snapshots_dir):
+    store = SnapshotStore(snapshots_dir)
+    store.save(rfm, "2026-01-01")
+    matrix = transition_matrix(store.load("2026-01-01"), encode_labels(rfm, store))
+    counts = segment_counts(rfm)
+    return matrix, calculate_drift(counts, store.counts("2026-01-01"))
+
+
+def _serialize(rfm, actions):
+    # What /rfm-details and /actions do: records -> JSON, plus an NDJSON stream
+    size = len(json.dumps(rfm.reset_index().to_dict(orient='records'), default=str))
+    size += len(json.dumps(actions.to_dict(orient='records'), default=str))
+    size += sum(len(part) for part in ndjson_stream(iter_blocks(rfm.reset_index())))
+    return size
+
+
+def run_size(rows, customers, seed, data_dir, columnar=False, repeat=1) -> dict:
+    path = _dataset(rows, customers, seed, data_dir, columnar)
+    timings = {}
+
+    df = _timed(timings, "load", lambda: _load(path, columnar), repeat)
+    rfm = _timed(timings, "rfm", lambda: _rfm(df), repeat)
+    rfm['segment'] = _timed(timings, "segmentation", lambda: assign_segments(rfm, m_col=None), repeat)
+    clusters = config.models.get('segmentation') or {}
+    model = _timed(timings, "kmeans_fit", lambda: ClusterSegmenter.fit(
+        rfm, int(clusters.get('n_clusters', 4)), fit_sample=int(clusters.get('fit_sample', 200_000)),
+        batch_size=int(clusters.get('batch_size', 4096))), repeat)
+    _timed(timings, "kmeans_assign", lambda: model.assign(rfm), repeat)
+    churn = config.models.get('churn') or {}
+    churn_model = _timed(timings, "churn_train", lambda: ChurnModel.train(
+        df, int(churn.get('horizon_days', 90)), int(churn.get('training_snapshots', 4)),
+        int(churn.get('snapshot_step_days', 30)), int(churn.get('window_days', 90)),
+        max_rows=int(churn.get('max_train_rows', 500_000))), repeat)
+    _timed(timings, "churn_score", lambda: churn_model.predict_proba(
+        churn_features(df, rfm=rfm, window_days=churn_model.window_days)), repeat)
+    actions = _timed(
+        timings, "actions",
+        lambda: top_actions(evaluate_actions(rfm), config.actions.top_k), repeat)
+    with tempfile.TemporaryDirectory() as snapshots_dir:
+        _timed(timings, "drift", lambda: _drift(rfm, snapshots_dir), repeat)
+    _timed(timings, "api_serialization", lambda: _serialize(rfm, actions), repeat)
+
+    return {
+        "rows": rows,
+        "customers": customers,
+        "customers_scored": int(len(rfm)),
+        "seed": seed,
+        "source": "columnar" if columnar else "csv",
+        "workers": parallel_workers(len(df)),
+        "stages": timings,
+        "total": round(sum(timings.values()), 6),
+    }
+
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=Path(__file__).parent.parent).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+        "machine": platform.machine(),
+    }
+
+
+def _previous(results_path, record):
+    """Last recorded run with the same inputs, or None."""
+    if not os.path.exists(results_path):
+        return None
+    match = None
+    with open(results_path) as f:
+        for line in f:
+            prev = json.loads(line)
+            if all(prev.get(k) == record[k] for k in ("rows", "customers", "seed", "source")):
+                match = prev
+    return match
+
+
+def compare(previous, record, threshold) -> list:
+    """Stages slower than threshold x their previous time, as (stage, before, after)."""
+    slower = []
+    for stage, seconds in record["stages"].items():
+        before = previous["stages"].get(stage)
+        if before and seconds > before * threshold:
+            slower.append((stage, before, seconds))
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default="100000,1000000", help="comma-separated transaction counts")
+    parser.add_argument("--customers-per-txn", type=float, default=0.05,
+                        help="customers as a fraction of transactions")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage (best is kept)")
+    parser.add_argument("--columnar", action="store_true", help="load from the columnar store instead of CSV")
+    parser.add_argument("--data-dir", default="data/bench")
+    parser.add_argument("--results", default="data/bench/results.jsonl")
+    parser.add_argument("--compare", action="store_true", help="check against the previous run")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+    env = _environment()
+    regressions = []
+
+    for rows in (int(s) for s in args.sizes.split(",") if s.strip()):
+        customers = max(1, int(rows * args.customers_per_txn))
+        record = {**env, **run_size(rows, customers, args.seed, args.data_dir, args.columnar, args.repeat)}
+        previous = _previous(args.results, record) if args.compare else None
+
+        print(f"\n{rows:,} transactions / {customers:,} customers ({record['source']}, "
+              f"{record['workers']} worker(s))")
+        for stage, seconds in record["stages"].items():
+            line = f"  {stage:<18} {seconds:10.3f}s"
+            if previous and previous["stages"].get(stage):
+                line += f"   x{seconds / previous['stages'][stage]:.2f} vs {previous['commit']}"
+            print(line)
+        print(f"  {'total':<18} {record['total']:10.3f}s")
+
+        if previous:
+            regressions += [(rows,) + r for r in compare(previous, record, args.threshold)]
+        with open(args.results, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    print(f"\nResults appended to {args.results}")
+    if regressions:
+        print("\nRegressions:")
+        for rows, stage, before, after in regressions:
+            print(f"  {rows:,} rows  {stage}: {before:.3f}s -> {after:.3f}s")
+        sys.exit(1)
@@ -1,49 +1,143 @@
 """
 Demo Data Generator for Testing end-to-end flow
+
+Vectorized and seeded, so it scales to 100M+ transactions (written in
+chunks) with realistic shape:
+    - cohorts: customers sign up over the whole period, with growth
+    - churn: each customer stays active for an exponential lifetime
+    - frequency: per-customer purchase rates are gamma distributed
+    - seasonality: weekly cycle plus a year-end peak
+    - spend: log-normal per customer and per transaction (heavy tail)
+
+Same seed + chunk_rows gives the same data.
+
+    python scripts/generate_demo_data.py                      # demo CSV
+    python scripts/generate_demo_data.py --transactions 100000000 \\
+        --customers 5000000 --format columnar --out data/bench/store
 """
-import pandas as pd
-import numpy as np
+import argparse
 import os
-from datetime import datetime, timedelta
-
-def generate_transactions(num_customers=500, num_txns=2000):
-    """Generates customer_id, date, amount CSV"""
-    
-    # Customers
-    c_ids = [f"C{str(i).zfill(3)}" for i in range(1, num_customers+1)]
-    
-    # Transaction data
-    data = []
-    
-    # Ensure some variety for segments
-    # High value group
-    for _ in range(int(num_txns * 0.4)):
-        c_id = np.random.choice(c_ids[:100]) # First 100 are potential high value
-        date = datetime.now() - timedelta(days=np.random.randint(0, 30))
-        amt = np.random.randint(100, 500)
-        data.append([c_id, date, amt])
-        
-    # Churning group
-    for _ in range(int(num_txns * 0.3)):
-        c_id = np.random.choice(c_ids[100:300]) 
-        date = datetime.now() - timedelta(days=np.random.randint(60, 120))
-        amt = np.random.randint(20, 100)
-        data.append([c_id, date, amt])
-        
-    # Recent low freq group
-    for _ in range(int(num_txns * 0.3)):
-        c_id = np.random.choice(c_ids[300:]) 
-        date = datetime.now() - timedelta(days=np.random.randint(0, 10))
-        amt = np.random.randint(10, 50)
-        data.append([c_id, date, amt])
-        
-    df = pd.DataFrame(data, columns=['customer_id', 'date', 'amount'])
-    
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+DAY_NS = 86_400 * 10**9
+
+
+def _customer_ids(n):
+    width = max(3, len(str(n)))
+    return np.char.add("C", np.char.zfill(np.arange(1, n + 1).astype(str), width)).astype(object)
+
+
+def _day_intensity(days, start):
+    """Relative purchase volume per calendar day: weekly cycle, year-end peak, growth."""
+    dates = pd.date_range(start, periods=days, freq="D")
+    weekly = np.array([0.9, 0.85, 0.9, 1.0, 1.15, 1.3, 1.1])[dates.dayofweek]
+    doy = dates.dayofyear.to_numpy()
+    peak = 1 + 0.6 * np.exp(-0.5 * ((doy - 340) / 15.0) ** 2)
+    growth = np.linspace(0.8, 1.2, days)
+    return weekly * peak * growth
+
+
+class TransactionModel:
+    """Customer population plus the calendar; transactions are sampled from it in chunks."""
+
+    def __init__(self, num_customers, days=365, end_date=None, seed=None):
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        end = pd.Timestamp(end_date) if end_date is not None else pd.Timestamp.now().normalize()
+        self.start = end - pd.Timedelta(days=days - 1)
+        self.days = days
+
+        intensity = _day_intensity(days, self.start)
+        self._cdf = np.concatenate(([0.0], np.cumsum(intensity)))
+        self._cdf /= self._cdf[-1]
+
+        # Cohorts: more signups later (growth), a fifth already active at the start
+        signup = np.where(rng.random(num_customers) < 0.2, 0,
+                          (days * np.sqrt(rng.random(num_customers))).astype(np.int64))
+        lifetime = rng.exponential(days * 0.6, num_customers).astype(np.int64) + 1
+        self.first_day = np.minimum(signup, days - 1)
+        self.last_day = np.minimum(self.first_day + lifetime, days)  # exclusive
+
+        rate = rng.gamma(0.7, 1.0, num_customers)
+        weight = rate * (self._cdf[self.last_day] - self._cdf[self.first_day])
+        self._cust_cdf = np.cumsum(weight) / weight.sum()
+
+        self.spend_scale = rng.lognormal(np.log(40), 0.9, num_customers)
+        self.ids = _customer_ids(num_customers)
+
+    def sample(self, n, rng) -> pd.DataFrame:
+        cust = np.searchsorted(self._cust_cdf, rng.random(n), side="right")
+        cust = np.minimum(cust, len(self._cust_cdf) - 1)
+
+        # Inverse-CDF draw from the seasonal calendar, restricted to the customer's active window
+        lo, hi = self._cdf[self.first_day[cust]], self._cdf[self.last_day[cust]]
+        day = np.searchsorted(self._cdf, lo + rng.random(n) * (hi - lo), side="right") - 1
+        day = np.clip(day, self.first_day[cust], self.last_day[cust] - 1)
+        ns = self.start.value + day * DAY_NS + rng.integers(8 * 3600, 22 * 3600, n) * 10**9
+
+        amount = np.round(self.spend_scale[cust] * rng.lognormal(0, 0.5, n), 2)
+        return pd.DataFrame({
+            "customer_id": self.ids[cust],
+            "date": ns.view("datetime64[ns]"),
+            "amount": np.maximum(amount, 1.0),
+        })
+
+    def chunks(self, num_txns, chunk_rows=1_000_000):
+        """Yields DataFrames totalling num_txns rows; each chunk has its own child seed."""
+        n_chunks = max(1, -(-num_txns // chunk_rows))
+        seeds = np.random.SeedSequence(self.seed).spawn(n_chunks + 1)[1:]
+        for i, ss in enumerate(seeds):
+            n = min(chunk_rows, num_txns - i * chunk_rows)
+            if n > 0:
+                yield self.sample(n, np.random.default_rng(ss))
+
+
+def generate_transactions(num_customers=500, num_txns=2000, seed=None, days=365, end_date=None):
+    """Generates customer_id, date, amount as one DataFrame"""
+    model = TransactionModel(num_customers, days=days, end_date=end_date, seed=seed)
+    df = pd.concat(model.chunks(num_txns), ignore_index=True)
     print(f"Generated {len(df)} transactions for {num_customers} customers.")
     return df
 
+
+def write_csv(chunks, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    rows = 0
+    with open(path, "w", newline="") as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, index=False, header=i == 0, date_format="%Y-%m-%d %H:%M:%S")
+            rows += len(chunk)
+    return rows
+
+
+def write_columnar(chunks, store_dir, amount_dtype="float32"):
+    from storage.columnar import build_store
+    return build_store(chunks, store_dir, amount_dtype=amount_dtype)["nrows"]
+
+
 if __name__ == "__main__":
-    os.makedirs('data/raw', exist_ok=True)
-    df = generate_transactions()
-    df.to_csv('data/raw/demo_transactions.csv', index=False)
-    print("Saved to data/raw/demo_transactions.csv")
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--transactions", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--end-date", default=None, help="last day of data (default: today)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=("csv", "columnar"), default="csv")
+    parser.add_argument("--out", default="data/raw/demo_transactions.csv")
+    args = parser.parse_args()
+
+    model = TransactionModel(args.customers, days=args.days, end_date=args.end_date, seed=args.seed)
+    chunks = model.chunks(args.transactions, args.chunk_rows)
+    if args.format == "csv":
+        rows = write_csv(chunks, args.out)
+    else:
+        rows = write_columnar(chunks, args.out)
+    print(f"Generated {rows} transactions for {args.customers} customers.")
+    print(f"Saved to {args.out}")
@@ -0,0 +1,68 @@
+"""
+Import-time benchmark: cold import cost of the modules API workers, cron
+jobs and the dashboard load at startup.
+
+Each module is imported in a fresh interpreter (so nothing is cached in
+sys.modules), --repeat times; the best and median wall time of the import
+statement itself are reported, without interpreter startup. With --top N,
+the N slowest modules by self time (python -X importtime) are listed too.
+
+    python scripts/import_benchmark.py --modules config,features.rfm,api --top 10
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+DEFAULT_MODULES = "config,features.rfm,segmentation.rfm_segments,pipeline.state,api"
+
+_TIMER = ("import time; _t = time.perf_counter(); import {module}; "
+          "print(time.perf_counter() - _t)")
+
+
+def time_import(module, repeat=5) -> list:
+    """Seconds to import `module` in each of `repeat` fresh interpreters."""
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _TIMER.format(module=module)],
+                             cwd=ROOT, capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def slowest_imports(module, top=10) -> list:
+    """(self seconds, cumulative seconds, name) of the slowest imports under `module`."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us) / 1e6, int(cumulative_us) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--modules", default=DEFAULT_MODULES, help="comma-separated module names")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=0, help="also list the N slowest imports")
+    parser.add_argument("--json", action="store_true", help="print one JSON line per module")
+    args = parser.parse_args()
+
+    for module in (m.strip() for m in args.modules.split(",") if m.strip()):
+        times = time_import(module, args.repeat)
+        record = {"module": module, "best": round(min(times), 6),
+                  "median": round(statistics.median(times), 6), "repeat": args.repeat}
+        if args.json:
+            print(json.dumps(record))
+        else:
+            print(f"{module:<28} best {record['best'] * 1000:8.1f} ms   "
+                  f"median {record['median'] * 1000:8.1f} ms")
+        if args.top:
+            for self_s, cumulative_s, name in slowest_imports(module, args.top):
+                print(f"    {self_s * 1000:8.1f} ms self  {cumulative_s * 1000:8.1f} ms total  {name}")
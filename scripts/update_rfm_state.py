@@ -0,0 +1,62 @@
+"""
+Nightly incremental RFM update.
+
+Loads the persisted per-customer aggregates, applies only the transactions
+appended since the last run, rescores, saves the state back and records
+today's segment snapshot for drift tracking.
+"""
+import os
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import config
+from features.rfm import RFMAggregateStore, read_csv_delta, score_rfm, file_prefix_hash
+from pipeline.state import segment_customers
+from drift.snapshots import SnapshotStore
+
+def update_rfm_state(transactions_file, state_file, snapshots_dir=None):
+    """Returns the rescored RFM frame after applying the new delta."""
+    start = time.perf_counter()
+    size = os.stat(transactions_file).st_size
+
+    store, meta = None, {}
+    if os.path.exists(state_file):
+        store, meta = RFMAggregateStore.load(state_file)
+
+    offset = meta.get('offset', 0)
+    if (store is None or meta.get('source') != str(transactions_file) or size < offset
+            or meta.get('prefix_hash') != file_prefix_hash(transactions_file, offset)):
+        # No usable state (first run, different or rewritten file)
+        store, offset = RFMAggregateStore(), 0
+
+    if offset == 0:
+        delta, offset = read_csv_delta(transactions_file, 0, size)
+        names = list(delta.columns)
+    else:
+        names = meta['columns']
+        delta, offset = read_csv_delta(transactions_file, offset, size, names=names)
+
+    if not delta.empty:
+        store.add_transactions(delta)
+
+    os.makedirs(os.path.dirname(state_file) or '.', exist_ok=True)
+    prefix = file_prefix_hash(transactions_file, offset)
+    store.save(state_file, source=str(transactions_file), prefix_hash=prefix,
+               offset=offset, columns=names)
+
+    rfm = score_rfm(store.to_frame())
+    rfm['segment'] = segment_customers(rfm)
+    if snapshots_dir:
+        SnapshotStore(snapshots_dir).save(rfm, date.today().isoformat())
+
+    print(f"Applied {len(delta)} new transactions; {len(store)} customers "
+          f"in {time.perf_counter() - start:.2f}s")
+    return rfm
+
+if __name__ == "__main__":
+    update_rfm_state(config.data.transactions_file, config.data.rfm_state_file,
+                     config.drift.snapshots_dir)
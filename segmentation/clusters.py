@@ -0,0 +1,172 @@
+"""
+Cluster Segmentation - k-means segments over standardized RFM features.
+
+Alternative to the rule table (models.segmentation.method: kmeans).
+Recency, frequency and monetary are log1p-transformed and standardized;
+MiniBatchKMeans is fitted on a uniform sample of at most fit_sample
+customers, so fitting cost stays flat as the customer base grows.
+Assignment is a chunked nearest-centre search in NumPy over everyone.
+
+The fitted model (centres, scaling, labels) is saved as an .npz under
+models.dir and reused by later pipeline runs; incremental runs only
+re-assign. Clusters are ordered by value (recent, frequent, high spend
+first) and named from models.segmentation.labels, else "Cluster 1..k".
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from pipeline.profiler import STAGES
+
+FEATURES = ('recency', 'frequency', 'monetary')
+MODEL_FILE = "segmentation_kmeans.npz"
+FORMAT_VERSION = 1
+PREDICT_CHUNK = 1_000_000
+
+
+def _names(labels, n_clusters):
+    """Configured labels if there is one per cluster, else Cluster 1..k."""
+    if labels and len(labels) == n_clusters:
+        if len(set(labels)) != n_clusters:
+            raise ValueError(f"models.segmentation.labels must be distinct, got {labels}")
+        return list(labels)
+    return [f"Cluster {i + 1}" for i in range(n_clusters)]
+
+
+class ClusterSegmenter:
+    def __init__(self, centers, mean, scale, labels, fitted_rows=0):
+        self.centers = np.asarray(centers, dtype=np.float64)  # standardized space
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.labels = list(labels)
+        self.fitted_rows = int(fitted_rows)
+
+    @property
+    def n_clusters(self):
+        return len(self.centers)
+
+    @staticmethod
+    def _features(rfm: pd.DataFrame) -> np.ndarray:
+        x = np.column_stack([rfm[c].to_numpy(dtype=np.float64) for c in FEATURES])
+        return np.log1p(np.maximum(x, 0))  # refunds can push monetary below zero
+
+    def _transform(self, rfm):
+        return (self._features(rfm) - self.mean) / self.scale
+
+    # --- Fitting ---
+    @classmethod
+    @STAGES.instrument("cluster_fit")
+    def fit(cls, rfm: pd.DataFrame, n_clusters: int = 4, labels=None, fit_sample: int = 200_000,
+            batch_size: int = 4096, seed: int = 0) -> "ClusterSegmenter":
+        try:
+            from sklearn.cluster import MiniBatchKMeans
+        except ImportError:
+            raise ImportError("models.segmentation.method 'kmeans' requires scikit-learn")
+        if len(rfm) < n_clusters:
+            raise ValueError(f"Need at least {n_clusters} customers to fit {n_clusters} clusters")
+
+        rng = np.random.default_rng(seed)
+        if len(rfm) > fit_sample:
+            rfm = rfm.iloc[np.sort(rng.choice(len(rfm), fit_sample, replace=False))]
+        x = cls._features(rfm)
+        mean = x.mean(axis=0)
+        scale = x.std(axis=0)
+        scale[scale == 0] = 1.0
+        x = (x - mean) / scale
+
+        km = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, n_init=3,
+                             random_state=seed).fit(x)
+        centers = km.cluster_centers_
+        # Most valuable first: recent (low recency), frequent, high spend
+        value = -centers[:, 0] + centers[:, 1] + centers[:, 2]
+        centers = centers[np.argsort(-value, kind='stable')]
+
+        return cls(centers, mean, scale, _names(labels, n_clusters), fitted_rows=len(rfm))
+
+    # --- Assignment ---
+    def predict(self, rfm: pd.DataFrame) -> np.ndarray:
+        """Cluster index per row (nearest centre), in chunks of PREDICT_CHUNK rows."""
+        codes = np.empty(len(rfm), dtype=np.int16)
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2; |x|^2 doesn't change the argmin
+        c2 = (self.centers ** 2).sum(axis=1)
+        for lo in range(0, len(rfm), PREDICT_CHUNK):
+            x = self._transform(rfm.iloc[lo:lo + PREDICT_CHUNK])
+            codes[lo:lo + len(x)] = np.argmin(c2 - 2 * x @ self.centers.T, axis=1)
+        return codes
+
+    @STAGES.instrument("cluster_assign", rows=len)
+    def assign(self, rfm: pd.DataFrame, categorical: bool = False) -> pd.Series:
+        """Segment label per customer, like assign_segments."""
+        codes = self.predict(rfm)
+        names = pd.Index(self.labels, dtype=object)
+        if categorical:
+            values = pd.Categorical.from_codes(codes, categories=names)
+        else:
+            values = names.to_numpy()[codes]
+        return pd.Series(values, index=rfm.index, name='segment')
+
+    # --- Persistence ---
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, format=FORMAT_VERSION, centers=self.centers, mean=self.mean, scale=self.scale,
+                     labels=np.array(self.labels, dtype=str), fitted_rows=self.fitted_rows)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """The saved model, or None if missing or in an older format."""
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                if int(z['format']) != FORMAT_VERSION:
+                    return None
+                return cls(z['centers'], z['mean'], z['scale'], z['labels'].tolist(), z['fitted_rows'])
+        except FileNotFoundError:
+            return None
+
+
+_model_cache = {}
+
+def model_path():
+    import config
+    return os.path.join(config.models.get('dir', 'models'), MODEL_FILE)
+
+
+def load_or_fit(rfm: pd.DataFrame, refit: bool = False) -> ClusterSegmenter:
+    """
+    The model at model_path() if it matches models.segmentation (cluster
+    count, labels); otherwise fits one on rfm and saves it.
+    """
+    import config
+    settings = config.models.get('segmentation') or {}
+    n_clusters = int(settings.get('n_clusters', 4))
+    labels = list(settings.get('labels') or ()) or None
+    path = model_path()
+
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        stamp = None
+    model = None
+    if not refit and stamp is not None:
+        cached = _model_cache.get(path)
+        model = cached[1] if cached and cached[0] == stamp else ClusterSegmenter.load(path)
+        if model is not None and model.labels != _names(labels, n_clusters):
+            model = None
+
+    if model is None:
+        model = ClusterSegmenter.fit(rfm, n_clusters, labels,
+                                     fit_sample=int(settings.get('fit_sample', 200_000)),
+                                     batch_size=int(settings.get('batch_size', 4096)),
+                                     seed=int(settings.get('seed', 0)))
+        model.save(path)
+        stamp = os.stat(path).st_mtime_ns
+    _model_cache[path] = (stamp, model)
+    return model
+
+
+def cluster_segments(rfm: pd.DataFrame, categorical: bool = False) -> pd.Series:
+    """Segment labels from the saved (or freshly fitted) cluster model."""
+    return load_or_fit(rfm).assign(rfm, categorical=categorical)
@@ -1,13 +1,13 @@
 """
 RFM Segmentation Logic
 """
+import config
+from pipeline.profiler import STAGES
 
 def assign_segment(r: int, f: int, m: int = None) -> str:
     """
     Assigns segment based on R and F scores using rules from config.yaml.
     """
-    import config
-    
     # Iterate through segments defined in config
     # The order in yaml determines priority if ranges overlap
     for seg in config.rfm.segments:
@@ -31,3 +31,118 @@ def assign_segment(r: int, f: int, m: int = None) -> str:
         return seg['name']
         
     return "Needs Attention"
+
+FALLBACK_SEGMENT = "Needs Attention"
+
+_table_cache = {}
+_last_rules = (None, None)  # (config segments tuple, its key); config is frozen
+
+def _rules_key(segments) -> tuple:
+    """Hashable snapshot of the YAML rules (config may be reloaded)."""
+    return tuple(
+        (seg['name'],
+         tuple(seg.get('r_range')),
+         tuple(seg.get('f_range')),
+         tuple(seg.get('m_range')) if seg.get('m_range') else None)
+        for seg in segments
+    )
+
+def compile_segment_table(segments, n_bins: int = 5, use_monetary: bool = True):
+    """
+    Compiles segment rules into a lookup table over (R, F, M) scores.
+
+    Returns (labels, table) where labels is an object array of segment names
+    (fallback last) and table[r, f, m] is the index into labels. Scores are
+    used directly as indices, so axis 0 is unused. Rules are painted in
+    reverse order so the first matching rule wins, as in assign_segment.
+    """
+    global _last_rules
+    if _last_rules[0] is segments:
+        rules = _last_rules[1]
+    else:
+        rules = _rules_key(segments)
+        if isinstance(segments, tuple):
+            _last_rules = (segments, rules)
+    cache_key = (rules, n_bins, use_monetary)
+    if cache_key in _table_cache:
+        return _table_cache[cache_key]
+
+    import numpy as np
+
+    labels = np.array([r[0] for r in rules] + [FALLBACK_SEGMENT], dtype=object)
+    table = np.full((n_bins + 1,) * 3, len(rules), dtype=np.int16)
+
+    for idx in range(len(rules) - 1, -1, -1):
+        _, r_range, f_range, m_range = rules[idx]
+        r_sl = slice(max(r_range[0], 1), min(r_range[1], n_bins) + 1)
+        f_sl = slice(max(f_range[0], 1), min(f_range[1], n_bins) + 1)
+        if use_monetary and m_range:
+            m_sl = slice(max(m_range[0], 1), min(m_range[1], n_bins) + 1)
+        else:
+            m_sl = slice(1, n_bins + 1)
+        table[r_sl, f_sl, m_sl] = idx
+
+    _table_cache[cache_key] = (labels, table)
+    return labels, table
+
+@STAGES.instrument("segmentation", rows=len)
+def assign_segments(rfm, r_col: str = 'R', f_col: str = 'F', m_col: str = 'M',
+                    categorical: bool = False):
+    """
+    Batch version of assign_segment: labels every row of an RFM frame with
+    one NumPy gather. Pass m_col=None to ignore the monetary ranges, which
+    matches assign_segment(r, f) called without m. categorical=True returns
+    a categorical over every configured label (plus the fallback).
+    """
+    import numpy as np
+    import pandas as pd
+
+    r = rfm[r_col].to_numpy(dtype=np.intp)
+    f = rfm[f_col].to_numpy(dtype=np.intp)
+    use_monetary = m_col is not None
+    m = rfm[m_col].to_numpy(dtype=np.intp) if use_monetary else np.ones_like(r)
+
+    n_bins = 5
+    if len(r):
+        n_bins = max(n_bins, int(r.max()), int(f.max()), int(m.max()))
+
+    labels, table = compile_segment_table(config.rfm.segments, n_bins, use_monetary)
+    codes = table[r, f, m]
+    if categorical:
+        # Rule names may repeat; map codes onto the distinct labels
+        uniques, remap = np.unique(labels.astype(str), return_inverse=True)
+        values = pd.Categorical.from_codes(remap[codes], categories=pd.Index(uniques, dtype=object))
+        return pd.Series(values, index=rfm.index, name='segment')
+    return pd.Series(labels[codes], index=rfm.index, name='segment')
+
+def segment_counts(rfm, segment_col: str = 'segment') -> dict:
+    """
+    Customers per segment label. A categorical segment column lists every
+    configured label, so labels without customers are dropped.
+    """
+    counts = rfm[segment_col].value_counts()
+    return counts[counts > 0].to_dict()
+
+PROFILE_COLUMNS = ('recency', 'frequency', 'monetary', 'R', 'F', 'M', 'rfm_score')
+
+def segment_profiles(rfm, active_days: int = 30, segment_col: str = 'segment'):
+    """
+    One row per segment: customers, customers active within active_days,
+    revenue (monetary sum) and the mean of each RFM column. Small enough to
+    drive the KPI cards and profile tables without per-customer rows.
+    """
+    import numpy as np
+    import pandas as pd
+
+    cols = [c for c in PROFILE_COLUMNS if c in rfm.columns]
+    segments = rfm[segment_col].to_numpy(dtype=object)
+    # float64 so compact (float32/small-int) columns sum without overflow or drift
+    values = pd.DataFrame({c: rfm[c].to_numpy(dtype=np.float64) for c in cols})
+    grouped = values.groupby(segments, sort=True)
+    out = grouped.mean()
+    out.insert(0, 'customers', grouped.size())
+    out.insert(1, 'active_customers', (values['recency'] < active_days).groupby(segments, sort=True).sum())
+    out.insert(2, 'revenue', grouped['monetary'].sum())
+    out.index.name = segment_col
+    return out
+
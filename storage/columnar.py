@@ -0,0 +1,343 @@
+"""
+Columnar Transaction Store - CSV ingested once into typed, memory-mappable columns.
+
+Layout of a store directory:
+    CURRENT                   name of the live generation directory
+    g-<generation>/
+        meta.json             row count, column types, source CSV bookkeeping
+        customer_id.codes.bin     int32 dictionary codes
+        customer_id.categories.npy  dictionary (unicode array, or the ids' own dtype, e.g. int64)
+        date.bin              datetime64[ns] as int64
+        amount.bin            float32 (configurable)
+
+Column files are raw little-endian arrays that only ever grow; meta.json is
+replaced atomically after new rows are written, so readers mapping the
+first `nrows` rows never see a partial append. A full rebuild writes a new
+generation and flips CURRENT; the previous generation is kept until the
+next rebuild, so readers that already resolved it can finish. Writers
+(ingests from several uvicorn workers) take an flock on `<store_dir>.lock`
+for the whole update.
+"""
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+META_FILE = "meta.json"
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "g-"
+FORMAT_VERSION = 1
+
+try:
+    import fcntl
+
+    def _lock(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:  # Windows: single-writer assumption
+    def _lock(fd):
+        pass
+
+    def _unlock(fd):
+        pass
+
+
+@contextmanager
+def _store_lock(store_dir):
+    """Cross-process writer lock; next to the store, which a rebuild replaces."""
+    path = store_dir.rstrip("/\\") + ".lock"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _lock(fd)
+        try:
+            yield
+        finally:
+            _unlock(fd)
+    finally:
+        os.close(fd)
+
+
+def _tmp_path(path, suffix=".tmp"):
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}{suffix}"
+
+
+def _col_path(store_dir, name, suffix="bin"):
+    return os.path.join(store_dir, f"{name}.{suffix}")
+
+
+def _generation_dir(store_dir, generation):
+    return os.path.join(store_dir, GENERATION_PREFIX + generation)
+
+
+def _current_generation(store_dir):
+    """Generation CURRENT points at, or None (no store yet, or an older layout)."""
+    try:
+        with open(os.path.join(store_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_meta(store_dir):
+    """Returns the live generation's metadata dict, or None if there is no store."""
+    generation = _current_generation(store_dir)
+    if generation is None:
+        return None
+    try:
+        with open(os.path.join(_generation_dir(store_dir, generation), META_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_meta(store_dir, meta):
+    tmp = _tmp_path(os.path.join(store_dir, META_FILE))
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(store_dir, META_FILE))
+
+
+def _write_categories(store_dir, name, categories):
+    # Native dtype for numeric ids, so appended rows (parsed as ints again) still match
+    categories = pd.Index(categories.tolist())
+    if not categories.is_unique:
+        raise ValueError(f"Dictionary for {name!r} has duplicate ids; mixed id types in the source?")
+    if categories.dtype.kind == "O" or isinstance(categories.dtype, pd.StringDtype):
+        stored = np.asarray(categories.tolist(), dtype=str)
+    else:
+        stored = categories.to_numpy()
+    path = _col_path(store_dir, name, "categories.npy")
+    tmp = _tmp_path(path, ".tmp.npy")
+    np.save(tmp, stored)
+    os.replace(tmp, path)
+
+
+def _read_categories(store_dir, name) -> pd.Index:
+    stored = np.load(_col_path(store_dir, name, "categories.npy"))
+    if stored.dtype.kind == "U":
+        return pd.Index(stored.tolist(), dtype=object)
+    return pd.Index(stored)
+
+
+def _append_chunk(store_dir, chunk, meta, categories):
+    """Encodes one parsed chunk and appends it to the column files."""
+    for name, spec in meta["columns"].items():
+        values = chunk[name]
+        if spec["kind"] == "categorical":
+            ids = pd.Index(values.to_numpy())
+            codes = categories[name].get_indexer(ids)
+            unseen = codes < 0
+            if unseen.any():
+                new_ids = pd.Index(ids[unseen]).unique()
+                categories[name] = categories[name].append(new_ids)
+                codes[unseen] = categories[name].get_indexer(ids[unseen])
+            arr = codes.astype(spec["dtype"])
+            path = _col_path(store_dir, name, "codes.bin")
+        elif spec["kind"] == "datetime":
+            arr = pd.to_datetime(values).to_numpy(dtype="datetime64[ns]").view(np.int64)
+            path = _col_path(store_dir, name)
+        else:
+            arr = values.to_numpy(dtype=spec["dtype"])
+            path = _col_path(store_dir, name)
+
+        with open(path, "ab") as f:
+            f.write(np.ascontiguousarray(arr).tobytes())
+
+    meta["nrows"] += len(chunk)
+
+
+def _truncate_to_meta(store_dir, meta):
+    """
+    Drops bytes past nrows left behind by an append that never committed
+    meta.json. Runs under the store lock, so no append is in flight; readers
+    only map the first nrows rows, which stay put.
+    """
+    for name, spec in meta["columns"].items():
+        path = _col_path(store_dir, name, "codes.bin" if spec["kind"] == "categorical" else "bin")
+        expected = meta["nrows"] * np.dtype(spec["dtype"]).itemsize
+        if os.path.exists(path) and os.path.getsize(path) > expected:
+            os.truncate(path, expected)
+
+
+def _new_meta(customer_col, date_col, amount_col, amount_dtype, source_path):
+    return {
+        "version": FORMAT_VERSION,
+        "generation": uuid.uuid4().hex,
+        "nrows": 0,
+        "columns": {
+            customer_col: {"kind": "categorical", "dtype": "int32"},
+            date_col: {"kind": "datetime", "dtype": "int64"},
+            amount_col: {"kind": "numeric", "dtype": amount_dtype},
+        },
+        "source": {"path": source_path, "offset": 0, "prefix_hash": None, "names": None},
+    }
+
+
+def _fresh_build_dir(store_dir, generation):
+    """Hidden directory a new generation is written into (caller holds the store lock)."""
+    build_dir = os.path.join(store_dir, ".building-" + generation)
+    os.makedirs(build_dir)
+    return build_dir
+
+
+def _swap_in(build_dir, store_dir, generation):
+    """
+    Publishes a built generation: rename it into place, flip CURRENT, then
+    drop everything but it and the generation it replaces (readers may still
+    be mapping that one).
+    """
+    previous = _current_generation(store_dir)
+    os.replace(build_dir, _generation_dir(store_dir, generation))
+    tmp = _tmp_path(os.path.join(store_dir, CURRENT_FILE))
+    with open(tmp, "w") as f:
+        f.write(generation)
+    os.replace(tmp, os.path.join(store_dir, CURRENT_FILE))
+
+    keep = {CURRENT_FILE, GENERATION_PREFIX + generation}
+    if previous is not None:
+        keep.add(GENERATION_PREFIX + previous)
+    # Older generations, abandoned builds and files of the pre-generation layout
+    for entry in os.listdir(store_dir):
+        if entry in keep:
+            continue
+        path = os.path.join(store_dir, entry)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def build_store(chunks, store_dir,
+                customer_col="customer_id", date_col="date", amount_col="amount",
+                amount_dtype="float32"):
+    """
+    Writes a new store from an iterable of DataFrames (e.g. a data generator),
+    without going through CSV. The store has no source file, so ingest_csv
+    rebuilds it if pointed at a CSV later. Returns the store metadata.
+    """
+    with _store_lock(store_dir):
+        meta = _new_meta(customer_col, date_col, amount_col, amount_dtype, None)
+        target = _fresh_build_dir(store_dir, meta["generation"])
+        categories = {customer_col: pd.Index([], dtype=object)}
+        for chunk in chunks:
+            _append_chunk(target, chunk, meta, categories)
+        for name, cats in categories.items():
+            _write_categories(target, name, cats)
+        _write_meta(target, meta)
+        _swap_in(target, store_dir, meta["generation"])
+    return meta
+
+
+def ingest_csv(csv_path, store_dir,
+               customer_col="customer_id", date_col="date", amount_col="amount",
+               amount_dtype="float32", chunksize=1_000_000):
+    """
+    Brings the store in sync with an append-only CSV.
+
+    If the store already covers a prefix of the same file, only the bytes
+    appended since the last ingest are parsed; otherwise the store is
+    rebuilt from scratch. Returns the store metadata.
+    """
+    with _store_lock(store_dir):
+        return _ingest_locked(csv_path, store_dir, customer_col, date_col, amount_col,
+                              amount_dtype, chunksize)
+
+
+def _ingest_locked(csv_path, store_dir, customer_col, date_col, amount_col, amount_dtype, chunksize):
+    from features.rfm import file_prefix_hash, read_csv_delta
+
+    size = os.stat(csv_path).st_size
+    meta = read_meta(store_dir)
+
+    reusable = (
+        meta is not None
+        and meta.get("version") == FORMAT_VERSION
+        and meta["source"]["path"] == str(csv_path)
+        and size >= meta["source"]["offset"]
+        and file_prefix_hash(csv_path, meta["source"]["offset"]) == meta["source"]["prefix_hash"]
+    )
+
+    if not reusable:
+        # Full rebuild into a new generation, then swap it in
+        meta = _new_meta(customer_col, date_col, amount_col, amount_dtype, str(csv_path))
+        target = _fresh_build_dir(store_dir, meta["generation"])
+        categories = {customer_col: pd.Index([], dtype=object)}
+        rebuilt = True
+    else:
+        # Append to the live generation in place
+        target = _generation_dir(store_dir, meta["generation"])
+        categories = {
+            name: _read_categories(target, name)
+            for name, spec in meta["columns"].items() if spec["kind"] == "categorical"
+        }
+        _truncate_to_meta(target, meta)
+        rebuilt = False
+
+    offset = meta["source"]["offset"]
+    names = meta["source"]["names"]
+    if offset < size:
+        # Bounded to the size seen above; complete lines only, streamed in chunks
+        chunks, new_offset = read_csv_delta(csv_path, offset, size, names=names, chunksize=chunksize)
+        for chunk in chunks:
+            if names is None:
+                names = list(chunk.columns)
+            _append_chunk(target, chunk, meta, categories)
+        offset = new_offset
+
+    for name, cats in categories.items():
+        _write_categories(target, name, cats)
+    meta["source"].update(
+        offset=offset,
+        names=names,
+        prefix_hash=file_prefix_hash(csv_path, offset),
+    )
+    _write_meta(target, meta)
+
+    if rebuilt:
+        _swap_in(target, store_dir, meta["generation"])
+    return meta
+
+
+def load_transactions(store_dir, columns=None, mmap=True, meta=None) -> pd.DataFrame:
+    """
+    Loads the store as a DataFrame (categorical ids, datetime64 dates,
+    typed amounts). Only the requested columns are touched; with mmap=True
+    numeric columns are zero-copy views over the files.
+    """
+    meta = meta or read_meta(store_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No columnar store at {store_dir}")
+    # The generation the metadata belongs to, even if a rebuild has flipped CURRENT since
+    store_dir = _generation_dir(store_dir, meta["generation"])
+
+    n = meta["nrows"]
+    mode = "r" if mmap else None
+    out = {}
+    for name, spec in meta["columns"].items():
+        if columns is not None and name not in columns:
+            continue
+        if spec["kind"] == "categorical":
+            codes = _read_column(_col_path(store_dir, name, "codes.bin"), spec["dtype"], n, mode)
+            out[name] = pd.Categorical.from_codes(codes, categories=_read_categories(store_dir, name))
+        elif spec["kind"] == "datetime":
+            raw = _read_column(_col_path(store_dir, name), "int64", n, mode)
+            out[name] = raw.view("datetime64[ns]")
+        else:
+            out[name] = _read_column(_col_path(store_dir, name), spec["dtype"], n, mode)
+
+    return pd.DataFrame(out, copy=False)
+
+
+def _read_column(path, dtype, n, mode):
+    if n == 0:
+        return np.empty(0, dtype=dtype)
+    if mode is None:
+        return np.fromfile(path, dtype=dtype, count=n)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=(n,))
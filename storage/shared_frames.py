@@ -0,0 +1,224 @@
+"""
+Shared Frame Cache - pipeline frames published once as memory-mapped columns.
+
+Each uvicorn worker and the Streamlit process would otherwise hold a private
+copy of the transactions and RFM tables. One process builds and publishes
+them here; every process (the builder included) then attaches to the files
+with np.load(mmap_mode='r'), so the OS page cache holds a single copy.
+
+Layout of the cache directory:
+    CURRENT                     {"version": 7, "dir": "v000007-..."}, replaced atomically
+    build.lock                  flock held by the process building a new version
+    v000007-.../meta.json       format version, input key, column specs, extra info
+    v000007-.../<frame>.<col>.npy             values (numbers, datetimes, codes)
+    v000007-.../<frame>.<col>.categories.npy  dictionary of a categorical column
+
+A version directory is complete before CURRENT points at it and is never
+modified afterwards. The previous version is kept for readers still moving
+over; older ones are deleted (mappings that are still open stay valid on
+POSIX). String columns and indexes come back as categoricals.
+"""
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "build.lock"
+META_FILE = "meta.json"
+FORMAT_VERSION = 1
+INDEX = "__index__"
+
+try:
+    import fcntl
+
+    def _lock(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:  # Windows: no cross-process exclusion, builds may repeat
+    def _lock(fd):
+        pass
+
+    def _unlock(fd):
+        pass
+
+
+def _save_column(version_dir, stem, values) -> dict:
+    """Writes one column (or index) and returns its spec for meta.json."""
+    if isinstance(values, pd.RangeIndex) and values.start == 0 and values.step == 1:
+        return {"kind": "range", "name": values.name}
+
+    name = getattr(values, "name", None)
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        cat = pd.Categorical(values)
+    elif dtype.kind == "O" or isinstance(dtype, pd.StringDtype):
+        codes, categories = pd.factorize(np.asarray(values, dtype=object))
+        cat = pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object))
+    else:
+        arr = np.asarray(values)
+        if arr.dtype.kind == "O":
+            raise TypeError(f"Cannot share column {stem!r} of dtype {dtype}")
+        np.save(os.path.join(version_dir, stem + ".npy"), arr)
+        return {"kind": "array", "name": name}
+
+    categories = cat.categories
+    if categories.dtype.kind == "O" or isinstance(categories.dtype, pd.StringDtype):
+        stored = np.asarray(categories.tolist(), dtype=str)
+    else:
+        stored = categories.to_numpy()
+    # Codes in the width pandas picks for this many categories, so loading maps them as is
+    np.save(os.path.join(version_dir, stem + ".npy"), cat.codes)
+    np.save(os.path.join(version_dir, stem + ".categories.npy"), stored)
+    return {"kind": "categorical", "name": name}
+
+
+def _map(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:  # zero-length arrays can't be mapped
+        return np.load(path)
+
+
+def _load_column(version_dir, stem, spec, nrows):
+    if spec["kind"] == "range":
+        return pd.RangeIndex(nrows, name=spec["name"])
+    values = _map(os.path.join(version_dir, stem + ".npy"))
+    if spec["kind"] == "array":
+        return values
+    categories = np.load(os.path.join(version_dir, stem + ".categories.npy"))
+    if categories.dtype.kind == "U":
+        categories = pd.Index(categories.tolist(), dtype=object)
+    return pd.Categorical.from_codes(values, categories=categories)
+
+
+class SharedFrameCache:
+    def __init__(self, cache_dir, keep: int = 2):
+        self.cache_dir = cache_dir
+        self.keep = max(int(keep), 1)
+        self._attached = None  # (version dir, frames, meta) last attached in this process
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # --- Writing ---
+    @contextmanager
+    def build_lock(self):
+        """Cross-process lock around build + publish, so a version is computed once."""
+        fd = os.open(os.path.join(self.cache_dir, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            _lock(fd)
+            try:
+                yield
+            finally:
+                _unlock(fd)
+        finally:
+            os.close(fd)
+
+    def publish(self, frames: dict, key=None, info=None) -> int:
+        """
+        Writes {name: DataFrame} as a new version and points CURRENT at it.
+        Call under build_lock(). Returns the new version number.
+        """
+        current = self.current()
+        version = (current["version"] if current else 0) + 1
+        dirname = f"v{version:06d}-{uuid.uuid4().hex[:8]}"
+        build_dir = os.path.join(self.cache_dir, "." + dirname)
+        os.makedirs(build_dir)
+
+        meta = {
+            "format": FORMAT_VERSION,
+            "version": version,
+            "key": list(key) if key is not None else None,
+            "info": info or {},
+            "frames": {},
+        }
+        for name, frame in frames.items():
+            meta["frames"][name] = {
+                "nrows": int(len(frame)),
+                "index": _save_column(build_dir, f"{name}.{INDEX}", frame.index),
+                "columns": {col: _save_column(build_dir, f"{name}.{i}", frame[col])
+                            for i, col in enumerate(frame.columns)},
+            }
+        with open(os.path.join(build_dir, META_FILE), "w") as f:
+            json.dump(meta, f, default=str)
+
+        os.replace(build_dir, os.path.join(self.cache_dir, dirname))
+        tmp = os.path.join(self.cache_dir, CURRENT_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": version, "dir": dirname}, f)
+        os.replace(tmp, os.path.join(self.cache_dir, CURRENT_FILE))
+        self._prune(dirname)
+        return version
+
+    def _prune(self, newest):
+        versions = sorted(d for d in os.listdir(self.cache_dir) if d.startswith("v") and d != newest)
+        keep = set(versions[-(self.keep - 1):]) if self.keep > 1 else set()
+        for d in os.listdir(self.cache_dir):
+            if d == newest or d in keep or d in (CURRENT_FILE, LOCK_FILE):
+                continue
+            path = os.path.join(self.cache_dir, d)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)  # leftovers of crashed builds too
+
+    # --- Reading ---
+    def current(self):
+        """{"version", "dir"} of the published version, or None."""
+        try:
+            with open(os.path.join(self.cache_dir, CURRENT_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def attach(self, key=None):
+        """
+        (frames, info) of the current version, mapped read-only; None if
+        nothing is published or it was built from inputs other than `key`.
+        """
+        for _ in range(3):
+            current = self.current()
+            if current is None:
+                return None
+            attached = self._attached
+            if attached is not None and attached[0] == current["dir"]:
+                frames, meta = attached[1], attached[2]
+            else:
+                try:
+                    frames, meta = self._load(current["dir"])
+                except FileNotFoundError:
+                    continue  # pruned between reading CURRENT and opening it; reread
+                self._attached = (current["dir"], frames, meta)
+            if key is not None and (meta["key"] is None or tuple(meta["key"]) != tuple(key)):
+                return None
+            return frames, dict(meta["info"], version=meta["version"])
+        return None
+
+    def _load(self, dirname):
+        version_dir = os.path.join(self.cache_dir, dirname)
+        with open(os.path.join(version_dir, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise FileNotFoundError(f"Unsupported shared cache format in {version_dir}")
+
+        frames = {}
+        for name, spec in meta["frames"].items():
+            n = spec["nrows"]
+            index = _load_column(version_dir, f"{name}.{INDEX}", spec["index"], n)
+            if not isinstance(index, pd.Index):
+                index = pd.Index(index, name=spec["index"]["name"], copy=False)
+            columns = {col: _load_column(version_dir, f"{name}.{i}", col_spec, n)
+                       for i, (col, col_spec) in enumerate(spec["columns"].items())}
+            frames[name] = pd.DataFrame(columns, index=index, copy=False)
+        return frames, meta
+
+    def stats(self) -> dict:
+        current = self.current()
+        return {
+            "dir": self.cache_dir,
+            "version": current["version"] if current else None,
+            "attached": self._attached[0] if self._attached else None,
+        }